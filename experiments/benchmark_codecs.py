@@ -0,0 +1,53 @@
+import argparse
+import json
+import time
+
+from agno.media import Image
+
+from mas.message import Message
+from mas.storage.codec import JsonCodec, MsgpackCodec, OrjsonCodec, decode
+
+'''
+encode + decode of node outputs, as persisted storages do for every entry and node record:
+json is the encoding storages used before codecs (pydantic json dump, no binary media)
+'''
+
+def make_data(i: int, image: bool) -> dict:
+    message = Message(role="assistant", content=f"output {i} " * 200, images=[Image(content=bytes(range(256)) * 400)] if image else None)
+    return {"caller_user_prompt": f"prompt {i}", "caller_output_message": message}
+
+def legacy_dumps(data: dict) -> str:
+    return json.dumps(data, default=lambda m: {"__message__": m.model_dump(mode="json", exclude_none=True)})
+
+def rate(n: int, seconds: float) -> str:
+    return f"{n} in {seconds:.2f}s, {n / seconds:,.0f}/s"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=20_000)
+    parser.add_argument("--images", action="store_true", help="every message carries a 100KB image, the old json encoding can't store it")
+    args = parser.parse_args()
+
+    entries = [make_data(i, args.images) for i in range(args.entries)]
+    if not args.images:
+        start = time.perf_counter()
+        for data in entries:
+            json.loads(legacy_dumps(data))
+        print(f"json (before codecs): {rate(len(entries), time.perf_counter() - start)}")
+
+    codecs = [MsgpackCodec(), JsonCodec()]
+    try:
+        codecs.append(OrjsonCodec())
+    except ImportError:
+        print("orjson not installed, skipping OrjsonCodec")
+    for codec in codecs:
+        start = time.perf_counter()
+        size = 0
+        for data in entries:
+            encoded = codec.encode(data)
+            size += len(encoded)
+            decode(encoded)
+        print(f"{type(codec).__name__}: {rate(len(entries), time.perf_counter() - start)}, {size / len(entries):,.0f} bytes/entry")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from mas.message import Message
+from mas.storage.sqlite import SqliteStorage
+
+'''
+SqliteStorage throughput on a large entry table:
+1. bulk writes, batch_size entries per transaction, as a node with that many successors writes them
+2. single writes, one transaction per add_entry
+3. indexed lookups: get_entry and get_entries_by_callee on random node ids
+'''
+
+RUN_ID = "benchmark"
+
+def make_entry(i: int, n_nodes: int) -> dict:
+    return {
+        "run_id": RUN_ID,
+        "caller": i % n_nodes,
+        "callee": (i * 7 + 1) % n_nodes,
+        "action": "default",
+        "data": {"caller_user_prompt": f"prompt {i}", "caller_output_message": Message(role="assistant", content=f"output {i} " * 20)},
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+
+def rate(n: int, seconds: float) -> str:
+    return f"{n} in {seconds:.2f}s, {n / seconds:,.0f}/s"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--single-entries", type=int, default=5_000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--nodes", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=10_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = SqliteStorage(db_file=f"{tmp_dir}/benchmark.db")
+        entries = [make_entry(i, args.nodes) for i in range(args.entries)]
+
+        start = time.perf_counter()
+        for i in range(0, len(entries), args.batch_size):
+            storage.add_entries(entries[i:i + args.batch_size])
+        print(f"add_entries (batch {args.batch_size}): {rate(len(entries), time.perf_counter() - start)}")
+
+        start = time.perf_counter()
+        for i in range(args.single_entries):
+            storage.add_entry(make_entry(args.entries + i, args.nodes))
+        print(f"add_entry: {rate(args.single_entries, time.perf_counter() - start)}")
+
+        keys = [(e["caller"], e["callee"]) for e in random.sample(entries, args.lookups)]
+        start = time.perf_counter()
+        for caller, callee in keys:
+            assert storage.get_entry(RUN_ID, caller, callee, "default") is not None
+        print(f"get_entry: {rate(args.lookups, time.perf_counter() - start)}")
+
+        start = time.perf_counter()
+        for _, callee in keys:
+            storage.get_entries_by_callee(RUN_ID, callee)
+        print(f"get_entries_by_callee: {rate(args.lookups, time.perf_counter() - start)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,109 @@
 
+import threading
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Sequence, Union
+from typing import AsyncIterator, Dict, Hashable, Iterator, List, Optional, Sequence, Union
 
 import agno.agent as agno_agent
+from agno.run.response import RunEvent
 
 from mas.agent.base import Agent
+from mas.agent.cache import AgentCache
 from mas.message import Message
+from mas.message.media import materialize_media
 from mas.graph.types import NodeAttr, NodeId
 
 @dataclass
 class AgnoAgent(Agent):
+    _profile_last = False  # see set_profile_last
+    _settle_lock = threading.Lock()
+    _agent_cache = AgentCache()  # see set_agent_cache, not a dataclass field
+
+    @classmethod
+    def set_profile_last(cls, profile_last: bool):
+        '''
+        send the profile as a system message right before the node prompt instead of first,
+        so requests start with the upstream context and sibling nodes with different profiles share a provider prompt cache prefix
+        '''
+        cls._profile_last = profile_last
+
+    @classmethod
+    def set_agent_cache(cls, agent_cache: Optional[AgentCache]):
+        ''' None gives every node its own agno agent, built with the node and kept for its calls '''
+        cls._agent_cache = agent_cache
+
+    @classmethod
+    def get_agent_cache(cls) -> Optional[AgentCache]:
+        return cls._agent_cache
+
     def __init__(self, id, node_attr: NodeAttr):
         super().__init__(id)
-        self.agent = agno_agent.Agent(
-            agent_id=str(id),
-            name=node_attr.name,
-            description=node_attr.profile,
-            model=self.to_model(node_attr.model),
-            tools=self.to_tools(node_attr.tools),
+        self.node_attr = node_attr
+        # with a cache, agno agents are only leased for each call, so building nodes is cheap
+        self.agent = self.build_agno_agent(node_attr.model) if self._agent_cache is None else None
+
+    def build_agno_agent(self, model: str) -> agno_agent.Agent:
+        return agno_agent.Agent(
+            agent_id=str(self.id),
+            name=self.node_attr.name,
+            description=None if self._profile_last else self.node_attr.profile,
+            model=self.to_model(model),
+            tools=self.to_tools(self.node_attr.tools),
             # introduction=node_attr.profile,
             # add_history_to_messages=True,
             # num_history_responses=3,
         )
 
+    def cache_key(self, model: str) -> Hashable:
+        ''' everything build_agno_agent depends on, but the node's id and name, which are set on each lease '''
+        return (model, tuple(sorted(self.node_attr.tools or [])), self.node_attr.profile, self._profile_last)
+
+    @contextmanager
+    def lease(self, model: str, attempt: int = 0, settled: Optional[threading.Event] = None) -> Iterator[agno_agent.Agent]:
+        '''
+        an agno agent for one call on model: from the cache, or without one the node's own agent for the original call,
+        a fresh one for each hedge, agno agents keep per-run state
+        settled: shared by the attempts of a hedged call, set by the first to finish, the later ones lost and are dropped
+        '''
+        cache = self._agent_cache
+        if cache is None:
+            yield self.agent if attempt == 0 else self.build_agno_agent(model)
+            return
+        key = self.cache_key(model)
+        agent = cache.acquire(key, lambda: self.build_agno_agent(model))
+        agent.agent_id, agent.name = str(self.id), self.node_attr.name
+        # an exception, e.g. a failed or cancelled call, leaves here and the agent is dropped
+        yield agent
+        if settled is not None:
+            with self._settle_lock:
+                lost = settled.is_set()
+                settled.set()
+            if lost:
+                # a sync hedge that ran on after the winner was returned, abandoned
+                return
+        cache.release(key, agent)
+
     def to_agno_message(self, m: Union[Dict, Message]) -> agno_agent.Message:
         return agno_agent.Message(
             role=m.role,
             content=m.content[0] if isinstance(m.content, list) else m.content,
             tool_calls=m.tool_calls, 
-            audio=m.audios, # agno use audio not audios
-            images=m.images, 
-            videos=m.videos, 
-            files=m.files
+            # references FlowNode left unloaded, e.g. the agent is called directly
+            audio=materialize_media(m.audios), # agno use audio not audios
+            images=materialize_media(m.images), 
+            videos=materialize_media(m.videos), 
+            files=materialize_media(m.files)
         )
     
     def from_agno_message(self, m: Union[Dict, agno_agent.Message]) -> Message:
+        metrics = m.metrics
+        usage = None
+        if metrics.input_tokens:
+            usage = {
+                "input_tokens": metrics.input_tokens,
+                "output_tokens": metrics.output_tokens,
+                "cached_tokens": (metrics.prompt_tokens_details or {}).get("cached_tokens", 0),
+            }
         return Message(
             role=m.role,
             content=m.content,
@@ -42,17 +111,61 @@ class AgnoAgent(Agent):
             audios=m.audio, # agno use audio not audios
             images=m.images, 
             videos=m.videos, 
-            files=m.files
+            files=m.files,
+            usage=usage,
             # Other fields remain the same
         )
     
     def to_agno_messages(self, messages: Sequence[Union[Dict, Message]]) -> Sequence[Union[Dict, agno_agent.Message]]:
-        return [self.to_agno_message(m) for m in messages]
+        agno_messages = [self.to_agno_message(m) for m in messages]
+        if self._profile_last and self.node_attr.profile and agno_messages:
+            agno_messages.insert(len(agno_messages) - 1, agno_agent.Message(role="system", content=self.node_attr.profile))
+        return agno_messages
     
     def from_agno_messages(self, messages: Sequence[Union[Dict, agno_agent.Message]]) -> Sequence[Union[Dict, Message]]:
         return [self.from_agno_message(m) for m in messages]
     
     def run_messages(self, messages: Sequence[Union[Dict, Message]]) -> Message:
-        response: agno_agent.RunResponse = self.agent.run(messages=self.to_agno_messages(messages))
+        hedging_policy = self.get_hedging_policy()
+        if hedging_policy is not None:
+            # threads can't be cancelled, losing attempts run to the end, settled tells them they lost
+            settled = threading.Event()
+            return hedging_policy.run(self.node_attr.model, lambda model, attempt: self.run_messages_with(model, attempt, messages, settled))
+        return self.run_messages_with(self.node_attr.model, 0, messages)
+
+    async def arun_messages(self, messages: Sequence[Union[Dict, Message]]) -> Message:
+        hedging_policy = self.get_hedging_policy()
+        if hedging_policy is not None:
+            return await hedging_policy.arun(self.node_attr.model, lambda model, attempt: self.arun_messages_with(model, attempt, messages))
+        return await self.arun_messages_with(self.node_attr.model, 0, messages)
+
+    def run_messages_with(self, model: str, attempt: int, messages: Sequence[Union[Dict, Message]], settled: Optional[threading.Event] = None) -> Message:
+        with self.lease(model, attempt, settled) as agent:
+            return self.run_messages_on(agent, messages)
+
+    async def arun_messages_with(self, model: str, attempt: int, messages: Sequence[Union[Dict, Message]]) -> Message:
+        with self.lease(model, attempt) as agent:
+            return await self.arun_messages_on(agent, messages)
+
+    def run_messages_on(self, agent: agno_agent.Agent, messages: Sequence[Union[Dict, Message]]) -> Message:
+        response: agno_agent.RunResponse = agent.run(messages=self.to_agno_messages(messages))
+        return self.from_agno_messages(response.messages)[-1]
+
+    async def arun_messages_on(self, agent: agno_agent.Agent, messages: Sequence[Union[Dict, Message]]) -> Message:
+        response: agno_agent.RunResponse = await agent.arun(messages=self.to_agno_messages(messages))
         return self.from_agno_messages(response.messages)[-1]
 
+    def run_messages_stream(self, messages: Sequence[Union[Dict, Message]]) -> Iterator[Union[str, Message]]:
+        with self.lease(self.node_attr.model) as agent:
+            for chunk in agent.run(messages=self.to_agno_messages(messages), stream=True):
+                if chunk.event == RunEvent.run_response.value and isinstance(chunk.content, str):
+                    yield chunk.content
+            # the agent keeps the aggregated response of the finished run
+            yield self.from_agno_messages(agent.run_response.messages)[-1]
+
+    async def arun_messages_stream(self, messages: Sequence[Union[Dict, Message]]) -> AsyncIterator[Union[str, Message]]:
+        with self.lease(self.node_attr.model) as agent:
+            async for chunk in await agent.arun(messages=self.to_agno_messages(messages), stream=True):
+                if chunk.event == RunEvent.run_response.value and isinstance(chunk.content, str):
+                    yield chunk.content
+            yield self.from_agno_messages(agent.run_response.messages)[-1]
@@ -1,6 +1,7 @@
+import asyncio
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import List, Dict, Sequence, Optional, Union
+from typing import AsyncIterator, Iterator, List, Dict, Sequence, Optional, Union
 from agno.models.base import Model
 from agno.tools import Toolkit
 
@@ -16,6 +17,7 @@ class Agent(ABC):
     id: NodeId
     _model_pool = None  # Class variable, shared across subclasses
     _tool_pool = None  # Class variable, shared across subclasses
+    _hedging_policy = None  # opt-in, see mas.agent.hedging
 
     @classmethod
     def set_model_pool(cls, model_pool):
@@ -25,6 +27,14 @@ class Agent(ABC):
     def set_tool_pool(cls, tool_pool):
         cls._tool_pool = tool_pool
 
+    @classmethod
+    def set_hedging_policy(cls, hedging_policy):
+        cls._hedging_policy = hedging_policy
+
+    @classmethod
+    def get_hedging_policy(cls):
+        return cls._hedging_policy
+
     @classmethod
     def get_model_pool(cls):
         if cls._model_pool is None:
@@ -50,6 +60,17 @@ class Agent(ABC):
     @abstractmethod
     def run_messages(self, messages: Sequence[Union[Dict, Message]]) -> Message:
         raise NotImplementedError
+
+    async def arun_messages(self, messages: Sequence[Union[Dict, Message]]) -> Message:
+        ''' fallback for agents without a native async api: run the blocking call in a worker thread '''
+        return await asyncio.to_thread(self.run_messages, messages)
+
+    def run_messages_stream(self, messages: Sequence[Union[Dict, Message]]) -> Iterator[Union[str, Message]]:
+        ''' yield text deltas as they arrive, then the complete response Message last; non-streaming agents yield only the Message '''
+        yield self.run_messages(messages)
+
+    async def arun_messages_stream(self, messages: Sequence[Union[Dict, Message]]) -> AsyncIterator[Union[str, Message]]:
+        yield await self.arun_messages(messages)
     
     def run(
         self,
@@ -70,3 +91,45 @@ class Agent(ABC):
             messages.append(message)
 
         return self.run_messages(messages=messages)
+
+    async def arun(
+        self,
+        message: Optional[Union[str, List, Dict, Message]] = None,
+        *,
+        messages: Optional[Sequence[Union[Dict, Message]]] = None,
+    ) -> Message:
+        messages = list(messages) if messages is not None else []
+
+        # append message
+        if message is not None:
+            messages.append(message)
+
+        return await self.arun_messages(messages=messages)
+
+    def run_stream(
+        self,
+        message: Optional[Union[str, List, Dict, Message]] = None,
+        *,
+        messages: Optional[Sequence[Union[Dict, Message]]] = None,
+    ) -> Iterator[Union[str, Message]]:
+        messages = list(messages) if messages is not None else []
+
+        # append message
+        if message is not None:
+            messages.append(message)
+
+        return self.run_messages_stream(messages=messages)
+
+    def arun_stream(
+        self,
+        message: Optional[Union[str, List, Dict, Message]] = None,
+        *,
+        messages: Optional[Sequence[Union[Dict, Message]]] = None,
+    ) -> AsyncIterator[Union[str, Message]]:
+        messages = list(messages) if messages is not None else []
+
+        # append message
+        if message is not None:
+            messages.append(message)
+
+        return self.arun_messages_stream(messages=messages)
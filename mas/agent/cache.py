@@ -0,0 +1,79 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional
+
+import agno.agent as agno_agent
+
+logger = logging.getLogger(__name__)
+
+'''
+AgentCache: idle agno agents, with their model client and toolkits, reused across nodes and runs
+1. agents are keyed by what their construction depends on, e.g. (model, tool set, profile), nodes with the same key share them
+2. an agent is leased to one call at a time, concurrent calls on a key get different agents, a new one is built when none is idle
+3. a returned agent's per-run state (memory, run and session ids, media) is reset, an agent whose call failed or lost a hedge is dropped instead
+4. at most max_size agents are kept idle, the least recently used keys are evicted first
+'''
+class AgentCache:
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self.idle: "OrderedDict[Hashable, List[agno_agent.Agent]]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, key: Hashable, build: Callable[[], agno_agent.Agent]) -> agno_agent.Agent:
+        with self.lock:
+            agents = self.idle.get(key)
+            if agents:
+                self.idle.move_to_end(key)
+                self.size -= 1
+                self.hits += 1
+                agent = agents.pop()
+                if not agents:
+                    del self.idle[key]
+                return agent
+            self.misses += 1
+        return build()
+
+    def release(self, key: Hashable, agent: agno_agent.Agent) -> None:
+        self.reset(agent)
+        with self.lock:
+            self.idle.setdefault(key, []).append(agent)
+            self.idle.move_to_end(key)
+            self.size += 1
+            while self.size > self.max_size:
+                oldest = next(iter(self.idle))
+                self.idle[oldest].pop(0)
+                self.size -= 1
+                if not self.idle[oldest]:
+                    del self.idle[oldest]
+
+    @staticmethod
+    def reset(agent: agno_agent.Agent) -> None:
+        ''' forget everything the last run left, so the next lease starts like a freshly built agent '''
+        if agent.memory is not None:
+            agent.memory.clear()
+        agent.run_id = None
+        agent.run_input = None
+        agent.run_response = None
+        agent.session_id = None
+        agent.session_state = None
+        agent.session_metrics = None
+        agent.agent_session = None
+        agent.images = None
+        agent.videos = None
+        agent.audio = None
+        if agent.model is not None:
+            agent.model._function_call_stack = None
+
+    def clear(self) -> None:
+        with self.lock:
+            self.idle.clear()
+            self.size = 0
+
+    def hit_rate(self) -> Optional[float]:
+        with self.lock:
+            total = self.hits + self.misses
+            return self.hits / total if total else None
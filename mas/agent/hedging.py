@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class LatencyTracker:
+    ''' latencies of the recent successful calls, per model '''
+
+    def __init__(self, window: int = 100):
+        self.window = window
+        self.samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.window))
+        self.lock = threading.Lock()
+
+    def record(self, model: str, seconds: float) -> None:
+        with self.lock:
+            self.samples[model].append(seconds)
+
+    def count(self, model: str) -> int:
+        with self.lock:
+            return len(self.samples[model])
+
+    def percentile(self, model: str, q: float) -> Optional[float]:
+        with self.lock:
+            samples = sorted(self.samples[model])
+        if not samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+'''
+Hedging:
+1. every call records its latency per model, once min_samples are known the hedge delay is the `percentile` latency
+2. a call still running after the hedge delay gets one duplicate, on the next alternate model of the pool (or the same model)
+3. the first response wins, the loser is cancelled (async) or abandoned (threads can't be killed)
+4. hedges per model are capped at `budget` times its calls, so they add at most that fraction of extra cost
+5. a call that fails is retried on an alternate at once (failover), this is not counted against the budget
+Sync calls that can't be hedged (too few samples, no budget left) run inline on the caller's thread,
+only hedgeable ones go to the worker pool, and no call is hedged while max_abandoned losers still hold workers
+'''
+@dataclass
+class HedgingPolicy:
+    percentile: float = 0.95
+    min_samples: int = 20
+    budget: float = 0.05
+    model_budgets: Dict[str, float] = field(default_factory=dict)
+    alternates: Dict[str, List[str]] = field(default_factory=dict)  # equivalent ModelPool names per model
+    tracker: LatencyTracker = field(default_factory=LatencyTracker)
+    max_workers: int = 16
+    max_abandoned: int = 4  # sync losers still running
+    calls: Counter = field(default_factory=Counter, init=False)
+    hedges: Counter = field(default_factory=Counter, init=False)
+
+    def __post_init__(self):
+        self.lock = threading.Lock()
+        self.pool: Optional[ThreadPoolExecutor] = None
+        self.abandoned = 0
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        ''' None while too few latencies are known to tell a slow call '''
+        if self.tracker.count(model) < self.min_samples:
+            return None
+        return self.tracker.percentile(model, self.percentile)
+
+    def can_hedge(self, model: str) -> bool:
+        with self.lock:
+            return self.abandoned < self.max_abandoned and self.hedges[model] + 1 <= self.model_budgets.get(model, self.budget) * self.calls[model]
+
+    def acquire_hedge(self, model: str) -> bool:
+        with self.lock:
+            if self.hedges[model] + 1 > self.model_budgets.get(model, self.budget) * self.calls[model]:
+                return False
+            self.hedges[model] += 1
+            return True
+
+    def alternate(self, model: str, attempt: int) -> str:
+        alternates = self.alternates.get(model)
+        return alternates[(attempt - 1) % len(alternates)] if alternates else model
+
+    def timed(self, model: str, attempt: int, call: Callable[[str, int], T]) -> Callable[[], T]:
+        def run() -> T:
+            start = time.monotonic()
+            result = call(model, attempt)
+            self.tracker.record(model, time.monotonic() - start)
+            return result
+        return run
+
+    def run(self, model: str, call: Callable[[str, int], T]) -> T:
+        ''' call(model_name, attempt), hedged on worker threads and failed over as above, attempt 0 is the original call '''
+        with self.lock:
+            self.calls[model] += 1
+        delay = self.hedge_delay(model)
+        if delay is None or not self.can_hedge(model):
+            return self.run_inline(model, call)
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedge")
+
+        attempts = 1
+        running: Dict[Future, str] = {self.pool.submit(self.timed(model, 0, call)): model}
+        hedged = False
+        error: Optional[BaseException] = None
+        while running:
+            timeout = delay if not hedged and delay is not None else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                if self.acquire_hedge(model):
+                    alt = self.alternate(model, attempts)
+                    logger.info(f"HedgingPolicy: {model} call slower than {delay:.2f}s, hedging on {alt}")
+                    running[self.pool.submit(self.timed(alt, attempts, call))] = alt
+                    attempts += 1
+                continue
+            for future in done:
+                running.pop(future)
+                if future.exception() is None:
+                    for loser in running:
+                        self.abandon(loser)
+                    return future.result()
+                error = future.exception()
+                logger.warning(f"HedgingPolicy: {model} call failed with {error!r}")
+            if not running and attempts < 2:
+                alt = self.alternate(model, attempts)
+                logger.info(f"HedgingPolicy: failing over to {alt}")
+                running[self.pool.submit(self.timed(alt, attempts, call))] = alt
+                attempts += 1
+                hedged = True
+        raise error
+
+    def run_inline(self, model: str, call: Callable[[str, int], T]) -> T:
+        ''' the unhedged call on the caller's thread, failed over once '''
+        try:
+            return self.timed(model, 0, call)()
+        except Exception as error:
+            logger.warning(f"HedgingPolicy: {model} call failed with {error!r}")
+        alt = self.alternate(model, 1)
+        logger.info(f"HedgingPolicy: failing over to {alt}")
+        return self.timed(alt, 1, call)()
+
+    def abandon(self, loser: Future) -> None:
+        ''' cancel a losing call not started yet, count a running one until it ends '''
+        if loser.cancel():
+            return
+        with self.lock:
+            self.abandoned += 1
+        loser.add_done_callback(self.loser_done)
+
+    def loser_done(self, loser: Future) -> None:
+        with self.lock:
+            self.abandoned -= 1
+
+    def close(self) -> None:
+        ''' shut the worker pool down, queued calls are cancelled, running losers end on their own '''
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def arun(self, model: str, call: Callable[[str, int], Awaitable[T]]) -> T:
+        ''' async counterpart of run, losing calls are cancelled '''
+        with self.lock:
+            self.calls[model] += 1
+        delay = self.hedge_delay(model)
+
+        async def timed(model: str, attempt: int) -> T:
+            start = time.monotonic()
+            result = await call(model, attempt)
+            self.tracker.record(model, time.monotonic() - start)
+            return result
+
+        attempts = 1
+        running: Dict[asyncio.Task, str] = {asyncio.create_task(timed(model, 0)): model}
+        hedged = False
+        error: Optional[BaseException] = None
+        try:
+            while running:
+                timeout = delay if not hedged and delay is not None else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if self.acquire_hedge(model):
+                        alt = self.alternate(model, attempts)
+                        logger.info(f"HedgingPolicy: {model} call slower than {delay:.2f}s, hedging on {alt}")
+                        running[asyncio.create_task(timed(alt, attempts))] = alt
+                        attempts += 1
+                    continue
+                for task in done:
+                    running.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    logger.warning(f"HedgingPolicy: {model} call failed with {error!r}")
+                if not running and attempts < 2:
+                    alt = self.alternate(model, attempts)
+                    logger.info(f"HedgingPolicy: failing over to {alt}")
+                    running[asyncio.create_task(timed(alt, attempts))] = alt
+                    attempts += 1
+                    hedged = True
+            raise error
+        finally:
+            for task in running:
+                task.cancel()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import List
+import re
+from typing import AsyncIterator, Iterator, List, Union
 from mas.graph import NodeAttr
 from mas.agent import Agent, Message
 
@@ -17,4 +18,16 @@ class MockAgent(Agent):
         self.tools = node_attr.tools
 
     def run_messages(self, messages: List[Message]) -> Message:
-        return Message(role="assistant", content=f"Hello, I am Agent[id={self.id}]), I received your request: {messages}")
\ No newline at end of file
+        return Message(role="assistant", content=f"Hello, I am Agent[id={self.id}]), I received your request: {messages}")
+
+    async def arun_messages(self, messages: List[Message]) -> Message:
+        return self.run_messages(messages)
+
+    def run_messages_stream(self, messages: List[Message]) -> Iterator[Union[str, Message]]:
+        response = self.run_messages(messages)
+        yield from re.findall(r"\S+\s*", response.content)
+        yield response
+
+    async def arun_messages_stream(self, messages: List[Message]) -> AsyncIterator[Union[str, Message]]:
+        for chunk in self.run_messages_stream(messages):
+            yield chunk
@@ -0,0 +1,8 @@
+class FlowError(Exception):
+    pass
+
+class FlowCancelledError(FlowError):
+    pass
+
+class FlowTimeoutError(FlowError):
+    pass
@@ -1,4 +1,9 @@
+from .context import ContextBuilder, ContextStats, estimate_tokens
 from .executor.base import FlowExecutor
 from .executor.pocketflow import PocketflowExecutor
 from .executor.simple_sequential import SimpleSequentialExecutor
+from .executor.parallel import ParallelExecutor
+from .executor.async_parallel import AsyncParallelExecutor
+from .executor.process import ProcessExecutor
+from .executor.distributed import DistributedExecutor, FlowWorker
 from .agent_task_flow import AgentTaskFlow
\ No newline at end of file
@@ -1,16 +1,18 @@
 import logging
-from typing import List, Optional, Iterator, Type
-from pydantic import BaseModel, ConfigDict
+from typing import AsyncIterator, List, Optional, Iterator, Type, Union
+from pydantic import BaseModel, ConfigDict, Field
 import networkx as nx
 
 from mas.agent.agno import AgnoAgent
 from mas.agent.mock import MockAgent
 from mas.graph import AgentTaskGraph, NodeId
-from mas.memory.memory import FlowMemory
+from mas.memory.memory import AsyncFlowMemory, FlowMemory
 from mas.agent import Agent
+from mas.errors.flow_error import FlowError
 
 from mas.graph.types import NodeAttr
-from mas.flow.executor.base import FlowExecutor
+from mas.flow.events import FlowEvent
+from mas.flow.executor.base import FlowExecutor, RunResult
 from mas.model.pool import ModelPool
 from mas.storage import InMemoryStorage
 from mas.tool.pool import ToolPool
@@ -39,27 +41,129 @@ class AgentTaskFlow(BaseModel):
     cls_Agent: Type[Agent]
 
     graph: Optional[AgentTaskGraph] = None
-    memory: Optional[FlowMemory] = FlowMemory(storage=InMemoryStorage())
+    # one store per flow, a class-level default would be shared by every flow in the process
+    memory: Optional[Union[FlowMemory, AsyncFlowMemory]] = Field(default_factory=lambda: FlowMemory(storage=InMemoryStorage()))
+    run_id: Optional[str] = None
+    incremental: bool = False
 
     '''add {node_id: Agent(node_attr)} to each graph node'''
     def build_agents_on_graph(self, G: AgentTaskGraph):
-        nx.set_node_attributes(G, {node_id: self.cls_Agent(id=node_id, node_attr=NodeAttr(**attr)) for node_id, attr in G.nodes(data=True)}, name='agent')
+        nx.set_node_attributes(G, {node_id: self.cls_Agent(id=node_id, node_attr=G.get_node_attr(node_id)) for node_id in G.nodes}, name='agent')
         
     def build(self, G: AgentTaskGraph):
         self.build_agents_on_graph(G)
+        nx.set_node_attributes(G, G.node_hashes(), name='hash')
         self.graph = G
+
+    '''
+    every run gets its own run id (kept in self.run_id) and checkpoints its graph and finished nodes into the memory storage
+    passing the id of an interrupted run only executes the nodes it did not finish
+    with incremental=True, nodes whose content hash is unchanged since any earlier run reuse that run's output
+    '''
+    def start_run(self, run_id: Optional[str] = None) -> FlowMemory:
+        if isinstance(self.memory, AsyncFlowMemory):
+            raise FlowError("AsyncFlowMemory can only be used with arun, arun_stream and aresume")
+        memory = self.memory.for_run(run_id, incremental=self.incremental)
+        memory.start_run()
+        if run_id is None or memory.load_graph() is None:
+            memory.save_graph(self.graph)
+        self.run_id = memory.run_id
+        return memory
+
+    async def astart_run(self, run_id: Optional[str] = None) -> Union[FlowMemory, AsyncFlowMemory]:
+        if not isinstance(self.memory, AsyncFlowMemory):
+            return self.start_run(run_id)
+        memory = self.memory.for_run(run_id, incremental=self.incremental)
+        await memory.start_run()
+        if run_id is None or await memory.load_graph() is None:
+            await memory.save_graph(self.graph)
+        self.run_id = memory.run_id
+        return memory
     
-    def run(self):
-        return self.executor.run(self.graph, self.memory)
+    '''
+    once a run stops, finished or failed, its memory is told so (complete_run), a bounded storage may then evict it
+    '''
+    def run(self, run_id: Optional[str] = None):
+        memory = self.start_run(run_id)
+        try:
+            return self.executor.run(self.graph, memory)
+        finally:
+            memory.complete_run()
+
+    async def arun(self, run_id: Optional[str] = None):
+        memory = await self.astart_run(run_id)
+        try:
+            return await self.executor.arun(self.graph, memory)
+        finally:
+            await self.complete_run(memory)
+
+    def run_result(self, run_id: Optional[str] = None) -> RunResult:
+        ''' run, with how it ended: status, timed out and skipped nodes '''
+        memory = self.start_run(run_id)
+        try:
+            return self.executor.run_result(self.graph, memory)
+        finally:
+            memory.complete_run()
+
+    async def arun_result(self, run_id: Optional[str] = None) -> RunResult:
+        memory = await self.astart_run(run_id)
+        try:
+            return await self.executor.arun_result(self.graph, memory)
+        finally:
+            await self.complete_run(memory)
     
-    # TODO: run stream
+    def run_stream(self, run_id: Optional[str] = None) -> Iterator[FlowEvent]:
+        memory = self.start_run(run_id)
+        try:
+            yield from self.executor.run_stream(self.graph, memory)
+        finally:
+            memory.complete_run()
+
+    async def arun_stream(self, run_id: Optional[str] = None) -> AsyncIterator[FlowEvent]:
+        memory = await self.astart_run(run_id)
+        try:
+            async for event in self.executor.arun_stream(self.graph, memory):
+                yield event
+        finally:
+            await self.complete_run(memory)
+
+    @staticmethod
+    async def complete_run(memory: Union[FlowMemory, AsyncFlowMemory]):
+        if isinstance(memory, AsyncFlowMemory):
+            await memory.complete_run()
+        else:
+            memory.complete_run()
+
+    def load_run(self, run_id: str):
+        ''' rebuild the graph checkpointed by a previous run '''
+        graph = self.memory.for_run(run_id).load_graph()
+        if graph is None:
+            raise FlowError(f"Run {run_id} not found in flow memory")
+        self.build(graph)
+
+    async def aload_run(self, run_id: str):
+        if not isinstance(self.memory, AsyncFlowMemory):
+            return self.load_run(run_id)
+        graph = await self.memory.for_run(run_id).load_graph()
+        if graph is None:
+            raise FlowError(f"Run {run_id} not found in flow memory")
+        self.build(graph)
+
+    def resume(self, run_id: str):
+        self.load_run(run_id)
+        return self.run(run_id)
+
+    async def aresume(self, run_id: str):
+        await self.aload_run(run_id)
+        return await self.arun(run_id)
 
     def build_and_run(self):
         self.build()
         return self.run()
 
     def pprint_flow_order(self):
-        logger.info(self.executor.get_execution_order_str())
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(self.executor.get_execution_order_str())
     '''
     for pydantic, resolve AgentTaskGraph compatiblity issue
     '''
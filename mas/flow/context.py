@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from mas.agent import Agent
+from mas.graph.types import NodeId
+from mas.message import Message
+
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(text: str) -> int:
+    ''' about 4 characters per token for english text and code, no tokenizer needed '''
+    return (len(text) + 3) // 4
+
+def message_text(message: Message) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return "" if message.content is None else str(message.content)
+
+@dataclass
+class ContextStats:
+    tokens_before: int
+    tokens_after: int
+    # predecessors whose output was cut down to fit the budget
+    reduced: List[NodeId] = field(default_factory=list)
+    # reported by the model: the node's input tokens, and how many of them the provider served from its prompt cache
+    input_tokens: int = 0
+    cached_tokens: int = 0
+
+'''
+ContextBuilder: assembles a node's input messages, [predecessor prompt, predecessor output]* + the node prompt, within a token budget
+1. prompts are always kept whole, the predecessor outputs share what is left of the budget
+2. outputs under their fair share are kept whole, what they leave is split again among the larger ones
+3. an oversized output is reduced to its share by the strategy:
+   truncate: keep its head and tail
+   extract: keep the paragraphs sharing the most words with the node prompt, in their original order
+   summarize: ask the summarizer agent, usually a small, cheap model, for a summary of that size, truncated if it runs over
+4. only text content is reduced, outputs with list content and media pass unchanged
+5. token counts before and after are logged and kept in stats per node, the latest run wins
+6. the summarizer agent is shared by every node, its calls are serialized, one summary at a time
+Prompt caching: providers reuse the longest request prefix seen recently, so the layout is deterministic,
+predecessors by id (FlowNode.predecessors), the node prompt last, and a summary is made once per output and size,
+siblings and reruns then send the same upstream context first. The cached tokens the model reports land in stats too
+'''
+@dataclass
+class ContextBuilder:
+    budget: Optional[int] = None  # tokens per node, None keeps every output whole
+    node_budgets: Dict[NodeId, int] = field(default_factory=dict)  # overrides budget for these nodes
+    strategy: str = "truncate"  # truncate, extract or summarize
+    summarizer: Optional[Agent] = None
+    count_tokens: Callable[[str], int] = estimate_tokens
+    max_summaries: int = 256
+    stats: Dict[NodeId, ContextStats] = field(default_factory=dict, init=False)
+    summaries: OrderedDict = field(default_factory=OrderedDict, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.strategy not in ("truncate", "extract", "summarize"):
+            raise ValueError(f"Unknown context strategy: {self.strategy}")
+        if self.strategy == "summarize" and self.summarizer is None:
+            raise ValueError("The summarize strategy needs a summarizer agent")
+        self.lock = threading.Lock()
+        # agents are not thread safe, parallel executors build several nodes' inputs at once
+        self.summarizer_lock = threading.Lock()
+
+    @property
+    def blocking(self) -> bool:
+        ''' building calls a model, async executors run it on a worker thread '''
+        return self.strategy == "summarize"
+
+    def build(self, node_id: NodeId, prompt: str, preds_data: List[Tuple[NodeId, Dict[str, Any]]]) -> List[Message]:
+        ''' preds_data: (predecessor id, its entry data) per predecessor '''
+        outputs = [self.count_tokens(message_text(d["caller_output_message"])) for _, d in preds_data]
+        prompts = sum(self.count_tokens(d["caller_user_prompt"]) for _, d in preds_data) + self.count_tokens(prompt)
+        budget = self.node_budgets.get(node_id, self.budget)
+        shares = outputs if budget is None else self.shares(outputs, max(budget - prompts, 0))
+
+        messages, reduced, after = [], [], prompts
+        for (pred, data), tokens, share in zip(preds_data, outputs, shares):
+            output = data["caller_output_message"]
+            if tokens > share and isinstance(output.content, str):
+                output = output.model_copy(update={"content": self.reduce(output.content, share, prompt)})
+                reduced.append(pred)
+            after += self.count_tokens(message_text(output))
+            messages.append(Message(role="user", content=data["caller_user_prompt"]))
+            messages.append(output)
+        messages.append(Message(role="user", content=prompt))
+
+        stats = ContextStats(tokens_before=prompts + sum(outputs), tokens_after=after, reduced=reduced)
+        with self.lock:
+            self.stats[node_id] = stats
+        logger.info(f"Agent[id={node_id}] context: {stats.tokens_before} -> {stats.tokens_after} tokens (budget {budget})")
+        return messages
+
+    @staticmethod
+    def shares(outputs: List[int], available: int) -> List[int]:
+        ''' the largest share per output so they all fit in available, smaller outputs keep their size '''
+        shares = list(outputs)
+        pending = sorted(range(len(outputs)), key=lambda i: outputs[i])
+        while pending:
+            fair = available // len(pending)
+            if outputs[pending[0]] > fair:
+                for i in pending:
+                    shares[i] = fair
+                break
+            i = pending.pop(0)
+            available -= outputs[i]
+        return shares
+
+    def reduce(self, text: str, tokens: int, prompt: str) -> str:
+        if self.strategy == "extract":
+            return self.extract(text, tokens, prompt)
+        if self.strategy == "summarize":
+            return self.summarize(text, tokens)
+        return self.truncate(text, tokens)
+
+    def truncate(self, text: str, tokens: int) -> str:
+        marker = "\n[...]\n"
+        # estimated from the character count, then cut until the counter agrees
+        chars = max(len(text) * tokens // max(self.count_tokens(text), 1) - len(marker), 0)
+        while chars > 0:
+            head = chars * 2 // 3
+            reduced = text[:head] + marker + text[len(text) - (chars - head):]
+            if self.count_tokens(reduced) <= tokens:
+                return reduced
+            chars = chars * 9 // 10
+        return ""
+
+    def extract(self, text: str, tokens: int, prompt: str) -> str:
+        paragraphs = [p for p in re.split(r"\n\s*\n", text) if p.strip()]
+        words = set(re.findall(r"\w+", prompt.lower()))
+
+        def score(i: int) -> Tuple[float, int]:
+            found = re.findall(r"\w+", paragraphs[i].lower())
+            return (-sum(w in words for w in found) / (len(found) or 1), i)
+
+        kept, used = set(), 0
+        for i in sorted(range(len(paragraphs)), key=score):
+            size = self.count_tokens(paragraphs[i])
+            if used + size <= tokens:
+                kept.add(i)
+                used += size
+        if not kept:
+            return self.truncate(text, tokens)
+        return "\n\n".join(paragraphs[i] for i in sorted(kept))
+
+    def record_usage(self, node_id: NodeId, usage: Dict[str, int]) -> None:
+        with self.lock:
+            stats = self.stats.setdefault(node_id, ContextStats(tokens_before=0, tokens_after=0))
+            stats.input_tokens = usage.get("input_tokens", 0)
+            stats.cached_tokens = usage.get("cached_tokens", 0)
+
+    def cache_hit_rate(self) -> float:
+        ''' share of the input tokens, over all recorded nodes, served from the provider's prompt cache '''
+        with self.lock:
+            input_tokens = sum(s.input_tokens for s in self.stats.values())
+            cached_tokens = sum(s.cached_tokens for s in self.stats.values())
+        return cached_tokens / input_tokens if input_tokens else 0.0
+
+    def summarize(self, text: str, tokens: int) -> str:
+        # siblings summarizing the same output to the same size send the same summary, a shared cacheable prefix
+        key = (hashlib.sha256(text.encode()).hexdigest(), tokens)
+        with self.lock:
+            if key in self.summaries:
+                self.summaries.move_to_end(key)
+                return self.summaries[key]
+        with self.summarizer_lock:
+            with self.lock:
+                # made by a sibling while this one waited
+                if key in self.summaries:
+                    return self.summaries[key]
+            summary = self.summarize_uncached(text, tokens)
+        with self.lock:
+            self.summaries[key] = summary
+            while len(self.summaries) > self.max_summaries:
+                self.summaries.popitem(last=False)
+        return summary
+
+    def summarize_uncached(self, text: str, tokens: int) -> str:
+        request = Message(role="user", content=f"Summarize the following text in at most {tokens * 3 // 4} words, keep facts, numbers and names:\n\n{text}")
+        summary = message_text(self.summarizer.run(messages=[request]))
+        return summary if self.count_tokens(summary) <= tokens else self.truncate(summary, tokens)
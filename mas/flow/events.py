@@ -0,0 +1,52 @@
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, List
+
+from mas.graph.types import NodeId
+from mas.message import Message
+
+'''
+How a run ended, COMPLETED unless timeouts cut parts of the graph:
+PARTIAL: some nodes hit their node timeout, their descendants were skipped, the other branches completed
+DEADLINE_EXCEEDED: the run deadline hit, in-flight nodes were cancelled and the unfinished rest skipped
+'''
+class RunStatus(str, Enum):
+    COMPLETED = "completed"
+    PARTIAL = "partial"
+    DEADLINE_EXCEEDED = "deadline_exceeded"
+
+'''
+Events yielded by AgentTaskFlow.run_stream / arun_stream, in order:
+NodeStarted -> NodeDelta* -> NodeFinished for every node (interleaved across branches), then a single FinalAnswer
+'''
+@dataclass
+class FlowEvent:
+    pass
+
+@dataclass
+class NodeStarted(FlowEvent):
+    node_id: NodeId
+
+@dataclass
+class NodeDelta(FlowEvent):
+    node_id: NodeId
+    delta: str
+
+@dataclass
+class NodeFinished(FlowEvent):
+    node_id: NodeId
+    message: Message
+
+@dataclass
+class FinalAnswer(FlowEvent):
+    message: Message
+    status: RunStatus = RunStatus.COMPLETED
+    timed_out: List[NodeId] = field(default_factory=list)
+    skipped: List[NodeId] = field(default_factory=list)
+
+    @classmethod
+    def of(cls, result) -> "FinalAnswer":
+        ''' from the executor's RunResult '''
+        return cls(message=result.message, status=result.status, timed_out=result.timed_out, skipped=result.skipped)
+
+Emit = Callable[[FlowEvent], None]
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Union
+import networkx as nx
+
+from mas.graph.types import NodeId
+from mas.message import Message
+from mas.memory.memory import AsyncFlowMemory, FlowMemory
+from mas.graph.agent_task_graph import AgentTaskGraph
+from mas.flow.events import Emit, RunStatus
+from mas.flow.executor.base import FlowExecutor, RunResult, RunTimeouts, partial_output
+from mas.flow.executor.pocketflow import FlowNode
+from mas.flow.scheduler import CriticalPathScheduler, Scheduler
+
+logger = logging.getLogger(__name__)
+
+'''
+AsyncParallel:
+1. same dispatch rule as ParallelExecutor, but every ready node is an asyncio task on one event loop
+2. max_concurrency bounds the in-flight agent calls, None means unbounded
+3. the scheduler orders ready nodes and applies per-model concurrency caps
+4. with an AsyncFlowMemory, memory reads and writes are awaited too, nothing blocks the event loop
+5. node_timeout and run_timeout behave as in ParallelExecutor, but timed out agent calls are really cancelled
+'''
+@dataclass
+class AsyncParallelExecutor(FlowExecutor):
+    max_concurrency: Optional[int] = None
+    scheduler: Scheduler = field(default_factory=CriticalPathScheduler)
+    node_timeout: Optional[float] = None  # seconds per agent call
+    run_timeout: Optional[float] = None  # seconds for the whole run
+    generations: List[List[NodeId]] = field(default_factory=list, init=False)
+
+    def run(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> Message:
+        return asyncio.run(self.arun(graph, memory, emit))
+
+    def run_result(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> RunResult:
+        return asyncio.run(self.arun_result(graph, memory, emit))
+
+    async def arun(self, graph: AgentTaskGraph, memory: Union[FlowMemory, AsyncFlowMemory], emit: Optional[Emit] = None) -> Message:
+        return (await self.arun_result(graph, memory, emit)).message
+
+    async def arun_result(self, graph: AgentTaskGraph, memory: Union[FlowMemory, AsyncFlowMemory], emit: Optional[Emit] = None) -> RunResult:
+        self.generations = [sorted(g) for g in nx.topological_generations(graph)]
+        sequential_order = list(graph.topological_sort())
+
+        '''
+        shared memory
+        '''
+        shared = {
+            "graph": graph,
+            "memory": memory,
+            "emit": emit,
+            "context": self.context
+        }
+
+        '''
+        create agents and nodes
+        '''
+        nodes = {
+            node_id: FlowNode(attr["agent"], attr["prompt"], attr["input_formats"], attr["output_formats"])
+            for node_id, attr in graph.nodes(data=True)
+        }
+
+        schedule = self.scheduler.start(graph)
+        timeouts = RunTimeouts(self.node_timeout, self.run_timeout)
+        outputs: Dict[NodeId, Message] = {}
+        status = RunStatus.COMPLETED
+
+        running: Dict[asyncio.Task, NodeId] = {}
+        try:
+            while schedule.has_ready() or running:
+                slots = self.max_concurrency - len(running) if self.max_concurrency else None
+                for node_id in schedule.pop_ready(slots=slots):
+                    logger.debug(f"AsyncParallelExecutor: dispatch Agent[id={node_id}]")
+                    running[asyncio.create_task(self.run_node(nodes[node_id], shared))] = node_id
+                    timeouts.start(node_id)
+
+                done, _ = await asyncio.wait(running, timeout=timeouts.wait_timeout(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    node_id = running.pop(task)
+                    timeouts.finish(node_id)
+                    outputs[node_id] = task.result()
+                    schedule.complete(node_id)
+
+                if timeouts.deadline_exceeded():
+                    logger.warning(f"AsyncParallelExecutor: run deadline of {self.run_timeout}s exceeded, cancelling Agents {sorted(running.values())}")
+                    status = RunStatus.DEADLINE_EXCEEDED
+                    for task, node_id in list(running.items()):
+                        if nodes[node_id].abandon():
+                            timeouts.timed_out.append(node_id)
+                        else:
+                            # already recording its output, e.g. on a storage thread, it finished
+                            del running[task]
+                            outputs[node_id] = await task
+                    break
+                expired = timeouts.pop_expired()
+                for task, node_id in list(running.items()):
+                    if node_id in expired and nodes[node_id].abandon():
+                        logger.warning(f"Agent[id={node_id}] timed out after {self.node_timeout}s, skipping its descendants {schedule.skip(node_id)}")
+                        del running[task]
+                        task.cancel()
+                        timeouts.timed_out.append(node_id)
+                        status = RunStatus.PARTIAL
+        finally:
+            # a failed, cancelled or timed out run must not leave orphan agent calls behind
+            for task in running:
+                task.cancel()
+
+        timed_out = sorted(timeouts.timed_out)
+        skipped = [node_id for node_id in sequential_order if node_id not in outputs and node_id not in timed_out]
+        # sinks may finish in any order, keep the result deterministic
+        shared["final_output_message"] = partial_output(sequential_order, outputs)
+        return RunResult(message=shared["final_output_message"], status=status, timed_out=timed_out, skipped=skipped)
+
+    async def run_node(self, node: FlowNode, shared: Dict[str, Any]) -> Message:
+        if isinstance(shared["memory"], AsyncFlowMemory):
+            prep_res = await node.prep_async(shared)
+            exec_res = await node.exec_async(prep_res)
+            await node.post_async(shared, prep_res, exec_res)
+        else:
+            prep_res = node.prep(shared)
+            exec_res = await node.exec_async(prep_res)
+            node.post(shared, prep_res, exec_res)
+        return exec_res
+
+    def get_execution_order_str(self):
+        return '->'.join(['|'.join([str(i) for i in g]) for g in self.generations])
@@ -1,15 +1,140 @@
+import asyncio
+import queue
+import threading
+import time
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from mas.graph import AgentTaskGraph
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from mas.errors.flow_error import FlowCancelledError, FlowTimeoutError
+from mas.flow.context import ContextBuilder
+from mas.flow.events import Emit, FinalAnswer, FlowEvent, RunStatus
+from mas.graph import AgentTaskGraph, NodeId
 from mas.memory import FlowMemory
 from mas.message import Message
 
+_DONE = object()
+
+@dataclass
+class RunResult:
+    ''' the output of one run and how it ended, executors without timeouts always complete '''
+    message: Message
+    status: RunStatus = RunStatus.COMPLETED
+    timed_out: List[NodeId] = field(default_factory=list)
+    skipped: List[NodeId] = field(default_factory=list)
+
 @dataclass
 class FlowExecutor(ABC):
+    # token budget for the input of each node, None passes every predecessor output whole
+    context: Optional[ContextBuilder] = None
+
     @abstractmethod
-    def run(self, graph: AgentTaskGraph, memory: FlowMemory) -> Message:
+    def run(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> Message:
         raise NotImplementedError
-    
+
+    async def arun(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> Message:
+        ''' fallback for blocking executors: run the whole flow in a worker thread '''
+        return await asyncio.to_thread(self.run, graph, memory, emit)
+
+    def run_result(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> RunResult:
+        ''' run and report how it ended, per run, so concurrent runs on one executor don't mix their results '''
+        return RunResult(message=self.run(graph, memory, emit))
+
+    async def arun_result(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> RunResult:
+        return RunResult(message=await self.arun(graph, memory, emit))
+
+    def run_stream(self, graph: AgentTaskGraph, memory: FlowMemory) -> Iterator[FlowEvent]:
+        '''
+        run the flow in a worker thread and yield its events as they are emitted
+        closing the iterator early cancels the run at the next event any node emits
+        '''
+        events: queue.Queue = queue.Queue()
+        cancelled = threading.Event()
+
+        def emit(event: FlowEvent):
+            if cancelled.is_set():
+                raise FlowCancelledError("Flow run cancelled by the stream consumer")
+            events.put(event)
+
+        def worker():
+            try:
+                events.put(FinalAnswer.of(self.run_result(graph, memory, emit)))
+            except BaseException as e:
+                events.put(e)
+            finally:
+                events.put(_DONE)
+
+        threading.Thread(target=worker, daemon=True).start()
+        try:
+            while (event := events.get()) is not _DONE:
+                if isinstance(event, BaseException):
+                    raise event
+                yield event
+        finally:
+            cancelled.set()
+
+    async def arun_stream(self, graph: AgentTaskGraph, memory: FlowMemory) -> AsyncIterator[FlowEvent]:
+        '''
+        async counterpart of run_stream, closing the iterator early cancels the run task
+        '''
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def emit(event: FlowEvent):
+            if cancelled.is_set():
+                raise FlowCancelledError("Flow run cancelled by the stream consumer")
+            # executors may emit from worker threads
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        task = asyncio.create_task(self.arun_result(graph, memory, emit))
+        task.add_done_callback(lambda _: events.put_nowait(_DONE))
+        try:
+            while (event := await events.get()) is not _DONE:
+                yield event
+            yield FinalAnswer.of(await task)
+        finally:
+            cancelled.set()
+            task.cancel()
+
     @abstractmethod
     def get_execution_order_str(self):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+class RunTimeouts:
+    ''' per-node timeouts and the run deadline of one run, on the monotonic clock '''
+
+    def __init__(self, node_timeout: Optional[float] = None, run_timeout: Optional[float] = None):
+        self.node_timeout = node_timeout
+        self.deadline = time.monotonic() + run_timeout if run_timeout is not None else None
+        self.node_deadlines: Dict[NodeId, float] = {}
+        self.timed_out: List[NodeId] = []
+
+    def start(self, node_id: NodeId) -> None:
+        if self.node_timeout is not None:
+            self.node_deadlines[node_id] = time.monotonic() + self.node_timeout
+
+    def finish(self, node_id: NodeId) -> None:
+        self.node_deadlines.pop(node_id, None)
+
+    def wait_timeout(self) -> Optional[float]:
+        ''' how long the executor may block before the next deadline, None if there is none '''
+        deadlines = list(self.node_deadlines.values()) + ([self.deadline] if self.deadline is not None else [])
+        return max(min(deadlines) - time.monotonic(), 0.0) if deadlines else None
+
+    def deadline_exceeded(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def pop_expired(self) -> List[NodeId]:
+        ''' nodes past their timeout, the executor adds those it could abandon to timed_out '''
+        now = time.monotonic()
+        expired = [node_id for node_id, deadline in self.node_deadlines.items() if deadline <= now]
+        for node_id in expired:
+            self.finish(node_id)
+        return expired
+
+def partial_output(sequential_order: List[NodeId], outputs: Dict[NodeId, Message]) -> Message:
+    ''' output of the last finished node in topological order, the furthest the run got '''
+    for node_id in reversed(sequential_order):
+        if node_id in outputs:
+            return outputs[node_id]
+    raise FlowTimeoutError("Flow run timed out before any node finished")
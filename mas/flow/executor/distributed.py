@@ -0,0 +1,177 @@
+import argparse
+import importlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Type
+import networkx as nx
+
+from mas.agent import Agent
+from mas.errors.flow_error import FlowError
+from mas.flow.context import ContextBuilder
+from mas.flow.events import Emit, NodeFinished, NodeStarted
+from mas.flow.executor.base import FlowExecutor
+from mas.flow.executor.pocketflow import FlowNode
+from mas.flow.scheduler import CriticalPathScheduler, Scheduler
+from mas.flow.task_queue import LocalTaskQueue, RedisTaskQueue, TaskQueue
+from mas.graph.agent_task_graph import AgentTaskGraph
+from mas.graph.types import NodeId
+from mas.memory.memory import FlowMemory
+from mas.message import Message
+from mas.storage.base import Storage
+from mas.storage.blob import BlobStore
+
+logger = logging.getLogger(__name__)
+
+def agent_class_path(cls_Agent: Type[Agent]) -> str:
+    return f"{cls_Agent.__module__}:{cls_Agent.__qualname__}"
+
+def load_agent_class(path: str) -> Type[Agent]:
+    module_name, qualname = path.split(":")
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+'''
+Distributed:
+1. the executor only schedules: every ready node becomes a task {run_id, node_id, agent class} on the task queue
+2. any FlowWorker, in any process or machine, pulls the task and runs the whole node (prep, agent call, post)
+   against the shared storage, loading the graph from the run checkpoint
+3. the worker reports back on the run's result channel, the executor then marks the node complete
+4. executor and workers must use the same storage backend, e.g. RedisStorage with RedisTaskQueue
+'''
+@dataclass
+class DistributedExecutor(FlowExecutor):
+    task_queue: TaskQueue = field(default_factory=LocalTaskQueue)
+    scheduler: Scheduler = field(default_factory=CriticalPathScheduler)
+    result_timeout: Optional[float] = None  # give up if no worker reports within this many seconds
+    generations: List[List[NodeId]] = field(default_factory=list, init=False)
+
+    def run(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> Message:
+        self.generations = [sorted(g) for g in nx.topological_generations(graph)]
+        sequential_order = list(graph.topological_sort())
+
+        # workers rebuild the graph from the run checkpoint
+        if memory.load_graph() is None:
+            memory.save_graph(graph)
+
+        schedule = self.scheduler.start(graph)
+        running: Set[NodeId] = set()
+        self.task_queue.open_run(memory.run_id)
+        try:
+            while schedule.has_ready() or running:
+                for node_id in schedule.pop_ready():
+                    logger.debug(f"DistributedExecutor: enqueue Agent[id={node_id}]")
+                    self.task_queue.put_task({
+                        "run_id": memory.run_id,
+                        "node_id": node_id,
+                        "agent": agent_class_path(type(graph.nodes[node_id]["agent"])),
+                        "incremental": memory.incremental,
+                    })
+                    running.add(node_id)
+                    if emit is not None:
+                        emit(NodeStarted(node_id=node_id))
+
+                result = self.task_queue.get_result(memory.run_id, timeout=self.result_timeout)
+                if result is None:
+                    raise FlowError(f"No worker result within {self.result_timeout}s, still running: {sorted(running)}")
+                node_id = result["node_id"]
+                if result.get("error") is not None:
+                    raise FlowError(f"Agent[id={node_id}] failed on worker: {result['error']}")
+                running.discard(node_id)
+                schedule.complete(node_id)
+                if emit is not None:
+                    emit(NodeFinished(node_id=node_id, message=memory.resolve(memory.get_node_record(node_id))["caller_output_message"]))
+        finally:
+            self.task_queue.close_run(memory.run_id)
+
+        return memory.resolve(memory.get_node_record(sequential_order[-1]))["caller_output_message"]
+
+    def get_execution_order_str(self):
+        return '->'.join(['|'.join([str(i) for i in g]) for g in self.generations])
+
+class FlowWorker:
+    ''' pulls node tasks from the queue and runs them, start as many as needed, in threads or processes '''
+
+    def __init__(self, task_queue: TaskQueue, storage: Storage, max_cached_graphs: int = 128, blobs: Optional[BlobStore] = None, blob_threshold: int = 4096,
+                 context: Optional[ContextBuilder] = None):
+        self.task_queue = task_queue
+        self.storage = storage
+        # the blob store of the executor's memory, if it has one
+        self.blobs = blobs
+        self.blob_threshold = blob_threshold
+        # token budget for the nodes this worker runs, the executor's context is not sent with the tasks
+        self.context = context
+        self.max_cached_graphs = max_cached_graphs
+        self.graphs: OrderedDict[str, AgentTaskGraph] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def run_forever(self, stop: Optional[threading.Event] = None, poll_timeout: float = 1.0):
+        while stop is None or not stop.is_set():
+            task = self.task_queue.get_task(timeout=poll_timeout)
+            if task is not None:
+                self.run_task(task)
+
+    def run_task(self, task: Dict[str, Any]) -> None:
+        run_id, node_id = task["run_id"], task["node_id"]
+        if not self.task_queue.is_open(run_id):
+            # its run failed or gave up waiting, nobody reads the result
+            logger.debug(f"FlowWorker: skipping Agent[id={node_id}] of closed run {run_id}")
+            return
+        try:
+            memory = FlowMemory(storage=self.storage, run_id=run_id, incremental=task.get("incremental", False), blobs=self.blobs, blob_threshold=self.blob_threshold)
+            graph = self.get_graph(memory)
+            node_attr = graph.get_node_attr(node_id)
+            agent = load_agent_class(task["agent"])(id=node_id, node_attr=node_attr)
+            node = FlowNode(agent, node_attr.prompt, node_attr.input_formats, node_attr.output_formats)
+
+            shared = {"graph": graph, "memory": memory, "context": self.context}
+            prep_res = node.prep(shared)
+            exec_res = node._exec(prep_res)
+            node.post(shared, prep_res, exec_res)
+            result = {"node_id": node_id}
+        except Exception as e:
+            logger.exception(f"FlowWorker: Agent[id={node_id}] of run {run_id} failed")
+            result = {"node_id": node_id, "error": repr(e)}
+        self.task_queue.put_result(run_id, result)
+
+    def get_graph(self, memory: FlowMemory) -> AgentTaskGraph:
+        with self.lock:
+            if memory.run_id in self.graphs:
+                self.graphs.move_to_end(memory.run_id)
+                return self.graphs[memory.run_id]
+
+        graph = memory.load_graph()
+        if graph is None:
+            raise FlowError(f"Run {memory.run_id} not found in storage")
+        nx.set_node_attributes(graph, graph.node_hashes(), name='hash')
+
+        with self.lock:
+            self.graphs[memory.run_id] = graph
+            while len(self.graphs) > self.max_cached_graphs:
+                self.graphs.popitem(last=False)
+        return graph
+
+if __name__ == "__main__":
+    from mas.model.pool import ModelPool
+    from mas.storage.blob import RedisBlobStore
+    from mas.storage.redis import RedisStorage
+    from mas.tool.pool import ToolPool
+
+    parser = argparse.ArgumentParser(description="Run a flow worker against a redis task queue and storage")
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-db", type=int, default=0)
+    parser.add_argument("--blobs", action="store_true", help="the executor's memory offloads messages to a RedisBlobStore")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    ModelPool.get_global()
+    ToolPool.get_global()
+    FlowWorker(
+        task_queue=RedisTaskQueue(args.redis_host, args.redis_port, args.redis_db),
+        storage=RedisStorage(args.redis_host, args.redis_port, args.redis_db),
+        blobs=RedisBlobStore(args.redis_host, args.redis_port, args.redis_db) if args.blobs else None,
+    ).run_forever()
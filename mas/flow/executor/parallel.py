@@ -0,0 +1,122 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import networkx as nx
+
+from mas.graph.types import NodeId
+from mas.message import Message
+from mas.memory.memory import FlowMemory
+from mas.graph.agent_task_graph import AgentTaskGraph
+from mas.flow.events import Emit, RunStatus
+from mas.flow.executor.base import FlowExecutor, RunResult, RunTimeouts, partial_output
+from mas.flow.executor.pocketflow import FlowNode
+from mas.flow.scheduler import CriticalPathScheduler, Scheduler
+
+logger = logging.getLogger(__name__)
+
+'''
+Parallel:
+1. a node is dispatched as soon as all its predecessors have written their entries into the flow memory
+2. independent branches run concurrently on a bounded thread pool
+3. when more nodes are ready than free workers, the scheduler picks which start first
+4. the final output is the output of the last node in topological order, same as the chain executors
+5. a node running longer than node_timeout is abandoned and its descendants skipped, the other branches go on
+6. once run_timeout passes, in-flight nodes are abandoned and nothing new starts,
+   the output of the last finished node is returned and the run's RunResult tells how it ended
+   threads can't be killed, an abandoned agent call finishes in the background but its output is not recorded,
+   so resuming the run executes it again; a node that already started recording its output counts as finished
+'''
+@dataclass
+class ParallelExecutor(FlowExecutor):
+    max_workers: int = 8
+    scheduler: Scheduler = field(default_factory=CriticalPathScheduler)
+    node_timeout: Optional[float] = None  # seconds per agent call
+    run_timeout: Optional[float] = None  # seconds for the whole run
+    generations: List[List[NodeId]] = field(default_factory=list, init=False)
+
+    def run(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> Message:
+        return self.run_result(graph, memory, emit).message
+
+    def run_result(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> RunResult:
+        self.generations = [sorted(g) for g in nx.topological_generations(graph)]
+        sequential_order = list(graph.topological_sort())
+
+        '''
+        shared memory
+        '''
+        shared = {
+            "graph": graph,
+            "memory": memory,
+            "emit": emit,
+            "context": self.context
+        }
+
+        '''
+        create agents and nodes
+        '''
+        nodes = {
+            node_id: FlowNode(attr["agent"], attr["prompt"], attr["input_formats"], attr["output_formats"])
+            for node_id, attr in graph.nodes(data=True)
+        }
+
+        schedule = self.scheduler.start(graph)
+        timeouts = RunTimeouts(self.node_timeout, self.run_timeout)
+        outputs: Dict[NodeId, Message] = {}
+        status = RunStatus.COMPLETED
+
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        running: Dict[Future, NodeId] = {}
+        try:
+            while schedule.has_ready() or running:
+                # only hand the pool as many nodes as it can start, so priorities hold
+                for node_id in schedule.pop_ready(slots=self.max_workers - len(running)):
+                    logger.debug(f"ParallelExecutor: dispatch Agent[id={node_id}]")
+                    running[pool.submit(self.run_node, nodes[node_id], shared)] = node_id
+                    timeouts.start(node_id)
+
+                done, _ = wait(running, timeout=timeouts.wait_timeout(), return_when=FIRST_COMPLETED)
+                for future in done:
+                    node_id = running.pop(future)
+                    timeouts.finish(node_id)
+                    outputs[node_id] = future.result()
+                    schedule.complete(node_id)
+
+                if timeouts.deadline_exceeded():
+                    logger.warning(f"ParallelExecutor: run deadline of {self.run_timeout}s exceeded, abandoning Agents {sorted(running.values())}")
+                    status = RunStatus.DEADLINE_EXCEEDED
+                    for future, node_id in list(running.items()):
+                        if nodes[node_id].abandon():
+                            timeouts.timed_out.append(node_id)
+                        else:
+                            # already recording its output, it finished
+                            outputs[node_id] = future.result()
+                            del running[future]
+                    break
+                expired = timeouts.pop_expired()
+                for future, node_id in list(running.items()):
+                    if node_id in expired and nodes[node_id].abandon():
+                        logger.warning(f"Agent[id={node_id}] timed out after {self.node_timeout}s, skipping its descendants {schedule.skip(node_id)}")
+                        del running[future]
+                        timeouts.timed_out.append(node_id)
+                        status = RunStatus.PARTIAL
+        finally:
+            # drop queued nodes of a failed, cancelled or timed out run, started ones finish in the background
+            for future in running:
+                future.cancel()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        timed_out = sorted(timeouts.timed_out)
+        skipped = [node_id for node_id in sequential_order if node_id not in outputs and node_id not in timed_out]
+        # sinks may finish in any order, keep the result deterministic
+        shared["final_output_message"] = partial_output(sequential_order, outputs)
+        return RunResult(message=shared["final_output_message"], status=status, timed_out=timed_out, skipped=skipped)
+
+    def run_node(self, node: FlowNode, shared: Dict[str, Any]) -> Message:
+        prep_res = node.prep(shared)
+        exec_res = node._exec(prep_res)
+        node.post(shared, prep_res, exec_res)
+        return exec_res
+
+    def get_execution_order_str(self):
+        return '->'.join(['|'.join([str(i) for i in g]) for g in self.generations])
@@ -1,9 +1,15 @@
+import asyncio
 import logging
-from typing import List
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
 from mas.agent import Agent
+from mas.errors.flow_error import FlowError
+from mas.flow.context import ContextBuilder
+from mas.flow.events import Emit, NodeDelta, NodeFinished, NodeStarted
 from mas.graph.types import NodeId
 from mas.message import Message, pprint_messages
-from mas.memory.memory import FlowMemory
+from mas.memory.memory import AsyncFlowMemory, FlowMemory
+from mas.storage.blob import BlobStore
 from mas.graph.agent_task_graph import AgentTaskGraph
 from mas.flow import FlowExecutor
 from pocketflow import Node, BatchNode, Flow
@@ -13,7 +19,13 @@ logger = logging.getLogger(__name__)
 class PocketflowExecutor(FlowExecutor):
     sequential_order: List[NodeId] = []
 
-    def run(self, graph: AgentTaskGraph, memory: FlowMemory) -> Message:
+    def __init__(self, context: Optional[ContextBuilder] = None, node_timeout: Optional[float] = None, run_timeout: Optional[float] = None):
+        # rejected rather than ignored, a chain has nothing to go on with once a node is abandoned
+        if node_timeout is not None or run_timeout is not None:
+            raise ValueError("PocketflowExecutor has no timeouts, use ParallelExecutor or AsyncParallelExecutor")
+        super().__init__(context=context)
+
+    def run(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> Message:
 
         self.sequential_order = list(graph.topological_sort())
 
@@ -22,7 +34,9 @@ class PocketflowExecutor(FlowExecutor):
         '''
         shared = {
             "graph": graph,
-            "memory": memory
+            "memory": memory,
+            "emit": emit,
+            "context": self.context
         }
 
         '''
@@ -64,17 +78,84 @@ class FlowNode(Node):
         self.default_prompt = default_prompt
         self.input_formats = input_formats
         self.output_formats = output_formats
+        self.emit: Optional[Emit] = None
+        self.context: Optional[ContextBuilder] = None
+        self.checkpoint: Optional[Dict[str, Any]] = None
+        self.resumed = False
+        self.node_hash: Optional[str] = None
+        # a timed out node is abandoned by its executor, it must not record its output once it finishes anyway
+        self.lock = threading.Lock()
+        self.abandoned = False
+        self.posting = False
 
     def prep(self, shared):
         mem: FlowMemory = shared["memory"]
         graph: AgentTaskGraph = shared["graph"]
-        
+        if isinstance(mem, AsyncFlowMemory):
+            raise FlowError("AsyncFlowMemory needs an async executor, e.g. AsyncParallelExecutor")
+        self.emit = shared.get("emit")
+        self.context = shared.get("context")
+
+        '''
+        reuse the output if this run already completed the node, e.g. when resuming,
+        or in incremental mode, if any run completed a node with the same content hash
+        '''
+        self.node_hash = graph.nodes[self.agent.id].get("hash")
+        self.checkpoint = mem.get_node_record(self.agent.id)
+        self.resumed = self.checkpoint is not None
+        if self.checkpoint is None and mem.incremental and self.node_hash is not None:
+            self.checkpoint = mem.get_node_record_by_hash(self.node_hash)
+        if self.checkpoint is not None:
+            self.checkpoint = mem.resolve(self.checkpoint)
+            return None
+
+        # entries may hold blob references, they are only loaded here, for the node that needs them
+        messages = self.build_messages([(pred, mem.resolve(mem.get_data(pred, self.agent.id, "default"))) for pred in self.predecessors(graph)])
+        return self.materialize(messages, mem.blobs)
+
+    async def prep_async(self, shared):
+        ''' prep on an AsyncFlowMemory, predecessor data is fetched concurrently '''
+        mem: AsyncFlowMemory = shared["memory"]
+        graph: AgentTaskGraph = shared["graph"]
+        self.emit = shared.get("emit")
+        self.context = shared.get("context")
+
+        self.node_hash = graph.nodes[self.agent.id].get("hash")
+        self.checkpoint = await mem.get_node_record(self.agent.id)
+        self.resumed = self.checkpoint is not None
+        if self.checkpoint is None and mem.incremental and self.node_hash is not None:
+            self.checkpoint = await mem.get_node_record_by_hash(self.node_hash)
+        if self.checkpoint is not None:
+            self.checkpoint = await mem.resolve(self.checkpoint)
+            return None
+
+        preds_data = await asyncio.gather(*[self.get_resolved(mem, pred) for pred in self.predecessors(graph)])
+        if self.context is not None and self.context.blocking:
+            messages = await asyncio.to_thread(self.build_messages, preds_data)
+        else:
+            messages = self.build_messages(preds_data)
+        # blob and URL reads block, keep them off the event loop
+        if any(m.has_media_refs() for m in messages):
+            return await asyncio.to_thread(self.materialize, messages, mem.blobs)
+        return self.materialize(messages, mem.blobs)
+
+    def predecessors(self, graph: AgentTaskGraph) -> List[NodeId]:
+        ''' by id, not edge insertion order, nodes sharing predecessors get their context in the same order, a cacheable prompt prefix '''
+        return sorted(graph.predecessors(self.agent.id))
+
+    async def get_resolved(self, mem: AsyncFlowMemory, pred: NodeId) -> Tuple[NodeId, Dict[str, Any]]:
+        return pred, await mem.resolve(await mem.get_data(pred, self.agent.id, "default"))
+
+    def build_messages(self, preds_data: List[Tuple[NodeId, Dict[str, Any]]]) -> List[Message]:
         '''
         create the input messages: [predecessor user prompt, predecessor output] + current user prompt
+        with a ContextBuilder, oversized predecessor outputs are cut down to the node's token budget
         '''
+        if self.context is not None:
+            return self.context.build(self.agent.id, self.default_prompt, preds_data)
+
         messages = []
-        for pred in graph.predecessors(self.agent.id):
-            _pred_data = mem.get_data(pred, self.agent.id, "default")
+        for _, _pred_data in preds_data:
             pred_user_prompt = _pred_data["caller_user_prompt"]
             pred_output_message = _pred_data["caller_output_message"]
             messages.append(Message(role="user", content=pred_user_prompt))
@@ -99,19 +180,100 @@ class FlowNode(Node):
 
         #TODO if action is approve, use my last output as the input for my succcessors
     
+    def materialize(self, messages: List[Message], blobs: Optional[BlobStore]) -> List[Message]:
+        ''' media references this agent can't take are dropped before its call, the ones it takes are loaded '''
+        return [m.materialize(self.input_formats, blobs) for m in messages]
+
     def exec(self, messages):
+        if self.checkpoint is not None:
+            return self.restore()
+
+        logger.info(f"Running Agent[id={self.agent.id}] with input:")
+        pprint_messages(messages)
+
+        if self.emit is None:
+            response_message = self.agent.run(messages=messages)
+        else:
+            self.emit(NodeStarted(node_id=self.agent.id))
+            for chunk in self.agent.run_stream(messages=messages):
+                response_message = self.on_stream_chunk(chunk)
+            self.emit(NodeFinished(node_id=self.agent.id, message=response_message))
+        self.record_usage(response_message)
+        
+        logger.info(f"Agent[id={self.agent.id}] complete with response:")
+        pprint_messages([response_message])
+        
+        return response_message
+
+    async def exec_async(self, messages):
+        if self.checkpoint is not None:
+            return self.restore()
 
         logger.info(f"Running Agent[id={self.agent.id}] with input:")
         pprint_messages(messages)
 
-        response_message = self.agent.run(messages=messages)
+        if self.emit is None:
+            response_message = await self.agent.arun(messages=messages)
+        else:
+            self.emit(NodeStarted(node_id=self.agent.id))
+            async for chunk in self.agent.arun_stream(messages=messages):
+                response_message = self.on_stream_chunk(chunk)
+            self.emit(NodeFinished(node_id=self.agent.id, message=response_message))
+        self.record_usage(response_message)
         
         logger.info(f"Agent[id={self.agent.id}] complete with response:")
         pprint_messages([response_message])
         
         return response_message
 
+    def record_usage(self, message: Message) -> None:
+        if message.usage is None:
+            return
+        logger.info(f"Agent[id={self.agent.id}] input tokens: {message.usage['input_tokens']}, from prompt cache: {message.usage.get('cached_tokens', 0)}")
+        if self.context is not None:
+            self.context.record_usage(self.agent.id, message.usage)
+
+    def restore(self) -> Message:
+        logger.info(f"Agent[id={self.agent.id}] {'restored from checkpoint' if self.resumed else 'unchanged, reusing stored output'}")
+        response_message = self.checkpoint["caller_output_message"]
+        if self.emit is not None:
+            self.emit(NodeFinished(node_id=self.agent.id, message=response_message))
+        return response_message
+
+    def on_stream_chunk(self, chunk: Union[str, Message]) -> Optional[Message]:
+        ''' forward text deltas, return the final message once the agent yields it '''
+        if isinstance(chunk, Message):
+            return chunk
+        self.emit(NodeDelta(node_id=self.agent.id, delta=chunk))
+        return None
+
+    def abandon(self) -> bool:
+        ''' keep the node from recording its output, False if it already started to, then it counts as finished '''
+        with self.lock:
+            if not self.posting:
+                self.abandoned = True
+            return self.abandoned
+
+    def start_post(self) -> bool:
+        with self.lock:
+            if not self.abandoned:
+                self.posting = True
+            return self.posting
+
     def post(self, shared, prep_res, exec_res: Message):
+        action, successors, data = self.output(shared, exec_res)
+        if data is not None and self.start_post():
+            shared["memory"].add_node_output(self.agent.id, successors, action, data, self.node_hash)
+        return action
+
+    async def post_async(self, shared, prep_res, exec_res: Message):
+        action, successors, data = self.output(shared, exec_res)
+        if data is not None and self.start_post():
+            await shared["memory"].add_node_output(self.agent.id, successors, action, data, self.node_hash)
+        return action
+
+    def output(self, shared, exec_res: Message) -> Tuple[str, List[NodeId], Optional[Dict[str, Any]]]:
+        ''' the action, the successors and the data to write for them, None if already written '''
         # set execution
         action = "default"
         successors = list(shared["graph"].successors(self.agent.id))
@@ -120,10 +282,12 @@ class FlowNode(Node):
             logger.debug('no successors, im the last node, writting results')
             shared["final_output_message"] = exec_res
 
-        for succ in successors:
-            shared["memory"].add_entry(caller=self.agent.id, callee=succ, action=action, data={"caller_user_prompt": self.default_prompt, "caller_output_message": exec_res})
-        
-        return action
+        # a resumed node wrote its entries before its checkpoint
+        if self.resumed:
+            return action, successors, None
+
+        data = {"caller_user_prompt": self.default_prompt, "caller_output_message": exec_res}
+        return action, successors, data
     
     # def condition(self, shared):
     #     myid = self.agent.agent_id
@@ -0,0 +1,82 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from mas.agent import Agent
+from mas.flow.events import NodeFinished, NodeStarted
+from mas.flow.executor.parallel import ParallelExecutor
+from mas.flow.executor.pocketflow import FlowNode
+from mas.graph.agent_task_graph import AgentTaskGraph
+from mas.graph.types import NodeAttr, NodeId
+from mas.message import Message, pprint_messages
+from mas.model.pool import ModelPool
+from mas.tool.pool import ToolPool
+
+logger = logging.getLogger(__name__)
+
+def preload_pools():
+    ''' default worker initializer: load builtin models and tools once per worker process '''
+    ModelPool.get_global()
+    ToolPool.get_global()
+
+def run_agent_in_worker(cls_Agent: Type[Agent], node_id: NodeId, node_attr: NodeAttr, messages: List[Message]) -> Message:
+    agent = cls_Agent(id=node_id, node_attr=node_attr)
+    return agent.run(messages=messages)
+
+'''
+Process:
+1. scheduling, memory reads (prep) and writes (post) stay in the parent, on the ParallelExecutor threads
+2. the agent call itself, including its tool calls and their parsing, runs in a worker process, so CPU-bound tools don't hold the parent's GIL
+3. workers are started once with ModelPool/ToolPool preloaded and reused across runs, call close() to stop them
+4. the agent class, node attributes and messages must be picklable; text deltas are not streamed back
+'''
+@dataclass
+class ProcessExecutor(ParallelExecutor):
+    max_processes: Optional[int] = None
+    mp_context: str = "spawn"  # forking a process that already runs threads is unsafe
+    worker_initializer: Optional[Callable[[], Any]] = preload_pools
+    process_pool: Optional[ProcessPoolExecutor] = field(default=None, init=False, repr=False)
+
+    def get_process_pool(self) -> ProcessPoolExecutor:
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=self.max_processes,
+                mp_context=multiprocessing.get_context(self.mp_context),
+                initializer=self.worker_initializer,
+            )
+        return self.process_pool
+
+    def close(self):
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+            self.process_pool = None
+
+    def run_node(self, node: FlowNode, shared: Dict[str, Any]) -> Message:
+        prep_res = node.prep(shared)
+        if node.checkpoint is not None:
+            exec_res = node.restore()
+        else:
+            exec_res = self.exec_in_worker(node, shared["graph"], prep_res)
+        node.post(shared, prep_res, exec_res)
+        return exec_res
+
+    def exec_in_worker(self, node: FlowNode, graph: AgentTaskGraph, messages: List[Message]) -> Message:
+        node_id = node.agent.id
+
+        logger.info(f"Running Agent[id={node_id}] in worker process with input:")
+        pprint_messages(messages)
+
+        if node.emit is not None:
+            node.emit(NodeStarted(node_id=node_id))
+        future = self.get_process_pool().submit(run_agent_in_worker, type(node.agent), node_id, graph.get_node_attr(node_id), messages)
+        response_message = future.result()
+        if node.emit is not None:
+            node.emit(NodeFinished(node_id=node_id, message=response_message))
+        node.record_usage(response_message)
+
+        logger.info(f"Agent[id={node_id}] complete with response:")
+        pprint_messages([response_message])
+
+        return response_message
@@ -1,4 +1,6 @@
 import logging
+from typing import Optional
+from mas.flow.events import Emit, NodeFinished, NodeStarted
 from mas.flow.executor.base import FlowExecutor
 from mas.memory.memory import FlowMemory
 from mas.message import Message
@@ -6,15 +8,24 @@ from mas.graph import AgentTaskGraph
 
 logger = logging.getLogger(__name__)
 
+'''
+SimpleSequentialExecutor: runs the nodes one by one in topological order, a smoke test of the graph
+1. each agent gets a greeting, not its predecessors' outputs, so there is nothing for a ContextBuilder to build,
+   context is ignored here, use PocketflowExecutor or the parallel executors for budgeted inputs
+'''
 class SimpleSequentialExecutor(FlowExecutor):
 
-    def run(self, graph: AgentTaskGraph, memory: FlowMemory) -> Message:
+    def run(self, graph: AgentTaskGraph, memory: FlowMemory, emit: Optional[Emit] = None) -> Message:
         self.sequential_order = list(graph.topological_sort())
 
         for node_id in self.sequential_order:
             agent = graph.nodes[node_id]["agent"]
             request = Message(role="user", content=f"Hi Agent[id={node_id}]")
+            if emit is not None:
+                emit(NodeStarted(node_id=node_id))
             response = agent.run(message=request)
+            if emit is not None:
+                emit(NodeFinished(node_id=node_id, message=response))
             request.pprint()
             response.pprint()
         logger.info("Sequential order executed successfully")
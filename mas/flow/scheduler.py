@@ -0,0 +1,96 @@
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import networkx as nx
+
+from mas.graph.agent_task_graph import AgentTaskGraph
+from mas.graph.types import NodeId
+from mas.model.pool import ModelPool
+
+logger = logging.getLogger(__name__)
+
+'''
+Scheduling:
+1. Scheduler decides which ready nodes start, and in which order, when a parallel executor has free slots
+2. a node is ready once all its predecessors completed
+3. per-model concurrency caps come from ModelPool registrations (max_concurrency), unless given explicitly
+'''
+@dataclass
+class Scheduler:
+    concurrency_limits: Optional[Dict[str, int]] = None
+    model_pool: Optional[ModelPool] = None
+
+    def start(self, graph: AgentTaskGraph) -> "Schedule":
+        return Schedule(graph, self.priorities(graph), self.get_concurrency_limits())
+
+    def priorities(self, graph: AgentTaskGraph) -> Dict[NodeId, Any]:
+        ''' lower sorts first, the base scheduler keeps topological order '''
+        return {node_id: i for i, node_id in enumerate(graph.topological_sort())}
+
+    def get_concurrency_limits(self) -> Dict[str, int]:
+        if self.concurrency_limits is not None:
+            return self.concurrency_limits
+        model_pool = self.model_pool or ModelPool._global
+        return model_pool.get_concurrency_limits() if model_pool is not None else {}
+
+@dataclass
+class CriticalPathScheduler(Scheduler):
+    '''
+    rank ready nodes by their longest remaining downstream path, so long branches start first
+    each node on the path weighs latency_estimates[model], default_latency if the model is unknown
+    '''
+    latency_estimates: Dict[str, float] = field(default_factory=dict)
+    default_latency: float = 1.0
+
+    def priorities(self, graph: AgentTaskGraph) -> Dict[NodeId, Any]:
+        sequential_order = list(graph.topological_sort())
+        remaining: Dict[NodeId, float] = {}
+        for node_id in reversed(sequential_order):
+            downstream = max((remaining[succ] for succ in graph.successors(node_id)), default=0.0)
+            remaining[node_id] = self.get_latency(graph.nodes[node_id].get("model")) + downstream
+        return {node_id: (-remaining[node_id], i) for i, node_id in enumerate(sequential_order)}
+
+    def get_latency(self, model: Optional[str]) -> float:
+        return self.latency_estimates.get(model, self.default_latency)
+
+class Schedule:
+    ''' per-run scheduling state, driven by the executor loop '''
+
+    def __init__(self, graph: AgentTaskGraph, priorities: Dict[NodeId, Any], concurrency_limits: Dict[str, int]):
+        self.graph = graph
+        self.priorities = priorities
+        self.concurrency_limits = concurrency_limits
+        self.waiting = {node_id: graph.in_degree(node_id) for node_id in graph.nodes}
+        self.ready: List[NodeId] = [node_id for node_id, n in self.waiting.items() if n == 0]
+        self.in_flight: Counter = Counter()
+
+    def has_ready(self) -> bool:
+        return bool(self.ready)
+
+    def pop_ready(self, slots: Optional[int] = None) -> List[NodeId]:
+        ''' pop up to `slots` ready nodes by priority, skipping those whose model is at its concurrency cap '''
+        self.ready.sort(key=self.priorities.__getitem__)
+        dispatch, blocked = [], []
+        for node_id in self.ready:
+            model = self.graph.nodes[node_id].get("model")
+            limit = self.concurrency_limits.get(model)
+            if (slots is not None and len(dispatch) >= slots) or (limit is not None and self.in_flight[model] >= max(limit, 1)):
+                blocked.append(node_id)
+                continue
+            self.in_flight[model] += 1
+            dispatch.append(node_id)
+        self.ready = blocked
+        return dispatch
+
+    def complete(self, node_id: NodeId) -> None:
+        self.in_flight[self.graph.nodes[node_id].get("model")] -= 1
+        for succ in self.graph.successors(node_id):
+            self.waiting[succ] -= 1
+            if self.waiting[succ] == 0:
+                self.ready.append(succ)
+
+    def skip(self, node_id: NodeId) -> List[NodeId]:
+        ''' drop an in-flight node that will not complete, returns its descendants, which can never become ready '''
+        self.in_flight[self.graph.nodes[node_id].get("model")] -= 1
+        return sorted(nx.descendants(self.graph, node_id))
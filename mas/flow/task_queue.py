@@ -0,0 +1,147 @@
+import logging
+import math
+import queue
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+import redis
+
+from mas.storage.redis import get_connection_pool
+from mas.storage.codec import decode, encode
+
+logger = logging.getLogger(__name__)
+
+'''
+Work queue between a DistributedExecutor and its FlowWorkers:
+1. tasks: one shared queue, any worker pulls the next node task
+2. results: one channel per run, only the executor driving that run reads it
+'''
+class TaskQueue(ABC):
+    @abstractmethod
+    def put_task(self, task: Dict[str, Any]) -> None:
+        pass
+
+    @abstractmethod
+    def get_task(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        ''' None if no task arrived within timeout '''
+        pass
+
+    @abstractmethod
+    def put_result(self, run_id: str, result: Dict[str, Any]) -> None:
+        pass
+
+    @abstractmethod
+    def get_result(self, run_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        ''' None if no result arrived within timeout '''
+        pass
+
+    def open_run(self, run_id: str) -> None:
+        ''' before the run's first task, so its results have a channel '''
+        pass
+
+    def close_run(self, run_id: str) -> None:
+        pass
+
+    def is_open(self, run_id: str) -> bool:
+        ''' False once the run closed, its queued tasks are skipped and late results dropped '''
+        return True
+
+class LocalTaskQueue(TaskQueue):
+    ''' in-process queue, for worker threads and tests, results of runs not open (e.g. late ones after close_run) are dropped '''
+
+    def __init__(self):
+        self.tasks = queue.Queue()
+        self.results: Dict[str, queue.Queue] = {}
+        self.lock = threading.Lock()
+
+    def put_task(self, task: Dict[str, Any]) -> None:
+        self.tasks.put(task)
+
+    def get_task(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return self.tasks.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put_result(self, run_id: str, result: Dict[str, Any]) -> None:
+        with self.lock:
+            results = self.results.get(run_id)
+        if results is None:
+            logger.debug(f"LocalTaskQueue: dropping result for closed run {run_id}")
+            return
+        results.put(result)
+
+    def get_result(self, run_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        try:
+            return self._results(run_id).get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def open_run(self, run_id: str) -> None:
+        self._results(run_id)
+
+    def close_run(self, run_id: str) -> None:
+        with self.lock:
+            self.results.pop(run_id, None)
+
+    def is_open(self, run_id: str) -> bool:
+        with self.lock:
+            return run_id in self.results
+
+    def _results(self, run_id: str) -> queue.Queue:
+        with self.lock:
+            return self.results.setdefault(run_id, queue.Queue())
+
+class RedisTaskQueue(TaskQueue):
+    '''
+    lists on a redis server shared by executors and workers on any machine
+    {prefix}:open:{run_id} marks an open run, results are only pushed while it exists (checked and pushed in one transaction),
+    marker and results expire after ttl seconds, in case the executor dies before close_run
+    '''
+
+    def __init__(self, redis_host='localhost', redis_port=6379, redis_db=0, client: Optional[redis.Redis] = None, prefix: str = "mas",
+                 ttl: Optional[float] = 24 * 3600):
+        self.r = client if client is not None else redis.Redis(connection_pool=get_connection_pool(redis_host, redis_port, redis_db))
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def put_task(self, task: Dict[str, Any]) -> None:
+        self.r.lpush(f"{self.prefix}:tasks", encode(task))
+
+    def get_task(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        return self._pop(f"{self.prefix}:tasks", timeout)
+
+    def open_run(self, run_id: str) -> None:
+        self.r.set(f"{self.prefix}:open:{run_id}", 1, ex=math.ceil(self.ttl) if self.ttl is not None else None)
+
+    def put_result(self, run_id: str, result: Dict[str, Any]) -> None:
+        open_key, results_key = f"{self.prefix}:open:{run_id}", f"{self.prefix}:results:{run_id}"
+        data = encode(result)
+
+        def push(pipe) -> bool:
+            # WATCH open_key: a close_run in between aborts the push and it is retried, finding the run closed
+            if not pipe.exists(open_key):
+                return False
+            pipe.multi()
+            pipe.lpush(results_key, data)
+            if self.ttl is not None:
+                pipe.expire(results_key, math.ceil(self.ttl))
+            return True
+
+        if not self.r.transaction(push, open_key, value_from_callable=True):
+            logger.debug(f"RedisTaskQueue: dropping result for closed run {run_id}")
+
+    def get_result(self, run_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        return self._pop(f"{self.prefix}:results:{run_id}", timeout)
+
+    def close_run(self, run_id: str) -> None:
+        self.r.delete(f"{self.prefix}:open:{run_id}", f"{self.prefix}:results:{run_id}")
+
+    def is_open(self, run_id: str) -> bool:
+        return bool(self.r.exists(f"{self.prefix}:open:{run_id}"))
+
+    def _pop(self, key: str, timeout: Optional[float]) -> Optional[Dict[str, Any]]:
+        # BRPOP blocks forever on 0 and only takes whole seconds on older servers
+        item = self.r.brpop([key], timeout=0 if timeout is None else max(1, math.ceil(timeout)))
+        return decode(item[1]) if item else None
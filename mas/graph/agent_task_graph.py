@@ -1,10 +1,13 @@
+import hashlib
+import json
 import logging
-from dataclasses import asdict
-from typing import Tuple, Iterable, List
+from dataclasses import asdict, fields
+from typing import Any, Dict, Tuple, Iterable, List
 import networkx as nx
 
 from mas.errors.graph_error import InvalidNodeError, ModalityMismatchError
 from mas.graph.types import EdgeAttr, NodeAttr, NodeId
+from mas.utils.log import PREVIEW_CHARS, LazyPformat, clip, dump_logger
 
 logger = logging.getLogger(__name__)
 
@@ -60,7 +63,38 @@ class AgentTaskGraph(nx.DiGraph):
     
     def get_node_attr(self, node_id: NodeId) -> NodeAttr:
         attr_dict = self.nodes[node_id]
-        return NodeAttr(**attr_dict)
+        # skip runtime attributes such as the "agent" added by AgentTaskFlow
+        return NodeAttr(**{f.name: attr_dict[f.name] for f in fields(NodeAttr) if f.name in attr_dict})
+
+    def get_edge_attr(self, u: NodeId, v: NodeId) -> EdgeAttr:
+        attr_dict = self.edges[u, v]
+        return EdgeAttr(**{f.name: attr_dict[f.name] for f in fields(EdgeAttr) if f.name in attr_dict})
+
+    def node_hashes(self) -> Dict[NodeId, str]:
+        '''
+        content hash per node, from its attributes and the hashes of its upstream nodes
+        editing a node changes its hash and the hashes of all its descendants, like make targets
+        '''
+        hashes = {}
+        for node_id in self.topological_sort():
+            upstream = sorted([hashes[pred], self.get_edge_attr(pred, node_id).action or ""] for pred in self.predecessors(node_id))
+            payload = json.dumps({"node": asdict(self.get_node_attr(node_id)), "upstream": upstream}, sort_keys=True)
+            hashes[node_id] = hashlib.sha256(payload.encode()).hexdigest()
+        return hashes
+
+    ''' Serialization, e.g. to checkpoint a run '''
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "nodes": [{"id": node_id, **asdict(self.get_node_attr(node_id))} for node_id in self.nodes],
+            "edges": [[fr, to, asdict(self.get_edge_attr(fr, to))] for fr, to in self.edges()],
+        }
+
+    @classmethod
+    def from_dict(cls, dic: Dict[str, Any]) -> "AgentTaskGraph":
+        nodes = [(NodeId(node["id"]), NodeAttr(**{k: v for k, v in node.items() if k != "id"})) for node in dic["nodes"]]
+        edges = [(NodeId(fr), NodeId(to), EdgeAttr(**attr)) for fr, to, attr in dic["edges"]]
+        return cls(nodes=nodes, edges=edges)
     
     ''' Graph Growing Functions '''
 
@@ -86,16 +120,18 @@ class AgentTaskGraph(nx.DiGraph):
     def out_edges(self, node):
         return super().out_edges(node)
 
-    def pprint(self):
-        import pprint
-        
-        pp = pprint.PrettyPrinter(indent=2)
+    def preview(self, max_chars: int = PREVIEW_CHARS) -> Dict[str, Any]:
+        ''' node attributes with long values clipped and the agent by class, for logs '''
+        nodes = {
+            node_id: {k: type(v).__name__ if k == "agent" else clip(v, max_chars) if isinstance(v, str) else v for k, v in data.items()}
+            for node_id, data in self.nodes(data=True)
+        }
+        return {"nodes": nodes, "edges": list(self.edges(data=True))}
 
-        logger.info("Nodes:")
-        logger.info(pp.pformat(dict(self.nodes(data=True))))
-
-        logger.info("\nEdges:")
-        logger.info(pp.pformat(list(self.edges(data=True))))
+    def pprint(self):
+        # formatted only if a handler emits the record
+        logger.info("%s", LazyPformat(self.preview))
+        dump_logger.info("%s", LazyPformat(lambda: {"nodes": dict(self.nodes(data=True)), "edges": list(self.edges(data=True))}))
 
     def plot(self):
         import matplotlib.pyplot as plt
@@ -9,8 +9,8 @@ class NodeAttr:
     prompt: str
     profile: str
     model: str
-    input_formats: List[Literal["text", "image", "video", "audio"]]
-    output_formats: List[Literal["text", "image", "video", "audio"]]
+    input_formats: List[Literal["text", "image", "video", "audio", "file"]]
+    output_formats: List[Literal["text", "image", "video", "audio", "file"]]
     tools: Optional[List[str]]=None
 
 @dataclass
@@ -1,6 +1,10 @@
+import asyncio
+import copy
 import logging
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Type, Union
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple, Type, Union
 from mas.curator.base import Curator
 from mas.orch import Orchestrator
 from mas.flow import AgentTaskFlow
@@ -9,6 +13,7 @@ from mas.tool import ToolPool
 from mas.model import ModelPool
 from mas.message import Message
 from mas.flow import FlowExecutor
+from mas.graph import AgentTaskGraph
 
 logger = logging.getLogger(__name__)
 
@@ -44,20 +49,27 @@ class MasFactory:
         ''' Generate agent task graph & Agents '''
 
         agent_task_graph = self.orch.generate(query)
+        self.prepare(agent_task_graph)
+        return self.answer(self.flow.run()) #TODO: not sure format
+
+    async def arun(self, query: Union[str, Message]) -> Message:
+        ''' Generate agent task graph & Agents, the orchestrator is blocking so keep it off the event loop '''
+
+        agent_task_graph = await asyncio.to_thread(self.orch.generate, query)
+        self.prepare(agent_task_graph)
+        return self.answer(await self.flow.arun())
+
+    def prepare(self, agent_task_graph: AgentTaskGraph) -> None:
+        ''' stages shared by run and arun: show the graph, curate it once, build the flow '''
 
         logger.info("\n----------------1.Agent Task Graph---------------\n")
-        
-        for curator  in self.curators:
-            agent_task_graph = curator.curate(agent_task_graph)
 
         agent_task_graph.pprint()
         # agent_task_graph.plot()
 
         logger.info("\n----------------2.Curations---------------\n")
 
-        for curator  in self.curators:
-            agent_task_graph = curator.curate(agent_task_graph)
-
+        agent_task_graph = self.curate(agent_task_graph)
         agent_task_graph.pprint()
 
         logger.info("\n----------------3.Execution Flow---------------\n")
@@ -70,7 +82,79 @@ class MasFactory:
 
         logger.info("\n----------------4.Run Tasks---------------\n")
 
-        response_message: Message = self.flow.run() #TODO: not sure format
+    def answer(self, response_message: Message) -> Message:
         logger.info("\n----------------Final Answer---------------\n")
-        response_message.pprint()
-        return response_message
\ No newline at end of file
+        response_message.pprint(max_chars=None)
+        return response_message
+
+    def run_many(
+        self,
+        queries: Iterable[Union[str, Message]],
+        max_concurrency: int = 4,
+        orch_concurrency: Optional[int] = None,
+        curation_concurrency: Optional[int] = None,
+    ) -> Iterator[Tuple[int, Message]]:
+        '''
+        Run a batch of queries with the stages pipelined: orchestration of the next queries overlaps with execution of earlier ones.
+        Each stage has its own concurrency limit (execution: max_concurrency, the others default to it).
+        Yields (query index, final message) in completion order; the first failure is raised and cancels the queued work.
+        '''
+        queries = list(queries)
+        results: queue.Queue = queue.Queue()
+
+        orch_pool = ThreadPoolExecutor(max_workers=orch_concurrency or max_concurrency, thread_name_prefix="mas-orch")
+        curation_pool = ThreadPoolExecutor(max_workers=curation_concurrency or max_concurrency, thread_name_prefix="mas-curation")
+        execution_pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="mas-execution")
+
+        def stage(pool: ThreadPoolExecutor, fn: Callable, arg: Any, index: int, next_stage: Optional[Callable[[int, Any], None]] = None):
+            def on_done(future: Future):
+                if future.cancelled():
+                    return
+                if future.exception() is not None:
+                    results.put((index, future.exception()))
+                elif next_stage is not None:
+                    next_stage(index, future.result())
+                else:
+                    results.put((index, future.result()))
+            try:
+                pool.submit(fn, arg).add_done_callback(on_done)
+            except RuntimeError:
+                # the batch was closed or failed and the pools shut down
+                logger.debug(f"MasFactory.run_many: query {index} dropped")
+
+        def execute(index: int, graph: AgentTaskGraph):
+            stage(execution_pool, self.execute_graph, graph, index)
+
+        def curate(index: int, graph: AgentTaskGraph):
+            stage(curation_pool, self.curate, graph, index, execute)
+
+        try:
+            for index, query in enumerate(queries):
+                stage(orch_pool, self.orch.generate, query, index, curate)
+
+            for _ in range(len(queries)):
+                index, result = results.get()
+                if isinstance(result, BaseException):
+                    raise result
+                yield index, result
+        finally:
+            for pool in (orch_pool, curation_pool, execution_pool):
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def curate(self, agent_task_graph: AgentTaskGraph) -> AgentTaskGraph:
+        for curator in self.curators:
+            agent_task_graph = curator.curate(agent_task_graph)
+        return agent_task_graph
+
+    def execute_graph(self, agent_task_graph: AgentTaskGraph) -> Message:
+        '''
+        concurrent queries can't share self.flow, each gets a copy of it with its own graph, run id and executor,
+        cls_Agent, memory storage, incremental and the executor's settings (context, scheduler, timeouts, ...) carry over
+        '''
+        flow = self.flow.model_copy(update={
+            "graph": None,
+            "run_id": None,
+            "executor": copy.copy(self.flow.executor),
+        })
+        flow.build(agent_task_graph)
+        return flow.run()
@@ -1 +1 @@
-from .memory import FlowMemory
\ No newline at end of file
+from .memory import AsyncFlowMemory, FlowMemory
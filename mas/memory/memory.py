@@ -1,41 +1,262 @@
+import asyncio
 from datetime import datetime
+from uuid import uuid4
 
+from mas.graph.agent_task_graph import AgentTaskGraph
 from mas.graph.types import NodeId
-from mas.storage.base import Storage
+from mas.message import Message
+from mas.storage.base import AsyncStorage, Storage, project
+from mas.storage.blob import BlobStore
+from mas.storage.codec import decode, encode
 from typing import Any, Dict, List, Tuple, Optional
 
+def make_entry(run_id: str, caller: NodeId, callee: NodeId, action: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "run_id": run_id,
+        "caller": caller,
+        "callee": callee,
+        "action": action,
+        "data": data,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+def make_node_record(node_id: NodeId, data: Dict[str, Any], node_hash: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "node_id": node_id,
+        "hash": node_hash,
+        "data": data,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+def make_run(graph: AgentTaskGraph) -> Dict[str, Any]:
+    return {
+        "graph": graph.to_dict(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+'''
+Blobs: with a BlobStore, messages in entry data that carry media or whose encoding reaches blob_threshold bytes
+are written to the blob store once per run and replaced by {"__blob__": key}, every entry and the node record share that key.
+The blobs are the run's, drop_run deletes them with it.
+Reads return the references, resolve() loads them, only when the messages are actually needed (FlowNode.prep)
+'''
+def is_blob_ref(value: Any) -> bool:
+    return isinstance(value, dict) and value.keys() == {"__blob__"}
+
+def offload(blobs: Optional[BlobStore], blob_threshold: int, data: Dict[str, Any], run_id: Optional[str] = None) -> Dict[str, Any]:
+    if blobs is None:
+        return data
+    offloaded = {}
+    for key, value in data.items():
+        if isinstance(value, Message):
+            encoded = encode(value)
+            # media references are a few bytes, only loaded media count
+            if len(encoded) >= blob_threshold or value.has_loaded_media():
+                value = {"__blob__": blobs.put(encoded, run_id)}
+        offloaded[key] = value
+    return offloaded
+
+def resolve(blobs: Optional[BlobStore], data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if data is None or not any(is_blob_ref(value) for value in data.values()):
+        return data
+    if blobs is None:
+        raise KeyError("entry data references blobs, but the memory has no blob store")
+    resolved = {}
+    for key, value in data.items():
+        if is_blob_ref(value):
+            blob = blobs.get(value["__blob__"])
+            if blob is None:
+                raise KeyError(f"blob {value['__blob__']} not found")
+            value = decode(blob)
+        resolved[key] = value
+    return resolved
+
+'''
+FlowMemory: one run's view on a storage, every entry it writes or reads is scoped by its run_id
+'''
 class FlowMemory:
-    def __init__(self, storage: Storage):
+    def __init__(self, storage: Storage, run_id: Optional[str] = None, incremental: bool = False, blobs: Optional[BlobStore] = None, blob_threshold: int = 4096):
         self.storage = storage
+        self.run_id = run_id if run_id is not None else uuid4().hex
+        # reuse outputs of earlier runs for nodes whose content hash did not change
+        self.incremental = incremental
+        self.blobs = blobs
+        self.blob_threshold = blob_threshold
+
+    def for_run(self, run_id: Optional[str] = None, incremental: Optional[bool] = None) -> "FlowMemory":
+        ''' a view on the same storage for another run, a new run id if not given '''
+        return FlowMemory(
+            storage=self.storage,
+            run_id=run_id,
+            incremental=self.incremental if incremental is None else incremental,
+            blobs=self.blobs,
+            blob_threshold=self.blob_threshold,
+        )
+
+    def offload(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return offload(self.blobs, self.blob_threshold, data, self.run_id)
+
+    def resolve(self, data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        ''' entry or record data with its blob references loaded '''
+        return resolve(self.blobs, data)
 
     def add_entry(self, caller: NodeId, callee: NodeId, action: str, data: Dict[str, Any]) -> None:
-        entry = {
-            "caller": caller,
-            "callee": callee,
-            "action": action,
-            "data": data,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        self.storage.add_entry(entry)
+        self.storage.add_entry(make_entry(self.run_id, caller, callee, action, self.offload(data)))
+
+    def add_entries(self, caller: NodeId, callees: List[NodeId], action: str, data: Dict[str, Any]) -> None:
+        ''' the same data from one caller to several callees, in one storage write '''
+        data = self.offload(data)
+        self.storage.add_entries([make_entry(self.run_id, caller, callee, action, data) for callee in callees])
 
     def get_entries_by_caller(self, caller: NodeId, mask: Optional[List[str]] = None) -> List[Dict[str, Any]]:
-        entries = self.storage.get_entries_by_caller(caller)
-        return self.entries_mask(entries, mask)
+        return self.storage.get_entries(self.run_id, caller=caller, fields=mask)
 
-    def get_entries_by_callee(self, callee: NodeId, mask: Optional[List[str]] = None) -> List[Tuple[NodeId, str]]:
-        entries = self.storage.get_entries_by_callee(callee)
-        return self.entries_mask(entries, mask)
+    def get_entries_by_callee(self, callee: NodeId, mask: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return self.storage.get_entries(self.run_id, callee=callee, fields=mask)
+
+    def get_entries(self, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None, mask: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        ''' filters and mask are applied by the storage, a mask without "data" never reads the messages '''
+        return self.storage.get_entries(self.run_id, caller, callee, action, since, until, mask)
+
+    def entries_mask(self, entries: List[Dict[str, Any]], keys: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        ''' keys of already read entries, the projection get_entries(mask=keys) applies in the storage '''
+        return project(entries, keys)
 
     def get_data(self, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
-        entry = self.storage.get_entry(caller, callee, action)
+        entry = self.storage.get_entry(self.run_id, caller, callee, action)
         return entry["data"] if entry else None
 
-    def entries_mask(self, entries: List[Dict[str, Any]], keys: Optional[List[str]] = None) -> List[Dict[str, Any]]:
-        if keys is None:
-            return entries  # full entry dicts
-
-        # Apply mask
-        return [
-            {k: entry[k] for k in keys if k in entry}
-            for entry in entries
-        ]
\ No newline at end of file
+    ''' Run checkpoints '''
+
+    def save_graph(self, graph: AgentTaskGraph) -> None:
+        self.storage.add_run(self.run_id, make_run(graph))
+
+    def load_graph(self) -> Optional[AgentTaskGraph]:
+        run = self.storage.get_run(self.run_id)
+        return AgentTaskGraph.from_dict(run["graph"]) if run else None
+
+    def add_node_record(self, node_id: NodeId, data: Dict[str, Any], node_hash: Optional[str] = None) -> None:
+        ''' mark a node of this run as completed, after its entries are written '''
+        self.storage.add_node_record(self.run_id, node_id, make_node_record(node_id, self.offload(data), node_hash))
+
+    def add_node_output(self, node_id: NodeId, callees: List[NodeId], action: str, data: Dict[str, Any], node_hash: Optional[str] = None) -> None:
+        ''' entries to all successors plus the completion record of a finished node, in one storage write '''
+        data = self.offload(data)
+        entries = [make_entry(self.run_id, node_id, callee, action, data) for callee in callees]
+        self.storage.add_node_output(self.run_id, node_id, entries, make_node_record(node_id, data, node_hash))
+
+    def get_node_record(self, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        record = self.storage.get_node_record(self.run_id, node_id)
+        return record["data"] if record else None
+
+    def get_node_records(self) -> Dict[NodeId, Dict[str, Any]]:
+        return {node_id: record["data"] for node_id, record in self.storage.get_node_records(self.run_id).items()}
+
+    def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        ''' output of any run for a node with the same content hash '''
+        record = self.storage.get_node_record_by_hash(node_hash)
+        return record["data"] if record else None
+
+    def drop_run(self) -> None:
+        ''' forget this run: its graph, entries, node records and blobs '''
+        self.storage.drop_run(self.run_id)
+        if self.blobs is not None:
+            self.blobs.drop_run(self.run_id)
+
+    def start_run(self) -> None:
+        self.storage.start_run(self.run_id)
+
+    def complete_run(self) -> None:
+        self.storage.complete_run(self.run_id)
+
+class AsyncFlowMemory:
+    ''' FlowMemory over an AsyncStorage, every storage call is awaited, blob store calls run on a worker thread '''
+
+    def __init__(self, storage: AsyncStorage, run_id: Optional[str] = None, incremental: bool = False, blobs: Optional[BlobStore] = None, blob_threshold: int = 4096):
+        self.storage = storage
+        self.run_id = run_id if run_id is not None else uuid4().hex
+        self.incremental = incremental
+        self.blobs = blobs
+        self.blob_threshold = blob_threshold
+
+    def for_run(self, run_id: Optional[str] = None, incremental: Optional[bool] = None) -> "AsyncFlowMemory":
+        return AsyncFlowMemory(
+            storage=self.storage,
+            run_id=run_id,
+            incremental=self.incremental if incremental is None else incremental,
+            blobs=self.blobs,
+            blob_threshold=self.blob_threshold,
+        )
+
+    async def offload(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        if self.blobs is None:
+            return data
+        return await asyncio.to_thread(offload, self.blobs, self.blob_threshold, data, self.run_id)
+
+    async def resolve(self, data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if data is None or not any(is_blob_ref(value) for value in data.values()):
+            return data
+        return await asyncio.to_thread(resolve, self.blobs, data)
+
+    async def add_entry(self, caller: NodeId, callee: NodeId, action: str, data: Dict[str, Any]) -> None:
+        await self.storage.add_entry(make_entry(self.run_id, caller, callee, action, await self.offload(data)))
+
+    async def add_entries(self, caller: NodeId, callees: List[NodeId], action: str, data: Dict[str, Any]) -> None:
+        data = await self.offload(data)
+        await self.storage.add_entries([make_entry(self.run_id, caller, callee, action, data) for callee in callees])
+
+    async def get_entries_by_caller(self, caller: NodeId, mask: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return await self.storage.get_entries(self.run_id, caller=caller, fields=mask)
+
+    async def get_entries_by_callee(self, callee: NodeId, mask: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return await self.storage.get_entries(self.run_id, callee=callee, fields=mask)
+
+    async def get_entries(self, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                          since: Optional[str] = None, until: Optional[str] = None, mask: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return await self.storage.get_entries(self.run_id, caller, callee, action, since, until, mask)
+
+    entries_mask = FlowMemory.entries_mask
+
+    async def get_data(self, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        entry = await self.storage.get_entry(self.run_id, caller, callee, action)
+        return entry["data"] if entry else None
+
+    ''' Run checkpoints '''
+
+    async def save_graph(self, graph: AgentTaskGraph) -> None:
+        await self.storage.add_run(self.run_id, make_run(graph))
+
+    async def load_graph(self) -> Optional[AgentTaskGraph]:
+        run = await self.storage.get_run(self.run_id)
+        return AgentTaskGraph.from_dict(run["graph"]) if run else None
+
+    async def add_node_record(self, node_id: NodeId, data: Dict[str, Any], node_hash: Optional[str] = None) -> None:
+        await self.storage.add_node_record(self.run_id, node_id, make_node_record(node_id, await self.offload(data), node_hash))
+
+    async def add_node_output(self, node_id: NodeId, callees: List[NodeId], action: str, data: Dict[str, Any], node_hash: Optional[str] = None) -> None:
+        data = await self.offload(data)
+        entries = [make_entry(self.run_id, node_id, callee, action, data) for callee in callees]
+        await self.storage.add_node_output(self.run_id, node_id, entries, make_node_record(node_id, data, node_hash))
+
+    async def get_node_record(self, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        record = await self.storage.get_node_record(self.run_id, node_id)
+        return record["data"] if record else None
+
+    async def get_node_records(self) -> Dict[NodeId, Dict[str, Any]]:
+        return {node_id: record["data"] for node_id, record in (await self.storage.get_node_records(self.run_id)).items()}
+
+    async def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        record = await self.storage.get_node_record_by_hash(node_hash)
+        return record["data"] if record else None
+
+    async def drop_run(self) -> None:
+        await self.storage.drop_run(self.run_id)
+        if self.blobs is not None:
+            await asyncio.to_thread(self.blobs.drop_run, self.run_id)
+
+    async def start_run(self) -> None:
+        await self.storage.start_run(self.run_id)
+
+    async def complete_run(self) -> None:
+        await self.storage.complete_run(self.run_id)
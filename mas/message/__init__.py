@@ -1 +1,2 @@
-from .message import Message, Messages, pprint_messages
\ No newline at end of file
+from .media import MediaRef
+from .message import Message, Messages, pprint_messages
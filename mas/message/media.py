@@ -0,0 +1,81 @@
+import urllib.request
+from typing import Any, Dict, List, Literal, Optional, Sequence
+from pydantic import BaseModel, model_validator
+from agno.media import Audio, File, Image, Video
+
+# Message media field -> the input format an agent must list to receive it
+MEDIA_FIELDS = {"images": "image", "videos": "video", "audios": "audio", "files": "file"}
+
+'''
+MediaRef: a media item by reference, a local path, a URL or the key of a blob in the flow memory's BlobStore
+1. it is what travels through entries and checkpoints, a few bytes however large the media
+2. FlowNode materializes it into agno media only for agents whose input_formats include its modality,
+   the other agents get the message without it, loaded agno media is left as it is
+3. path and URL references stay lazy after materializing where agno supports it, agno reads them when calling the model
+'''
+class MediaRef(BaseModel):
+    kind: Literal["image", "video", "audio", "file"]
+    path: Optional[str] = None
+    url: Optional[str] = None
+    blob: Optional[str] = None  # BlobStore key
+    format: Optional[str] = None  # e.g. png, mp4, wav
+    mime_type: Optional[str] = None  # files only
+
+    @model_validator(mode="after")
+    def validate_source(self):
+        if sum(source is not None for source in (self.path, self.url, self.blob)) != 1:
+            raise ValueError("MediaRef needs exactly one of path, url or blob")
+        return self
+
+    @classmethod
+    def from_bytes(cls, blobs, kind: str, data: bytes, run_id: Optional[str] = None, **kwargs) -> "MediaRef":
+        ''' store the bytes in the blob store once, reference them by key, with a run id the blob is dropped with the run '''
+        return cls(kind=kind, blob=blobs.put(data, run_id), **kwargs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self.model_dump(exclude_none=True)
+
+    def read(self, blobs=None) -> bytes:
+        if self.blob is not None:
+            if blobs is None:
+                raise KeyError(f"MediaRef to blob {self.blob}, but no blob store is given")
+            data = blobs.get(self.blob)
+            if data is None:
+                raise KeyError(f"blob {self.blob} not found")
+            return data
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                return f.read()
+        with urllib.request.urlopen(self.url) as response:
+            return response.read()
+
+    def materialize(self, blobs=None):
+        ''' the agno media object to send to a model, only blob references (and video URLs, agno has no video URL) are read here '''
+        if self.kind == "image":
+            if self.blob is None:
+                return Image(filepath=self.path, url=self.url, format=self.format)
+            return Image(content=self.read(blobs), format=self.format)
+        if self.kind == "audio":
+            if self.blob is None:
+                return Audio(filepath=self.path, url=self.url, format=self.format)
+            return Audio(content=self.read(blobs), format=self.format)
+        if self.kind == "video":
+            if self.path is not None:
+                return Video(filepath=self.path, format=self.format)
+            return Video(content=self.read(blobs), format=self.format)
+        if self.blob is None:
+            return File(filepath=self.path, url=self.url, mime_type=self.mime_type)
+        return File(content=self.read(blobs), mime_type=self.mime_type)
+
+def materialize_media(media: Optional[Sequence[Any]], blobs=None) -> Optional[List[Any]]:
+    if media is None or not any(isinstance(m, MediaRef) for m in media):
+        return media
+    return [m.materialize(blobs) if isinstance(m, MediaRef) else m for m in media]
+
+def strip_refs(media: Optional[Sequence[Any]]) -> Optional[List[Any]]:
+    if media is None or not any(isinstance(m, MediaRef) for m in media):
+        return media
+    return [m for m in media if not isinstance(m, MediaRef)] or None
+
+def has_refs(media: Optional[Sequence[Any]]) -> bool:
+    return media is not None and any(isinstance(m, MediaRef) for m in media)
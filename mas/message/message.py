@@ -1,8 +1,9 @@
 import logging
-import json
 from typing import List, Dict, Sequence, Optional, Union, Any
 from pydantic import BaseModel
 from agno.media import Audio, File, Image, Video
+from mas.utils.log import PREVIEW_CHARS, LazyJson, clip, dump_logger
+from mas.message.media import MEDIA_FIELDS, MediaRef, has_refs, materialize_media, strip_refs
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +14,13 @@ class Message(BaseModel):
     content: Optional[Union[List[Any], str]] = None
     # The func def of the tool calls
     tool_calls: Optional[List[Dict[str, Any]]] = None
-    # Additional modalities
-    audios: Optional[Sequence[Audio]] = None
-    images: Optional[Sequence[Image]] = None
-    videos: Optional[Sequence[Video]] = None
-    files: Optional[Sequence[File]] = None
+    # Additional modalities, loaded media or references to it (see MediaRef)
+    audios: Optional[Sequence[Union[MediaRef, Audio]]] = None
+    images: Optional[Sequence[Union[MediaRef, Image]]] = None
+    videos: Optional[Sequence[Union[MediaRef, Video]]] = None
+    files: Optional[Sequence[Union[MediaRef, File]]] = None
+    # tokens of the model call that produced the message: input_tokens, output_tokens, cached_tokens (input served from the provider's prompt cache)
+    usage: Optional[Dict[str, int]] = None
 
     def to_dict(self) -> Dict[str, Any]:
         """Returns the message as a dictionary."""
@@ -41,16 +44,44 @@ class Message(BaseModel):
         
         return message_dict
     
-    def pprint(self):
-        logger.info(json.dumps(self.to_dict(), indent=2))
+    def has_loaded_media(self) -> bool:
+        return any(not isinstance(m, MediaRef) for name in MEDIA_FIELDS for m in getattr(self, name) or [])
+
+    def has_media_refs(self) -> bool:
+        return any(has_refs(getattr(self, name)) for name in MEDIA_FIELDS)
+
+    def materialize(self, input_formats: Sequence[str], blobs=None) -> "Message":
+        ''' the message as an agent with these input formats gets it: references it takes loaded, the others dropped, loaded media kept '''
+        update = {}
+        for name, modality in MEDIA_FIELDS.items():
+            media = getattr(self, name)
+            if has_refs(media):
+                update[name] = materialize_media(media, blobs) if modality in input_formats else strip_refs(media)
+        return self.model_copy(update=update) if update else self
+    
+    def preview(self, max_chars: Optional[int] = PREVIEW_CHARS) -> Dict[str, Any]:
+        """A bounded summary for logs: content clipped to max_chars (None keeps it whole), tool calls and media counted."""
+        preview = {"role": self.role}
+        if self.content is not None:
+            preview["content"] = clip(self.content if isinstance(self.content, str) else repr(self.content), max_chars)
+        if self.tool_calls:
+            preview["tool_calls"] = len(self.tool_calls)
+        for name in MEDIA_FIELDS:
+            if getattr(self, name):
+                preview[name] = len(getattr(self, name))
+        return preview
+
+    def pprint(self, max_chars: Optional[int] = PREVIEW_CHARS):
+        # serialized only if a handler emits the record
+        logger.info("%s", LazyJson(lambda: self.preview(max_chars)))
+        dump_logger.info("%s", LazyJson(self.to_dict))
         
 Messages = Optional[List[Union[Dict, Message]]]
 
 def pprint_messages(messages: Messages) -> None:
-    """Pretty print the Messages object."""
+    """Pretty print the Messages object, lazily, see mas.utils.log."""
     if messages is None:
         logging.warning("No messages to display.")
     else:
-        logger.info("\n=======Messages=====\n")
-        logger.info(json.dumps([m.to_dict() for m in messages], indent=2))
-        logger.info("\n=======End=======\n")
\ No newline at end of file
+        logger.info("Messages:\n%s", LazyJson(lambda: [m.preview() if isinstance(m, Message) else m for m in messages]))
+        dump_logger.info("Messages:\n%s", LazyJson(lambda: [m.to_dict() if isinstance(m, Message) else m for m in messages]))
@@ -1,6 +1,6 @@
 from __future__ import annotations
 import logging
-from typing import Callable, Optional, Type
+from typing import Callable, Dict, Optional, Type
 from agno.models.base import Model
 from mas.agent.base import Agent
 from mas.pool import Pool
@@ -13,6 +13,22 @@ ModelType = Type[Model]
 class ModelPool(Pool[ModelType]):
     _global: Optional["ModelPool"] = None
 
+    def __init__(self):
+        super().__init__()
+        self._concurrency_limits: Dict[str, int] = {}
+
+    def add(self, name: str, obj: ModelType, description: str = "", max_concurrency: Optional[int] = None):
+        super().add(name, obj, description)
+        if max_concurrency is not None:
+            self._concurrency_limits[name] = max_concurrency
+
+    def get_concurrency_limit(self, name: str) -> Optional[int]:
+        ''' max in-flight calls per flow run for a model, None means unlimited '''
+        return self._concurrency_limits.get(name)
+
+    def get_concurrency_limits(self) -> Dict[str, int]:
+        return dict(self._concurrency_limits)
+
     @classmethod
     def initialize(cls, load_builtin=True, ext_dir: str = None) -> ModelPool:
         pool = cls()
@@ -43,16 +59,17 @@ class ModelPool(Pool[ModelType]):
         logger.debug(f"After autoload, model count: {self.count()}")
     
     @classmethod
-    def register(cls, name: str, description: str = "") -> Callable[[ModelType], ModelType]:
+    def register(cls, name: str, description: str = "", max_concurrency: Optional[int] = None) -> Callable[[ModelType], ModelType]:
         """
         Decorator to register a model class into the global ModelPool instace.
+        max_concurrency caps the in-flight calls to this model within a flow run, e.g. to respect provider rate limits.
 
         Usage:
-            @ModelPool.register(name="model_name", description="my own model")
+            @ModelPool.register(name="model_name", description="my own model", max_concurrency=4)
             model_name = MyModel(...)
         """
         def decorator(model_cls: ModelType):
-            cls._global.add(name=name, obj=model_cls, description=description)
+            cls._global.add(name=name, obj=model_cls, description=description, max_concurrency=max_concurrency)
             return model_cls
         return decorator
     
@@ -1,4 +1,6 @@
-from .base import Storage
-from .mem import InMemoryStorage
-from .redis import RedisStorage
-from .sqlite import SqliteStorage
\ No newline at end of file
+from .blob import BlobStore, FileBlobStore, InMemoryBlobStore, RedisBlobStore
+from .base import AsyncStorage, Storage, ThreadedAsyncStorage
+from .log import LogStorage
+from .mem import AsyncInMemoryStorage, BoundedInMemoryStorage, InMemoryStorage
+from .redis import AsyncRedisStorage, RedisStorage
+from .sqlite import AsyncSqliteStorage, SqliteStorage
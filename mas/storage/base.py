@@ -1,21 +1,235 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import Any, Dict, List, Tuple, Optional
 
 from mas.graph.types import NodeId
 
+def entry_matches(entry: Dict[str, Any], caller: Optional[NodeId], callee: Optional[NodeId], action: Optional[str], since: Optional[str], until: Optional[str]) -> bool:
+    ''' since and until are isoformat timestamps, like the entries', both inclusive '''
+    return (caller is None or entry["caller"] == caller) and \
+        (callee is None or entry["callee"] == callee) and \
+        (action is None or entry["action"] == action) and \
+        (since is None or entry["timestamp"] >= since) and \
+        (until is None or entry["timestamp"] <= until)
+
+def project(entries: List[Dict[str, Any]], fields: Optional[List[str]]) -> List[Dict[str, Any]]:
+    if fields is None:
+        return entries  # full entry dicts
+    return [{k: entry[k] for k in fields if k in entry} for entry in entries]
+
+def needs_data(fields: Optional[List[str]]) -> bool:
+    return fields is None or "data" in fields
+
+'''
+Storage: entries between agents, scoped by the "run_id" of each entry, so concurrent runs can share one backend
+backends given a ttl (seconds) forget a run that long after its last write, drop_run forgets it at once
+'''
 class Storage(ABC):
     @abstractmethod
     def add_entry(self, entry: Dict[str, Any]) -> None:
         pass
 
+    def add_entries(self, entries: List[Dict[str, Any]]) -> None:
+        ''' backends override this to write all entries in one round-trip '''
+        for entry in entries:
+            self.add_entry(entry)
+
+    @abstractmethod
+    def get_entries_by_caller(self, run_id: str, caller: NodeId) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def get_entries_by_callee(self, run_id: str, callee: NodeId) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def get_entry(self, run_id: str, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    def get_entries(self, run_id: str, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        '''
+        entries from caller and/or to callee, filtered by action and timestamp, with only the given fields (all if None)
+        backends override this to filter and project where the data is, so e.g. bookkeeping reads never decode "data"
+        '''
+        if caller is not None:
+            entries = self.get_entries_by_caller(run_id, caller)
+        elif callee is not None:
+            entries = self.get_entries_by_callee(run_id, callee)
+        else:
+            raise ValueError("get_entries needs a caller or a callee")
+        return project([e for e in entries if entry_matches(e, caller, callee, action, since, until)], fields)
+
+    ''' 
+    Run checkpoints: the run itself (e.g. its graph) and a completion record per finished node
+    records carrying a content "hash" are also found across runs by that hash
+    '''
+
+    @abstractmethod
+    def add_run(self, run_id: str, run: Dict[str, Any]) -> None:
+        pass
+
+    @abstractmethod
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def add_node_record(self, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        pass
+
+    def add_node_output(self, run_id: str, node_id: NodeId, entries: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        ''' a finished node's entries to its successors, then its completion record; backends override this to write both at once '''
+        self.add_entries(entries)
+        self.add_node_record(run_id, node_id, record)
+
+    @abstractmethod
+    def get_node_record(self, run_id: str, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def get_node_records(self, run_id: str) -> Dict[NodeId, Dict[str, Any]]:
+        pass
+
     @abstractmethod
-    def get_entries_by_caller(self, caller: NodeId) -> List[Dict[str, Any]]:
+    def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
         pass
 
     @abstractmethod
-    def get_entries_by_callee(self, callee: NodeId) -> List[Dict[str, Any]]:
+    def drop_run(self, run_id: str) -> None:
+        ''' delete the run, its entries and its node records '''
+        pass
+
+    def start_run(self, run_id: str) -> None:
+        ''' the run (new or resumed) is executing, bounded backends keep it until complete_run '''
+        pass
+
+    def complete_run(self, run_id: str) -> None:
+        ''' the run finished, nothing more is written for it, bounded backends may now evict it '''
         pass
 
+'''
+AsyncStorage: same contract as Storage, for async executors that must not block their event loop
+'''
+class AsyncStorage(ABC):
     @abstractmethod
-    def get_entry(self, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
-        pass
\ No newline at end of file
+    async def add_entry(self, entry: Dict[str, Any]) -> None:
+        pass
+
+    async def add_entries(self, entries: List[Dict[str, Any]]) -> None:
+        for entry in entries:
+            await self.add_entry(entry)
+
+    @abstractmethod
+    async def get_entries_by_caller(self, run_id: str, caller: NodeId) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def get_entries_by_callee(self, run_id: str, callee: NodeId) -> List[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def get_entry(self, run_id: str, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    async def get_entries(self, run_id: str, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                          since: Optional[str] = None, until: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        if caller is not None:
+            entries = await self.get_entries_by_caller(run_id, caller)
+        elif callee is not None:
+            entries = await self.get_entries_by_callee(run_id, callee)
+        else:
+            raise ValueError("get_entries needs a caller or a callee")
+        return project([e for e in entries if entry_matches(e, caller, callee, action, since, until)], fields)
+
+    @abstractmethod
+    async def add_run(self, run_id: str, run: Dict[str, Any]) -> None:
+        pass
+
+    @abstractmethod
+    async def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def add_node_record(self, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        pass
+
+    async def add_node_output(self, run_id: str, node_id: NodeId, entries: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        await self.add_entries(entries)
+        await self.add_node_record(run_id, node_id, record)
+
+    @abstractmethod
+    async def get_node_record(self, run_id: str, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def get_node_records(self, run_id: str) -> Dict[NodeId, Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    async def drop_run(self, run_id: str) -> None:
+        pass
+
+    async def start_run(self, run_id: str) -> None:
+        pass
+
+    async def complete_run(self, run_id: str) -> None:
+        pass
+
+class ThreadedAsyncStorage(AsyncStorage):
+    ''' any blocking Storage as an AsyncStorage, each call runs in a worker thread '''
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+
+    async def add_entry(self, entry: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.storage.add_entry, entry)
+
+    async def add_entries(self, entries: List[Dict[str, Any]]) -> None:
+        await asyncio.to_thread(self.storage.add_entries, entries)
+
+    async def get_entries_by_caller(self, run_id: str, caller: NodeId) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.storage.get_entries_by_caller, run_id, caller)
+
+    async def get_entries_by_callee(self, run_id: str, callee: NodeId) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.storage.get_entries_by_callee, run_id, callee)
+
+    async def get_entry(self, run_id: str, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.storage.get_entry, run_id, caller, callee, action)
+
+    async def get_entries(self, run_id: str, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                          since: Optional[str] = None, until: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.storage.get_entries, run_id, caller, callee, action, since, until, fields)
+
+    async def add_run(self, run_id: str, run: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.storage.add_run, run_id, run)
+
+    async def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.storage.get_run, run_id)
+
+    async def add_node_record(self, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.storage.add_node_record, run_id, node_id, record)
+
+    async def add_node_output(self, run_id: str, node_id: NodeId, entries: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.storage.add_node_output, run_id, node_id, entries, record)
+
+    async def get_node_record(self, run_id: str, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.storage.get_node_record, run_id, node_id)
+
+    async def get_node_records(self, run_id: str) -> Dict[NodeId, Dict[str, Any]]:
+        return await asyncio.to_thread(self.storage.get_node_records, run_id)
+
+    async def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.storage.get_node_record_by_hash, node_hash)
+
+    async def drop_run(self, run_id: str) -> None:
+        await asyncio.to_thread(self.storage.drop_run, run_id)
+
+    async def start_run(self, run_id: str) -> None:
+        await asyncio.to_thread(self.storage.start_run, run_id)
+
+    async def complete_run(self, run_id: str) -> None:
+        await asyncio.to_thread(self.storage.complete_run, run_id)
@@ -0,0 +1,193 @@
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple
+import redis
+from mas.storage.redis import get_connection_pool
+
+'''
+Blob stores: content addressed, a blob's key is the sha256 of its bytes,
+so a payload referenced by many entries, runs or flows is stored once
+Blobs put for a run are keyed {run_id}/{sha256}, stored once per run, and live as long as the run:
+drop_run deletes them, and with a ttl they are deleted ttl seconds after the run's last blob write,
+like the storages forget the run's entries (checked whenever a run writes its first blob, RedisBlobStore expires keys)
+'''
+class BlobStore(ABC):
+    @staticmethod
+    def key(data: bytes, run_id: Optional[str] = None) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        return digest if run_id is None else f"{run_id}/{digest}"
+
+    def put(self, data: bytes, run_id: Optional[str] = None) -> str:
+        ''' store the bytes, return their key, a no-op if the store already has them '''
+        key = self.key(data, run_id)
+        if not self.has(key):
+            self.write(key, data)
+        return key
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def has(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def write(self, key: str, data: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def drop_run(self, run_id: str) -> None:
+        ''' delete the blobs put for the run '''
+        pass
+
+def split_key(key: str) -> Tuple[Optional[str], str]:
+    ''' (run id or None, sha256) '''
+    run_id, _, digest = key.rpartition("/")
+    return run_id or None, digest
+
+class InMemoryBlobStore(BlobStore):
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self.blobs: Dict[str, bytes] = {}
+        self.last_write: Dict[str, float] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.blobs.get(key)
+
+    def has(self, key: str) -> bool:
+        return key in self.blobs
+
+    def write(self, key: str, data: bytes) -> None:
+        run_id, _ = split_key(key)
+        if run_id is not None and self.ttl is not None:
+            if run_id not in self.last_write:
+                self.expire_runs()
+            self.last_write[run_id] = time.monotonic()
+        self.blobs[key] = data
+
+    def delete(self, key: str) -> None:
+        self.blobs.pop(key, None)
+
+    def drop_run(self, run_id: str) -> None:
+        self.last_write.pop(run_id, None)
+        prefix = f"{run_id}/"
+        for key in [key for key in self.blobs if key.startswith(prefix)]:
+            del self.blobs[key]
+
+    def expire_runs(self) -> None:
+        deadline = time.monotonic() - self.ttl
+        for run_id in [run_id for run_id, last_write in self.last_write.items() if last_write < deadline]:
+            self.drop_run(run_id)
+
+class FileBlobStore(BlobStore):
+    '''
+    one file per blob under root/{key[:2]}/{key}, a run's under root/runs/{run_id}/{key[:2]}/{key},
+    written to a temporary file then renamed, readers never see a partial blob
+    '''
+
+    def __init__(self, root: str = "tmp/blobs", ttl: Optional[float] = None):
+        self.root = root
+        self.ttl = ttl
+        os.makedirs(root, exist_ok=True)
+
+    def run_dir(self, run_id: str) -> str:
+        return os.path.join(self.root, "runs", run_id)
+
+    def path(self, key: str) -> str:
+        run_id, digest = split_key(key)
+        root = self.root if run_id is None else self.run_dir(run_id)
+        return os.path.join(root, digest[:2], digest)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def has(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def write(self, key: str, data: bytes) -> None:
+        run_id, _ = split_key(key)
+        if run_id is not None and self.ttl is not None and not os.path.exists(self.run_dir(run_id)):
+            self.expire_runs()
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        if run_id is not None:
+            # the run directory's mtime is the run's last blob write
+            os.utime(self.run_dir(run_id))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def drop_run(self, run_id: str) -> None:
+        shutil.rmtree(self.run_dir(run_id), ignore_errors=True)
+
+    def expire_runs(self) -> None:
+        deadline = time.time() - self.ttl
+        runs = os.path.join(self.root, "runs")
+        if not os.path.isdir(runs):
+            return
+        for entry in os.scandir(runs):
+            if entry.is_dir() and entry.stat().st_mtime < deadline:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+class RedisBlobStore(BlobStore):
+    '''
+    blob:{key} keys, with a ttl every put restarts the expiry, so a blob lives as long as the runs still writing it,
+    blob_run:{run_id} holds the keys of a run's blobs, for drop_run
+    '''
+
+    def __init__(self, redis_host='localhost', redis_port=6379, redis_db=0, client: Optional[redis.Redis] = None, ttl: Optional[float] = None):
+        self.r = client if client is not None else redis.Redis(connection_pool=get_connection_pool(redis_host, redis_port, redis_db))
+        self.ttl = ttl
+
+    def put(self, data: bytes, run_id: Optional[str] = None) -> str:
+        # no EXISTS round trip first, SET NX already makes a repeated put a no-op
+        key = self.key(data, run_id)
+        self.write(key, data)
+        return key
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.r.get(f"blob:{key}")
+
+    def has(self, key: str) -> bool:
+        return bool(self.r.exists(f"blob:{key}"))
+
+    def write(self, key: str, data: bytes) -> None:
+        run_id, _ = split_key(key)
+        keys = [f"blob:{key}"]
+        pipe = self.r.pipeline()
+        pipe.set(f"blob:{key}", data, nx=True)
+        if run_id is not None:
+            pipe.sadd(f"blob_run:{run_id}", f"blob:{key}")
+            keys.append(f"blob_run:{run_id}")
+        if self.ttl is not None:
+            for k in keys:
+                pipe.expire(k, math.ceil(self.ttl))
+        pipe.execute()
+
+    def delete(self, key: str) -> None:
+        self.r.delete(f"blob:{key}")
+
+    def drop_run(self, run_id: str) -> None:
+        keys = self.r.smembers(f"blob_run:{run_id}")
+        self.r.delete(*keys, f"blob_run:{run_id}")
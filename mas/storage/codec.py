@@ -0,0 +1,142 @@
+import base64
+import json
+from abc import ABC, abstractmethod
+from pathlib import PurePath
+from typing import Any, Dict, Union
+import msgpack
+
+from mas.message import Message
+
+'''
+Codecs: how persisted storages turn entries, node records and runs into bytes
+1. Message is encoded from its python dump, media keep their raw bytes (msgpack) or base64 (json codecs), and round-trip
+2. every payload starts with a one byte tag naming its codec and format version,
+   so any codec reads what another one wrote, and untagged json from before codecs existed
+3. msgpack is the default: compact, binary media without base64, several times faster than json with pydantic dumps
+'''
+
+MESSAGE_EXT = 1
+
+def message_to_dict(message: Message) -> Dict[str, Any]:
+    return message.model_dump(exclude_none=True)
+
+def message_from_dict(dic: Dict[str, Any]) -> Message:
+    return Message.model_validate(dic)
+
+class Codec(ABC):
+    tag: bytes
+
+    def encode(self, obj: Any) -> bytes:
+        return self.tag + self.dumps(obj)
+
+    def decode(self, data: Union[bytes, memoryview, str]) -> Any:
+        return decode(data)
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> bytes:
+        pass
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        pass
+
+class MsgpackCodec(Codec):
+    tag = b"\x01"  # msgpack, v1
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(self._to_ext(obj), default=self._default, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        # int keys are node ids, e.g. of get_node_records
+        return msgpack.unpackb(data, ext_hook=self._ext_hook, raw=False, strict_map_key=False)
+
+    def _to_ext(self, obj: Any) -> Any:
+        # messages are swapped for ExtTypes before packing, packing them from the default hook is several times slower
+        if isinstance(obj, Message):
+            return msgpack.ExtType(MESSAGE_EXT, msgpack.packb(message_to_dict(obj), default=self._default, use_bin_type=True))
+        if isinstance(obj, dict):
+            return {k: self._to_ext(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [self._to_ext(v) for v in obj]
+        return obj
+
+    def _default(self, obj: Any) -> Any:
+        if isinstance(obj, PurePath):  # media filepath
+            return str(obj)
+        raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+
+    def _ext_hook(self, code: int, data: bytes) -> Any:
+        if code == MESSAGE_EXT:
+            return message_from_dict(self.loads(data))
+        return msgpack.ExtType(code, data)
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, Message):
+        return {"__message__": message_to_dict(obj)}
+    if isinstance(obj, bytes):
+        return {"__bytes__": base64.b64encode(obj).decode()}
+    if isinstance(obj, PurePath):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _json_object_hook(dic: dict) -> Any:
+    if "__bytes__" in dic:
+        return base64.b64decode(dic["__bytes__"])
+    if "__message__" in dic:
+        return message_from_dict(dic["__message__"])
+    return dic
+
+def _revive(obj: Any) -> Any:
+    ''' _json_object_hook applied bottom up, for parsers without an object hook '''
+    if isinstance(obj, dict):
+        return _json_object_hook({k: _revive(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return [_revive(v) for v in obj]
+    return obj
+
+class JsonCodec(Codec):
+    ''' stdlib json, readable payloads, no extra dependency '''
+    tag = b"\x02"  # json, v1
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, default=_json_default).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(bytes(data), object_hook=_json_object_hook)
+
+class OrjsonCodec(Codec):
+    ''' readable payloads like JsonCodec, at close to msgpack speed, needs orjson '''
+    tag = b"\x03"  # orjson, v1
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def dumps(self, obj: Any) -> bytes:
+        # orjson encodes dicts natively, its default only sees Message and bytes
+        return self.orjson.dumps(obj, default=_json_default, option=self.orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data: bytes) -> Any:
+        return _revive(self.orjson.loads(data))
+
+_codecs: Dict[bytes, Codec] = {}
+
+def codec_for(tag: bytes) -> Codec:
+    if tag not in _codecs:
+        _codecs[tag] = {MsgpackCodec.tag: MsgpackCodec, JsonCodec.tag: JsonCodec, OrjsonCodec.tag: OrjsonCodec}[tag]()
+    return _codecs[tag]
+
+def decode(data: Union[bytes, memoryview, str]) -> Any:
+    ''' a memoryview, e.g. on an mmap, is decoded without copying it first (msgpack, orjson) '''
+    if isinstance(data, str):
+        data = data.encode()
+    tag = bytes(data[:1])
+    if tag in (MsgpackCodec.tag, JsonCodec.tag, OrjsonCodec.tag):
+        return codec_for(tag).loads(data[1:])
+    # untagged: json written before codecs existed
+    return _revive(json.loads(bytes(data)))
+
+default_codec: Codec = MsgpackCodec()
+
+def encode(obj: Any) -> bytes:
+    return default_codec.encode(obj)
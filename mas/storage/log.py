@@ -0,0 +1,316 @@
+import glob
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from mas.graph.types import NodeId
+from mas.storage.base import Storage, entry_matches, needs_data, project
+from mas.storage.codec import Codec, default_codec
+
+logger = logging.getLogger(__name__)
+
+'''
+Append-only log:
+1. every write appends records to the active segment file, a record is
+   [payload length, crc32 of the payload, kind, unix time][codec payload]
+2. the index (run -> caller/callee/(caller, callee, action) -> record location) lives in memory,
+   rebuilt by scanning the segments on open, a torn record at the tail of the last segment is cut off
+3. reads decode straight from mmaps of the segments, no read() copies
+4. the active segment rolls into a new one past segment_size bytes
+5. drop_run appends a tombstone, compact() rewrites the sealed segments with only the records still indexed,
+   dropping tombstoned, expired (ttl) and superseded records
+'''
+
+HEADER = struct.Struct("<IIBd")
+ENTRY, RUN, NODE_RECORD, DROP, COMPACTED = range(5)
+
+Location = Tuple[int, int, int]  # segment, payload offset, payload length
+
+class RunIndex:
+    ''' locations of one run's records '''
+
+    def __init__(self):
+        self.entries: List[Location] = []
+        self.fields: Dict[Location, Dict[str, Any]] = {}  # every field but "data", filters and projections without reads
+        self.caller_index: Dict[NodeId, List[Location]] = defaultdict(list)
+        self.callee_index: Dict[NodeId, List[Location]] = defaultdict(list)
+        self.entry_index: Dict[Tuple[NodeId, NodeId, str], Location] = {}
+        self.run: Optional[Location] = None
+        self.node_records: Dict[NodeId, Location] = {}
+        self.hashes: Dict[str, Location] = {}
+        self.last_write = 0.0
+
+    def locations(self) -> List[Location]:
+        return self.entries + list(self.node_records.values()) + ([self.run] if self.run is not None else [])
+
+class LogStorage(Storage):
+    def __init__(self, root: str = "tmp/flow_log", segment_size: int = 64 * 2**20, fsync: bool = False, ttl: Optional[float] = None, codec: Optional[Codec] = None):
+        self.root = root
+        self.segment_size = segment_size
+        # flush() survives a process crash, fsync also a power loss
+        self.fsync = fsync
+        self.ttl = ttl
+        self.codec = codec if codec is not None else default_codec
+        self.lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+        for tmp_path in glob.glob(os.path.join(root, "*.tmp")):
+            os.remove(tmp_path)  # an interrupted compaction
+        self.maps: Dict[int, mmap.mmap] = {}
+        self.open_index()
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.root, f"segment-{segment:08d}.log")
+
+    def segments(self) -> List[int]:
+        return sorted(int(os.path.basename(path)[8:16]) for path in glob.glob(os.path.join(self.root, "segment-*.log")))
+
+    ''' Index '''
+
+    def open_index(self) -> None:
+        self.runs: Dict[str, RunIndex] = defaultdict(RunIndex)
+        self.hash_index: Dict[str, Tuple[str, Location]] = {}
+        segments = self.segments()
+        skipped = set()
+        for i, segment in enumerate(segments):
+            if segment in skipped:
+                os.remove(self.segment_path(segment))
+                continue
+            for kind, written, payload, location in self.scan(segment, last=i == len(segments) - 1):
+                if kind == COMPACTED:
+                    # the compaction renamed its output to this segment, the ones it replaced may not be deleted yet
+                    skipped.update(range(segment + 1, payload["through"] + 1))
+                else:
+                    self.index(kind, written, payload, location)
+        self.active_segment = segments[-1] if segments else 0
+        self.active = open(self.segment_path(self.active_segment), "ab")
+
+    def scan(self, segment: int, last: bool):
+        path = self.segment_path(segment)
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset < len(data):
+            if offset + HEADER.size > len(data):
+                break
+            length, crc, kind, written = HEADER.unpack_from(data, offset)
+            start = offset + HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            yield kind, written, self.codec.decode(payload), (segment, start, length)
+            offset = start + length
+        if offset < len(data):
+            if not last:
+                raise IOError(f"{path} is corrupted at offset {offset}")
+            logger.warning(f"LogStorage: dropping a torn record at the end of {path}, offset {offset}")
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+    def index(self, kind: int, written: float, payload: Dict[str, Any], location: Location) -> None:
+        if kind == DROP:
+            self.forget(payload["run_id"])
+            return
+        run = self.runs[payload["run_id"]]
+        run.last_write = max(run.last_write, written)
+        if kind == ENTRY:
+            key = (payload["caller"], payload["callee"], payload["action"])
+            run.entries.append(location)
+            run.fields[location] = {k: payload[k] for k in ("run_id", "caller", "callee", "action", "timestamp")}
+            run.caller_index[key[0]].append(location)
+            run.callee_index[key[1]].append(location)
+            run.entry_index[key] = location
+        elif kind == RUN:
+            run.run = location
+        elif kind == NODE_RECORD:
+            run.node_records[payload["node_id"]] = location
+            node_hash = payload["record"].get("hash")
+            if node_hash is not None:
+                run.hashes[node_hash] = location
+                self.hash_index[node_hash] = (payload["run_id"], location)
+
+    def forget(self, run_id: str) -> None:
+        run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+        for node_hash, location in run.hashes.items():
+            # keep the hash if a later run recorded it again
+            if self.hash_index.get(node_hash, (None, None))[1] == location:
+                del self.hash_index[node_hash]
+
+    ''' Writes '''
+
+    def append(self, records: List[Tuple[int, Dict[str, Any]]]) -> None:
+        with self.lock:
+            now = time.time()
+            offset = self.active.tell()
+            chunks, indexed = [], []
+            for kind, payload in records:
+                data = self.codec.encode(payload)
+                chunks.append(HEADER.pack(len(data), zlib.crc32(data), kind, now))
+                chunks.append(data)
+                indexed.append((kind, payload, (self.active_segment, offset + HEADER.size, len(data))))
+                offset += HEADER.size + len(data)
+            # one write, a crash tears at most the tail, which the next open cuts off
+            self.active.write(b"".join(chunks))
+            self.active.flush()
+            if self.fsync:
+                os.fsync(self.active.fileno())
+            for kind, payload, location in indexed:
+                self.index(kind, now, payload, location)
+            if offset >= self.segment_size:
+                self.roll()
+
+    def roll(self) -> None:
+        self.active.close()
+        self.active_segment += 1
+        self.active = open(self.segment_path(self.active_segment), "ab")
+
+    def add_entry(self, entry: Dict[str, Any]) -> None:
+        self.append([(ENTRY, entry)])
+
+    def add_entries(self, entries: List[Dict[str, Any]]) -> None:
+        if entries:
+            self.append([(ENTRY, entry) for entry in entries])
+
+    def add_run(self, run_id: str, run: Dict[str, Any]) -> None:
+        # a new run is a good time to forget the expired ones
+        self.expire_runs()
+        self.append([(RUN, {"run_id": run_id, "run": run})])
+
+    def add_node_record(self, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        self.append([(NODE_RECORD, {"run_id": run_id, "node_id": node_id, "record": record})])
+
+    def add_node_output(self, run_id: str, node_id: NodeId, entries: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        # one append, the record is never indexed without the entries
+        self.append([(ENTRY, entry) for entry in entries] + [(NODE_RECORD, {"run_id": run_id, "node_id": node_id, "record": record})])
+
+    def drop_run(self, run_id: str) -> None:
+        with self.lock:
+            if run_id in self.runs:
+                self.append([(DROP, {"run_id": run_id})])
+
+    def expire_runs(self) -> None:
+        if self.ttl is None:
+            return
+        with self.lock:
+            deadline = time.time() - self.ttl
+            expired = [run_id for run_id, run in self.runs.items() if run.last_write < deadline]
+            if expired:
+                self.append([(DROP, {"run_id": run_id}) for run_id in expired])
+
+    ''' Reads '''
+
+    def read(self, location: Location) -> Dict[str, Any]:
+        segment, offset, length = location
+        with self.lock:
+            mm = self.maps.get(segment)
+            if mm is None or len(mm) < offset + length:
+                # the active segment grew since it was mapped
+                if mm is not None:
+                    mm.close()
+                with open(self.segment_path(segment), "rb") as f:
+                    mm = self.maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with memoryview(mm) as view:
+                return self.codec.decode(view[offset:offset + length])
+
+    def get_entries_by_caller(self, run_id: str, caller: NodeId) -> List[Dict[str, Any]]:
+        with self.lock:
+            run = self.runs.get(run_id)
+            return [self.read(location) for location in run.caller_index.get(caller, [])] if run else []
+
+    def get_entries_by_callee(self, run_id: str, callee: NodeId) -> List[Dict[str, Any]]:
+        with self.lock:
+            run = self.runs.get(run_id)
+            return [self.read(location) for location in run.callee_index.get(callee, [])] if run else []
+
+    def get_entry(self, run_id: str, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            run = self.runs.get(run_id)
+            location = run.entry_index.get((caller, callee, action)) if run else None
+            return self.read(location) if location else None
+
+    def get_entries(self, run_id: str, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        if caller is None and callee is None:
+            raise ValueError("get_entries needs a caller or a callee")
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is None:
+                return []
+            locations = run.caller_index.get(caller, []) if caller is not None else run.callee_index.get(callee, [])
+            locations = [location for location in locations if entry_matches(run.fields[location], caller, callee, action, since, until)]
+            if not needs_data(fields):
+                return project([run.fields[location] for location in locations], fields)
+            return project([self.read(location) for location in locations], fields)
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            run = self.runs.get(run_id)
+            return self.read(run.run)["run"] if run and run.run else None
+
+    def get_node_record(self, run_id: str, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            run = self.runs.get(run_id)
+            location = run.node_records.get(node_id) if run else None
+            return self.read(location)["record"] if location else None
+
+    def get_node_records(self, run_id: str) -> Dict[NodeId, Dict[str, Any]]:
+        with self.lock:
+            run = self.runs.get(run_id)
+            return {node_id: self.read(location)["record"] for node_id, location in run.node_records.items()} if run else {}
+
+    def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            run_id, location = self.hash_index.get(node_hash, (None, None))
+            return self.read(location)["record"] if location else None
+
+    ''' Compaction '''
+
+    def compact(self) -> None:
+        ''' rewrite the sealed segments into one, keeping only the records the index still points to '''
+        with self.lock:
+            self.expire_runs()
+            if self.active.tell() > 0:
+                self.roll()
+            sealed = [segment for segment in self.segments() if segment < self.active_segment]
+            if not sealed:
+                return
+            live = {location for run in self.runs.values() for location in run.locations()}
+            first, last = sealed[0], sealed[-1]
+            tmp_path = self.segment_path(first) + ".tmp"
+            with open(tmp_path, "wb") as out:
+                marker = self.codec.encode({"through": last})
+                out.write(HEADER.pack(len(marker), zlib.crc32(marker), COMPACTED, time.time()) + marker)
+                for segment in sealed:
+                    with open(self.segment_path(segment), "rb") as f:
+                        data = f.read()
+                    offset = 0
+                    while offset < len(data):
+                        length, crc, kind, written = HEADER.unpack_from(data, offset)
+                        start = offset + HEADER.size
+                        if (segment, start, length) in live:
+                            out.write(data[offset:start + length])
+                        offset = start + length
+                out.flush()
+                os.fsync(out.fileno())
+            for mm in self.maps.values():
+                mm.close()
+            self.maps.clear()
+            # the marker makes the rename the commit point, leftover sealed segments are deleted on the next open
+            os.replace(tmp_path, self.segment_path(first))
+            for segment in sealed[1:]:
+                os.remove(self.segment_path(segment))
+            self.active.close()
+            self.open_index()
+
+    def close(self) -> None:
+        with self.lock:
+            self.active.close()
+            for mm in self.maps.values():
+                mm.close()
+            self.maps.clear()
@@ -1,29 +1,374 @@
-from collections import defaultdict
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from typing import Any, Dict, List, Tuple, Optional
 from mas.graph.types import NodeId
-from mas.storage.base import Storage
+from mas.storage.base import AsyncStorage, Storage, entry_matches, project
+from mas.storage.codec import encode
+from mas.storage.sqlite import SqliteStorage
+
+class RunEntries:
+    ''' entries of one run and their indexes '''
 
-class InMemoryStorage(Storage):
     def __init__(self):
         self.entries = []
         self.caller_index = defaultdict(list)
         self.callee_index = defaultdict(list)
         self.entry_index = {}
 
+'''
+InMemoryStorage: the default storage of every flow, parallel executors write to it from several threads,
+so writes, and reads copying its dicts, hold one lock (reentrant, writes call each other)
+'''
+class InMemoryStorage(Storage):
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self.run_entries: Dict[str, RunEntries] = defaultdict(RunEntries)
+        self.runs = {}
+        self.node_records = defaultdict(dict)
+        self.hash_index = {}  # hash -> (run_id, record)
+        self.last_write: Dict[str, float] = {}
+        self.lock = threading.RLock()
+
     def add_entry(self, entry: Dict[str, Any]) -> None:
-        self.entries.append(entry)
-        caller = entry["caller"]
-        callee = entry["callee"]
-        action = entry["action"]
-        self.caller_index[caller].append(entry)
-        self.callee_index[callee].append(entry)
-        self.entry_index[(caller, callee, action)] = entry
-
-    def get_entries_by_caller(self, caller: NodeId) -> List[Dict[str, Any]]:
-        return self.caller_index.get(caller, [])
-
-    def get_entries_by_callee(self, callee: NodeId) -> List[Dict[str, Any]]:
-        return self.callee_index.get(callee, [])
-
-    def get_entry(self, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
-        return self.entry_index.get((caller, callee, action), None)
\ No newline at end of file
+        with self.lock:
+            run = self.run_entries[entry["run_id"]]
+            run.entries.append(entry)
+            caller = entry["caller"]
+            callee = entry["callee"]
+            action = entry["action"]
+            run.caller_index[caller].append(entry)
+            run.callee_index[callee].append(entry)
+            run.entry_index[(caller, callee, action)] = entry
+            self.touch(entry["run_id"])
+
+    def add_entries(self, entries: List[Dict[str, Any]]) -> None:
+        with self.lock:
+            for entry in entries:
+                self.add_entry(entry)
+
+    def get_entries_by_caller(self, run_id: str, caller: NodeId) -> List[Dict[str, Any]]:
+        run = self.run_entries.get(run_id)
+        return run.caller_index.get(caller, []) if run else []
+
+    def get_entries_by_callee(self, run_id: str, callee: NodeId) -> List[Dict[str, Any]]:
+        run = self.run_entries.get(run_id)
+        return run.callee_index.get(callee, []) if run else []
+
+    def get_entry(self, run_id: str, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        run = self.run_entries.get(run_id)
+        return run.entry_index.get((caller, callee, action), None) if run else None
+
+    def get_entries(self, run_id: str, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        if caller is None and callee is None:
+            raise ValueError("get_entries needs a caller or a callee")
+        with self.lock:
+            run = self.run_entries.get(run_id)
+            if run is None:
+                return []
+            # scan the shorter index list
+            by_caller = run.caller_index.get(caller, []) if caller is not None else None
+            by_callee = run.callee_index.get(callee, []) if callee is not None else None
+            entries = by_caller if by_callee is None or (by_caller is not None and len(by_caller) <= len(by_callee)) else by_callee
+            return project([e for e in entries if entry_matches(e, caller, callee, action, since, until)], fields)
+
+    def add_run(self, run_id: str, run: Dict[str, Any]) -> None:
+        with self.lock:
+            # a new run is a good time to forget the expired ones
+            self.expire_runs()
+            self.runs[run_id] = run
+            self.touch(run_id)
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        return self.runs.get(run_id, None)
+
+    def add_node_record(self, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        with self.lock:
+            self.node_records[run_id][node_id] = record
+            if record.get("hash") is not None:
+                self.hash_index[record["hash"]] = (run_id, record)
+            self.touch(run_id)
+
+    def add_node_output(self, run_id: str, node_id: NodeId, entries: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        # readers never see the record without the entries
+        with self.lock:
+            super().add_node_output(run_id, node_id, entries, record)
+
+    def get_node_record(self, run_id: str, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        return self.node_records.get(run_id, {}).get(node_id, None)
+
+    def get_node_records(self, run_id: str) -> Dict[NodeId, Dict[str, Any]]:
+        with self.lock:
+            return dict(self.node_records.get(run_id, {}))
+
+    def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        run_id, record = self.hash_index.get(node_hash, (None, None))
+        return record
+
+    def drop_run(self, run_id: str) -> None:
+        with self.lock:
+            self.run_entries.pop(run_id, None)
+            self.runs.pop(run_id, None)
+            self.last_write.pop(run_id, None)
+            for record in self.node_records.pop(run_id, {}).values():
+                # keep the hash if a later run recorded it again
+                if self.hash_index.get(record.get("hash"), (None,))[0] == run_id:
+                    del self.hash_index[record["hash"]]
+
+    def touch(self, run_id: str) -> None:
+        if self.ttl is not None:
+            self.last_write[run_id] = time.monotonic()
+
+    def expire_runs(self) -> None:
+        if self.ttl is None:
+            return
+        deadline = time.monotonic() - self.ttl
+        with self.lock:
+            for run_id in [run_id for run_id, last_write in self.last_write.items() if last_write < deadline]:
+                self.drop_run(run_id)
+
+'''
+Bounded in-memory storage:
+1. entries and node records count against max_entries and max_bytes (their encoded size)
+2. over budget, completed runs are spilled, least recently used first, into an on-disk storage (a temporary SqliteStorage by default)
+3. a run still executing is never spilled, the budget can be exceeded while all runs are active,
+   start_run pins a resumed run again until it completes
+4. reads and writes of a spilled run go to the spill storage, with a ttl it expires from there like the others
+5. a node record written again replaces the old one in the budget
+'''
+class BoundedInMemoryStorage(InMemoryStorage):
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None, spill: Optional[Storage] = None, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._spill = spill
+        self.completed = OrderedDict()  # completed runs held in memory, least recently used first
+        self.spilled = set()
+        self.sizes: Dict[str, List[int]] = defaultdict(lambda: [0, 0])  # run -> [entries, bytes]
+        self.n_entries = 0
+        self.n_bytes = 0
+
+    @property
+    def spill(self) -> Storage:
+        if self._spill is None:
+            self._spill = SqliteStorage(db_file=os.path.join(tempfile.mkdtemp(prefix="mas-spill-"), "spill.db"), ttl=self.ttl)
+        return self._spill
+
+    def add_entry(self, entry: Dict[str, Any]) -> None:
+        self.add_entries([entry])
+
+    def add_entries(self, entries: List[Dict[str, Any]]) -> None:
+        with self.lock:
+            for entry in entries:
+                if entry["run_id"] in self.spilled:
+                    self.spill.add_entry(entry)
+                    self.touch(entry["run_id"])
+                else:
+                    super().add_entry(entry)
+                    self.account(entry["run_id"], entry)
+            self.evict()
+
+    def get_entries_by_caller(self, run_id: str, caller: NodeId) -> List[Dict[str, Any]]:
+        with self.lock:
+            if run_id in self.spilled:
+                return self.spill.get_entries_by_caller(run_id, caller)
+            self.used(run_id)
+            return list(super().get_entries_by_caller(run_id, caller))
+
+    def get_entries_by_callee(self, run_id: str, callee: NodeId) -> List[Dict[str, Any]]:
+        with self.lock:
+            if run_id in self.spilled:
+                return self.spill.get_entries_by_callee(run_id, callee)
+            self.used(run_id)
+            return list(super().get_entries_by_callee(run_id, callee))
+
+    def get_entry(self, run_id: str, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            if run_id in self.spilled:
+                return self.spill.get_entry(run_id, caller, callee, action)
+            self.used(run_id)
+            return super().get_entry(run_id, caller, callee, action)
+
+    def get_entries(self, run_id: str, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        with self.lock:
+            if run_id in self.spilled:
+                return self.spill.get_entries(run_id, caller, callee, action, since, until, fields)
+            self.used(run_id)
+            return super().get_entries(run_id, caller, callee, action, since, until, fields)
+
+    def add_run(self, run_id: str, run: Dict[str, Any]) -> None:
+        with self.lock:
+            # expired spilled runs leave self.spilled here
+            self.expire_runs()
+            if run_id in self.spilled:
+                self.spill.add_run(run_id, run)
+                self.touch(run_id)
+            else:
+                super().add_run(run_id, run)
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            if run_id in self.spilled:
+                return self.spill.get_run(run_id)
+            return super().get_run(run_id)
+
+    def add_node_record(self, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        with self.lock:
+            if run_id in self.spilled:
+                self.spill.add_node_record(run_id, node_id, record)
+                self.touch(run_id)
+                return
+            replaced = self.node_records.get(run_id, {}).get(node_id)
+            super().add_node_record(run_id, node_id, record)
+            if replaced is not None:
+                self.account(run_id, replaced, -1)
+            self.account(run_id, record)
+            self.evict()
+
+    def add_node_output(self, run_id: str, node_id: NodeId, entries: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        with self.lock:
+            if run_id in self.spilled:
+                self.spill.add_node_output(run_id, node_id, entries, record)
+                self.touch(run_id)
+            else:
+                super().add_node_output(run_id, node_id, entries, record)
+
+    def get_node_record(self, run_id: str, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            if run_id in self.spilled:
+                return self.spill.get_node_record(run_id, node_id)
+            return super().get_node_record(run_id, node_id)
+
+    def get_node_records(self, run_id: str) -> Dict[NodeId, Dict[str, Any]]:
+        with self.lock:
+            if run_id in self.spilled:
+                return self.spill.get_node_records(run_id)
+            return super().get_node_records(run_id)
+
+    def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            record = super().get_node_record_by_hash(node_hash)
+            if record is None and self.spilled:
+                record = self.spill.get_node_record_by_hash(node_hash)
+            return record
+
+    def drop_run(self, run_id: str) -> None:
+        with self.lock:
+            if run_id in self.spilled:
+                self.spilled.discard(run_id)
+                self.spill.drop_run(run_id)
+            self.forget(run_id)
+
+    def start_run(self, run_id: str) -> None:
+        with self.lock:
+            self.completed.pop(run_id, None)
+
+    def complete_run(self, run_id: str) -> None:
+        with self.lock:
+            if run_id not in self.spilled:
+                self.completed[run_id] = None
+                self.completed.move_to_end(run_id)
+                self.evict()
+
+    def account(self, run_id: str, item: Dict[str, Any], sign: int = 1) -> None:
+        ''' sign -1 takes a replaced item back out '''
+        size = sign * len(encode(item)) if self.max_bytes is not None else 0
+        self.sizes[run_id][0] += sign
+        self.sizes[run_id][1] += size
+        self.n_entries += sign
+        self.n_bytes += size
+
+    def used(self, run_id: str) -> None:
+        if run_id in self.completed:
+            self.completed.move_to_end(run_id)
+
+    def over_budget(self) -> bool:
+        return (self.max_entries is not None and self.n_entries > self.max_entries) or \
+            (self.max_bytes is not None and self.n_bytes > self.max_bytes)
+
+    def evict(self) -> None:
+        while self.completed and self.over_budget():
+            run_id, _ = self.completed.popitem(last=False)
+            self.spill_run(run_id)
+
+    def spill_run(self, run_id: str) -> None:
+        run_entries = self.run_entries.get(run_id)
+        if run_id in self.runs:
+            self.spill.add_run(run_id, self.runs[run_id])
+        if run_entries is not None:
+            self.spill.add_entries(run_entries.entries)
+        for node_id, record in self.node_records.get(run_id, {}).items():
+            self.spill.add_node_record(run_id, node_id, record)
+        # the run keeps its last write, it expires from the spill like from memory
+        last_write = self.last_write.get(run_id)
+        self.forget(run_id)
+        self.spilled.add(run_id)
+        if last_write is not None:
+            self.last_write[run_id] = last_write
+
+    def forget(self, run_id: str) -> None:
+        ''' drop the run from memory only '''
+        super().drop_run(run_id)
+        self.completed.pop(run_id, None)
+        n_entries, n_bytes = self.sizes.pop(run_id, (0, 0))
+        self.n_entries -= n_entries
+        self.n_bytes -= n_bytes
+
+class AsyncInMemoryStorage(AsyncStorage):
+    ''' InMemoryStorage never waits on I/O, its calls are simply awaited in place '''
+
+    def __init__(self, storage: Optional[InMemoryStorage] = None):
+        self.storage = storage if storage is not None else InMemoryStorage()
+
+    async def add_entry(self, entry: Dict[str, Any]) -> None:
+        self.storage.add_entry(entry)
+
+    async def add_entries(self, entries: List[Dict[str, Any]]) -> None:
+        self.storage.add_entries(entries)
+
+    async def get_entries_by_caller(self, run_id: str, caller: NodeId) -> List[Dict[str, Any]]:
+        return self.storage.get_entries_by_caller(run_id, caller)
+
+    async def get_entries_by_callee(self, run_id: str, callee: NodeId) -> List[Dict[str, Any]]:
+        return self.storage.get_entries_by_callee(run_id, callee)
+
+    async def get_entry(self, run_id: str, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        return self.storage.get_entry(run_id, caller, callee, action)
+
+    async def get_entries(self, run_id: str, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                          since: Optional[str] = None, until: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        return self.storage.get_entries(run_id, caller, callee, action, since, until, fields)
+
+    async def add_run(self, run_id: str, run: Dict[str, Any]) -> None:
+        self.storage.add_run(run_id, run)
+
+    async def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        return self.storage.get_run(run_id)
+
+    async def add_node_record(self, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        self.storage.add_node_record(run_id, node_id, record)
+
+    async def add_node_output(self, run_id: str, node_id: NodeId, entries: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        self.storage.add_node_output(run_id, node_id, entries, record)
+
+    async def get_node_record(self, run_id: str, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        return self.storage.get_node_record(run_id, node_id)
+
+    async def get_node_records(self, run_id: str) -> Dict[NodeId, Dict[str, Any]]:
+        return self.storage.get_node_records(run_id)
+
+    async def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        return self.storage.get_node_record_by_hash(node_hash)
+
+    async def drop_run(self, run_id: str) -> None:
+        self.storage.drop_run(run_id)
+
+    async def start_run(self, run_id: str) -> None:
+        self.storage.start_run(run_id)
+
+    async def complete_run(self, run_id: str) -> None:
+        self.storage.complete_run(run_id)
@@ -1,45 +1,279 @@
+import math
+import threading
 import redis
-import json
-from typing import Any, Dict, List, Optional
+import redis.asyncio
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime
+from urllib.parse import quote, unquote
 from mas.graph.types import NodeId
-from mas.storage.base import Storage  # assuming the interface class exists in agent_storage.py
+from mas.storage.base import AsyncStorage, Storage, entry_matches, needs_data, project  # assuming the interface class exists in agent_storage.py
+from mas.storage.codec import Codec, decode, default_codec
 
+_connection_pools: Dict[Tuple[str, int, int], redis.ConnectionPool] = {}
+_connection_pools_lock = threading.Lock()
+
+def get_connection_pool(redis_host='localhost', redis_port=6379, redis_db=0) -> redis.ConnectionPool:
+    ''' one connection pool per server and db, shared by every storage, blob store and queue in the process '''
+    key = (redis_host, redis_port, redis_db)
+    with _connection_pools_lock:
+        if key not in _connection_pools:
+            # responses stay bytes, values are codec payloads
+            _connection_pools[key] = redis.ConnectionPool(host=redis_host, port=redis_port, db=redis_db)
+        return _connection_pools[key]
+
+'''
+Keys, all under the run they belong to:
+run:{run_id}                                      the run (its graph)
+run:{run_id}:entry:{caller}:{callee}:{action}:{ts} an entry, its components percent-encoded, none holds a colon
+run:{run_id}:caller:{caller} / :callee:{callee}   entry ids sorted by timestamp
+run:{run_id}:direct:{caller}:{callee}:{action}    id of the latest entry
+run:{run_id}:nodes                                node records by node id
+run:{run_id}:keys                                 every key above, for drop_run
+node_hash:{hash}                                  latest node record with that content hash, across runs
+'''
+def run_key(run_id: str, *parts: Any) -> str:
+    return ":".join(["run", run_id, *[str(part) for part in parts]])
+
+def entry_key(run_id: str, caller: NodeId, callee: NodeId, action: str, timestamp: str) -> str:
+    return run_key(run_id, "entry", *[quote(str(part), safe="") for part in (caller, callee, action, timestamp)])
+
+def queue_keys(pipe, run_id: str, keys: List[str], ttl: Optional[float]) -> None:
+    ''' remember the keys written for the run, and (re)start their expiry '''
+    keys_key = run_key(run_id, "keys")
+    pipe.sadd(keys_key, *keys)
+    if ttl is not None:
+        for key in keys + [keys_key]:
+            pipe.expire(key, math.ceil(ttl))
+
+def queue_entries(pipe, entries: List[Dict[str, Any]], codec: Codec, ttl: Optional[float] = None) -> None:
+    ''' queue the writes of entries on a sync or async pipeline '''
+    for entry in entries:
+        run_id = entry["run_id"]
+        entry_id = entry_key(run_id, entry['caller'], entry['callee'], entry['action'], entry['timestamp'])
+        score = datetime.fromisoformat(entry['timestamp']).timestamp()
+        caller_key = run_key(run_id, "caller", entry['caller'])
+        callee_key = run_key(run_id, "callee", entry['callee'])
+        direct_key = run_key(run_id, "direct", entry['caller'], entry['callee'], entry['action'])
+
+        # Store entry data
+        pipe.set(entry_id, codec.encode(entry))
+
+        # Index by caller and by callee (sorted by timestamp)
+        pipe.zadd(caller_key, {entry_id: score})
+        pipe.zadd(callee_key, {entry_id: score})
+
+        # Direct lookup by (caller, callee, action)
+        pipe.set(direct_key, entry_id)
+
+        queue_keys(pipe, run_id, [entry_id, caller_key, callee_key, direct_key], ttl)
+
+def queue_node_record(pipe, run_id: str, node_id: NodeId, record: Dict[str, Any], codec: Codec, ttl: Optional[float] = None) -> None:
+    data = codec.encode(record)
+    pipe.hset(run_key(run_id, "nodes"), str(node_id), data)
+    queue_keys(pipe, run_id, [run_key(run_id, "nodes")], ttl)
+    if record.get("hash") is not None:
+        pipe.set(f"node_hash:{record['hash']}", data, ex=math.ceil(ttl) if ttl is not None else None)
+
+def entry_fields(entry_id: bytes, run_id: str) -> Dict[str, Any]:
+    ''' the fields an entry id carries, every field but "data" '''
+    caller, callee, action, timestamp = map(unquote, entry_id.decode()[len(run_key(run_id, "entry")) + 1:].split(":"))
+    return {"run_id": run_id, "caller": NodeId(caller), "callee": NodeId(callee), "action": action, "timestamp": timestamp}
+
+def entries_query(run_id: str, caller: Optional[NodeId], callee: Optional[NodeId], since: Optional[str], until: Optional[str]) -> Tuple[str, Any, Any]:
+    ''' the index to read and its score range, for ZRANGE ... BYSCORE '''
+    if caller is None and callee is None:
+        raise ValueError("get_entries needs a caller or a callee")
+    key = run_key(run_id, "caller", caller) if caller is not None else run_key(run_id, "callee", callee)
+    low = datetime.fromisoformat(since).timestamp() if since is not None else "-inf"
+    high = datetime.fromisoformat(until).timestamp() if until is not None else "+inf"
+    return key, low, high
+
+def matching_ids(entry_ids: List[bytes], run_id: str, caller: Optional[NodeId], callee: Optional[NodeId], action: Optional[str],
+                 since: Optional[str], until: Optional[str]) -> List[Tuple[bytes, Dict[str, Any]]]:
+    pairs = [(entry_id, entry_fields(entry_id, run_id)) for entry_id in entry_ids]
+    return [(entry_id, fields) for entry_id, fields in pairs if entry_matches(fields, caller, callee, action, since, until)]
+
+def hashed_records(records: Dict[bytes, bytes]) -> List[Tuple[str, bytes]]:
+    ''' (node_hash key, record) for the records of a run that carry a content hash '''
+    pairs = []
+    for record in records.values():
+        node_hash = decode(record).get("hash")
+        if node_hash is not None:
+            pairs.append((f"node_hash:{node_hash}", record))
+    return pairs
+
+'''
+Redis:
+1. writes of one call go out in a single MULTI/EXEC pipeline, a finished node's entries and record included
+2. index reads fetch the entry ids (ZRANGE, BYSCORE for a time range), then all entries with one MGET
+   get_entries filters on the ids (they carry every field but "data"), and only fetches entries when "data" is asked for
+3. with a ttl, every write refreshes the expiry of the run's keys, so a run is gone ttl seconds after its last write
+'''
 class RedisStorage(Storage):
-    def __init__(self, redis_host='localhost', redis_port=6379, redis_db=0):
-        self.r = redis.Redis(host=redis_host, port=redis_port, db=redis_db, decode_responses=True)
+    def __init__(self, redis_host='localhost', redis_port=6379, redis_db=0, client: Optional[redis.Redis] = None, ttl: Optional[float] = None, codec: Optional[Codec] = None):
+        # a client passed in must not decode responses
+        self.r = client if client is not None else redis.Redis(connection_pool=get_connection_pool(redis_host, redis_port, redis_db))
+        self.ttl = ttl
+        self.codec = codec if codec is not None else default_codec
 
     def add_entry(self, entry: Dict[str, Any]) -> None:
-        entry_id = f"{entry['caller']}:{entry['callee']}:{entry['action']}:{entry['timestamp']}"
+        self.add_entries([entry])
 
-        # Store entry data
-        self.r.set(entry_id, json.dumps(entry))
+    def add_entries(self, entries: List[Dict[str, Any]]) -> None:
+        pipe = self.r.pipeline()
+        queue_entries(pipe, entries, self.codec, self.ttl)
+        pipe.execute()
 
-        # Index by caller (sorted by timestamp)
-        caller_key = f"caller:{entry['caller']}"
-        self.r.zadd(caller_key, {entry_id: datetime.fromisoformat(entry['timestamp']).timestamp()})
+    def get_entries_by_caller(self, run_id: str, caller: NodeId) -> List[Dict[str, Any]]:
+        return self._get_entries(self.r.zrange(run_key(run_id, "caller", caller), 0, -1))
 
-        # Index by callee
-        callee_key = f"callee:{entry['callee']}"
-        self.r.zadd(callee_key, {entry_id: datetime.fromisoformat(entry['timestamp']).timestamp()})
+    def get_entries_by_callee(self, run_id: str, callee: NodeId) -> List[Dict[str, Any]]:
+        return self._get_entries(self.r.zrange(run_key(run_id, "callee", callee), 0, -1))
 
-        # Direct lookup by (caller, callee, action)
-        direct_key = f"entry:{entry['caller']}:{entry['callee']}:{entry['action']}"
-        self.r.set(direct_key, entry_id)
-
-    def get_entries_by_caller(self, caller: NodeId) -> List[Dict[str, Any]]:
-        caller_key = f"caller:{caller}"
-        entry_ids = self.r.zrange(caller_key, 0, -1)
-        return [json.loads(self.r.get(entry_id)) for entry_id in entry_ids]
-
-    def get_entries_by_callee(self, callee: NodeId) -> List[Dict[str, Any]]:
-        callee_key = f"callee:{callee}"
-        entry_ids = self.r.zrange(callee_key, 0, -1)
-        return [json.loads(self.r.get(entry_id)) for entry_id in entry_ids]
-
-    def get_entry(self, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
-        direct_key = f"entry:{caller}:{callee}:{action}"
-        entry_id = self.r.get(direct_key)
+    def _get_entries(self, entry_ids: List[str]) -> List[Dict[str, Any]]:
+        if not entry_ids:
+            return []
+        return [self.codec.decode(entry) for entry in self.r.mget(entry_ids) if entry is not None]
+
+    def get_entry(self, run_id: str, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        entry_id = self.r.get(run_key(run_id, "direct", caller, callee, action))
         if entry_id:
-            return json.loads(self.r.get(entry_id))
-        return None
\ No newline at end of file
+            entry = self.r.get(entry_id)
+            return self.codec.decode(entry) if entry else None
+        return None
+
+    def get_entries(self, run_id: str, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        key, low, high = entries_query(run_id, caller, callee, since, until)
+        matches = matching_ids(self.r.zrange(key, low, high, byscore=True), run_id, caller, callee, action, since, until)
+        if not needs_data(fields):
+            return project([entry for _, entry in matches], fields)
+        return project(self._get_entries([entry_id for entry_id, _ in matches]), fields)
+
+    def add_run(self, run_id: str, run: Dict[str, Any]) -> None:
+        pipe = self.r.pipeline()
+        pipe.set(run_key(run_id), self.codec.encode(run))
+        queue_keys(pipe, run_id, [run_key(run_id)], self.ttl)
+        pipe.execute()
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        run = self.r.get(run_key(run_id))
+        return self.codec.decode(run) if run else None
+
+    def add_node_record(self, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        pipe = self.r.pipeline()
+        queue_node_record(pipe, run_id, node_id, record, self.codec, self.ttl)
+        pipe.execute()
+
+    def add_node_output(self, run_id: str, node_id: NodeId, entries: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        # one transaction, the record is never visible without the entries
+        pipe = self.r.pipeline()
+        queue_entries(pipe, entries, self.codec, self.ttl)
+        queue_node_record(pipe, run_id, node_id, record, self.codec, self.ttl)
+        pipe.execute()
+
+    def get_node_record(self, run_id: str, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        record = self.r.hget(run_key(run_id, "nodes"), str(node_id))
+        return self.codec.decode(record) if record else None
+
+    def get_node_records(self, run_id: str) -> Dict[NodeId, Dict[str, Any]]:
+        records = self.r.hgetall(run_key(run_id, "nodes"))
+        return {NodeId(node_id): self.codec.decode(record) for node_id, record in records.items()}
+
+    def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        record = self.r.get(f"node_hash:{node_hash}")
+        return self.codec.decode(record) if record else None
+
+    def drop_run(self, run_id: str) -> None:
+        keys = list(self.r.smembers(run_key(run_id, "keys")))
+        records = self.r.hgetall(run_key(run_id, "nodes"))
+        hashed = hashed_records(records)
+        current = self.r.mget([key for key, _ in hashed]) if hashed else []
+        # keep the hash keys a later run recorded again
+        hash_keys = [key for (key, record), value in zip(hashed, current) if value == record]
+        self.r.delete(*keys, *hash_keys, run_key(run_id, "keys"))
+
+class AsyncRedisStorage(AsyncStorage):
+    ''' RedisStorage on redis.asyncio, same keys, so sync and async clients see the same data '''
+
+    def __init__(self, redis_host='localhost', redis_port=6379, redis_db=0, client: Optional[redis.asyncio.Redis] = None, ttl: Optional[float] = None, codec: Optional[Codec] = None):
+        # asyncio connections belong to one event loop, so the pool is not shared process-wide
+        self.r = client if client is not None else redis.asyncio.Redis(host=redis_host, port=redis_port, db=redis_db)
+        self.ttl = ttl
+        self.codec = codec if codec is not None else default_codec
+
+    async def add_entry(self, entry: Dict[str, Any]) -> None:
+        await self.add_entries([entry])
+
+    async def add_entries(self, entries: List[Dict[str, Any]]) -> None:
+        pipe = self.r.pipeline()
+        queue_entries(pipe, entries, self.codec, self.ttl)
+        await pipe.execute()
+
+    async def get_entries_by_caller(self, run_id: str, caller: NodeId) -> List[Dict[str, Any]]:
+        return await self._get_entries(await self.r.zrange(run_key(run_id, "caller", caller), 0, -1))
+
+    async def get_entries_by_callee(self, run_id: str, callee: NodeId) -> List[Dict[str, Any]]:
+        return await self._get_entries(await self.r.zrange(run_key(run_id, "callee", callee), 0, -1))
+
+    async def _get_entries(self, entry_ids: List[str]) -> List[Dict[str, Any]]:
+        if not entry_ids:
+            return []
+        return [self.codec.decode(entry) for entry in await self.r.mget(entry_ids) if entry is not None]
+
+    async def get_entry(self, run_id: str, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        entry_id = await self.r.get(run_key(run_id, "direct", caller, callee, action))
+        if entry_id:
+            entry = await self.r.get(entry_id)
+            return self.codec.decode(entry) if entry else None
+        return None
+
+    async def get_entries(self, run_id: str, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                          since: Optional[str] = None, until: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        key, low, high = entries_query(run_id, caller, callee, since, until)
+        matches = matching_ids(await self.r.zrange(key, low, high, byscore=True), run_id, caller, callee, action, since, until)
+        if not needs_data(fields):
+            return project([entry for _, entry in matches], fields)
+        return project(await self._get_entries([entry_id for entry_id, _ in matches]), fields)
+
+    async def add_run(self, run_id: str, run: Dict[str, Any]) -> None:
+        pipe = self.r.pipeline()
+        pipe.set(run_key(run_id), self.codec.encode(run))
+        queue_keys(pipe, run_id, [run_key(run_id)], self.ttl)
+        await pipe.execute()
+
+    async def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        run = await self.r.get(run_key(run_id))
+        return self.codec.decode(run) if run else None
+
+    async def add_node_record(self, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        pipe = self.r.pipeline()
+        queue_node_record(pipe, run_id, node_id, record, self.codec, self.ttl)
+        await pipe.execute()
+
+    async def add_node_output(self, run_id: str, node_id: NodeId, entries: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        pipe = self.r.pipeline()
+        queue_entries(pipe, entries, self.codec, self.ttl)
+        queue_node_record(pipe, run_id, node_id, record, self.codec, self.ttl)
+        await pipe.execute()
+
+    async def get_node_record(self, run_id: str, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        record = await self.r.hget(run_key(run_id, "nodes"), str(node_id))
+        return self.codec.decode(record) if record else None
+
+    async def get_node_records(self, run_id: str) -> Dict[NodeId, Dict[str, Any]]:
+        records = await self.r.hgetall(run_key(run_id, "nodes"))
+        return {NodeId(node_id): self.codec.decode(record) for node_id, record in records.items()}
+
+    async def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        record = await self.r.get(f"node_hash:{node_hash}")
+        return self.codec.decode(record) if record else None
+
+    async def drop_run(self, run_id: str) -> None:
+        keys = list(await self.r.smembers(run_key(run_id, "keys")))
+        records = await self.r.hgetall(run_key(run_id, "nodes"))
+        hashed = hashed_records(records)
+        current = await self.r.mget([key for key, _ in hashed]) if hashed else []
+        # keep the hash keys a later run recorded again
+        hash_keys = [key for (key, record), value in zip(hashed, current) if value == record]
+        await self.r.delete(*keys, *hash_keys, run_key(run_id, "keys"))
@@ -1,63 +1,230 @@
-import json
-from sqlalchemy import create_engine, Column, String, Integer, Text
-from sqlalchemy.orm import sessionmaker, declarative_base
+import os
+import time
+from sqlalchemy import create_engine, delete, event, inspect, insert, select, text, Column, Float, Index, LargeBinary, String, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import declarative_base
 from typing import Any, Dict, List, Tuple, Optional
 from mas.graph.types import NodeId
-from mas.storage.base import Storage
+from mas.storage.base import Storage, ThreadedAsyncStorage
+from mas.storage.codec import Codec, default_codec
 
 Base = declarative_base()
 
 class Entry(Base):
     __tablename__ = 'agent_sessions'
     id = Column(Integer, primary_key=True, autoincrement=True)
-    caller = Column(String)
-    callee = Column(String)
+    run_id = Column(String)
+    caller = Column(Integer)
+    callee = Column(Integer)
     action = Column(String)
-    data = Column(Text)  # Store as JSON
+    data = Column(LargeBinary)  # codec payload, tables of earlier versions hold json text
     timestamp = Column(String)
 
+    __table_args__ = (
+        # get_entry and get_entries_by_caller, the latter on the index prefix
+        Index('ix_agent_sessions_run_caller_callee_action', 'run_id', 'caller', 'callee', 'action'),
+        Index('ix_agent_sessions_run_callee', 'run_id', 'callee'),
+    )
+
+ENTRY_COLUMNS = ("run_id", "caller", "callee", "action", "data", "timestamp")
+
+class Run(Base):
+    __tablename__ = 'flow_runs'
+    run_id = Column(String, primary_key=True)
+    data = Column(LargeBinary)  # codec payload, tables of earlier versions hold json text
+    last_write = Column(Float, index=True)  # unix time, for ttl expiry
+
+class NodeRecord(Base):
+    __tablename__ = 'flow_node_records'
+    run_id = Column(String, primary_key=True)
+    node_id = Column(Integer, primary_key=True)
+    hash = Column(String, index=True)
+    data = Column(LargeBinary)  # codec payload, tables of earlier versions hold json text
+
+'''
+SQLite:
+1. the engine keeps its connections open, every call is one short transaction on a pooled connection
+2. WAL journal with synchronous=NORMAL: readers don't block the writer, commits don't fsync the database file
+3. bulk writes (add_entries, add_node_output) are a single executemany in a single transaction
+4. with a ttl, a run is deleted ttl seconds after its last write, checked whenever a run starts
+5. data columns hold codec payloads (msgpack by default), json text written by earlier versions still reads
+'''
 class SqliteStorage(Storage):
-    def __init__(self, table_name: str = "agent_sessions", db_file: str = "tmp/agent_storage.db"):
-        self.engine = create_engine(f"sqlite:///{db_file}")
+    def __init__(self, table_name: str = "agent_sessions", db_file: str = "tmp/agent_storage.db", ttl: Optional[float] = None, codec: Optional[Codec] = None):
+        self.ttl = ttl
+        self.codec = codec if codec is not None else default_codec
+        if os.path.dirname(db_file):
+            os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        # parallel executors write from several threads, wait for the write lock instead of failing
+        self.engine = create_engine(f"sqlite:///{db_file}", connect_args={"timeout": 30})
+        event.listen(self.engine, "connect", self._on_connect)
         Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
+        # databases created by earlier versions lack the run columns and the indexes
+        self._add_missing_columns()
+        for table in (Entry.__table__, Run.__table__):
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
+
+    def _add_missing_columns(self):
+        inspector = inspect(self.engine)
+        with self.engine.begin() as conn:
+            for table, column, type_ in ((Entry.__tablename__, "run_id", "VARCHAR"), (Run.__tablename__, "last_write", "FLOAT")):
+                if column not in {c["name"] for c in inspector.get_columns(table)}:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {type_}"))
+
+    @staticmethod
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
 
     def add_entry(self, entry: Dict[str, Any]) -> None:
-        session = self.Session()
-        entry_row = Entry(
-            caller=entry["caller"],
-            callee=entry["callee"],
-            action=entry["action"],
-            data=json.dumps(entry["data"]),
-            timestamp=entry["timestamp"]
+        self.add_entries([entry])
+
+    def add_entries(self, entries: List[Dict[str, Any]]) -> None:
+        if not entries:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(insert(Entry), [self._entry_to_row(e) for e in entries])
+            for run_id in {e["run_id"] for e in entries}:
+                self._touch(conn, run_id)
+
+    def get_entries_by_caller(self, run_id: str, caller: NodeId) -> List[Dict[str, Any]]:
+        return self._select_entries(select(Entry.__table__).where(Entry.run_id == run_id, Entry.caller == caller).order_by(Entry.id))
+
+    def get_entries_by_callee(self, run_id: str, callee: NodeId) -> List[Dict[str, Any]]:
+        return self._select_entries(select(Entry.__table__).where(Entry.run_id == run_id, Entry.callee == callee).order_by(Entry.id))
+
+    def get_entry(self, run_id: str, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
+        entries = self._select_entries(
+            select(Entry.__table__)
+            .where(Entry.run_id == run_id, Entry.caller == caller, Entry.callee == callee, Entry.action == action)
+            .order_by(Entry.id.desc())
+            .limit(1)
         )
-        session.add(entry_row)
-        session.commit()
-        session.close()
-
-    def get_entries_by_caller(self, caller: NodeId) -> List[Dict[str, Any]]:
-        session = self.Session()
-        entries = session.query(Entry).filter_by(caller=caller).all()
-        session.close()
-        return [self._row_to_dict(e) for e in entries]
-
-    def get_entries_by_callee(self, callee: NodeId) -> List[Dict[str, Any]]:
-        session = self.Session()
-        entries = session.query(Entry).filter_by(callee=callee).all()
-        session.close()
-        return [self._row_to_dict(e) for e in entries]
-
-    def get_entry(self, caller: NodeId, callee: NodeId, action: str) -> Optional[Dict[str, Any]]:
-        session = self.Session()
-        entry = session.query(Entry).filter_by(caller=caller, callee=callee, action=action).first()
-        session.close()
-        return self._row_to_dict(entry) if entry else None
-
-    def _row_to_dict(self, entry: Entry) -> Dict[str, Any]:
+        return entries[0] if entries else None
+
+    def get_entries(self, run_id: str, caller: Optional[NodeId] = None, callee: Optional[NodeId] = None, action: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        if caller is None and callee is None:
+            raise ValueError("get_entries needs a caller or a callee")
+        # only the asked columns are read, "data" is only decoded when asked for
+        names = [name for name in (fields if fields is not None else ENTRY_COLUMNS) if name in ENTRY_COLUMNS]
+        columns = [Entry.__table__.c[name] for name in names] or [Entry.id]
+        stmt = select(*columns).where(Entry.run_id == run_id)
+        for column, value in ((Entry.caller, caller), (Entry.callee, callee), (Entry.action, action)):
+            if value is not None:
+                stmt = stmt.where(column == value)
+        if since is not None:
+            stmt = stmt.where(Entry.timestamp >= since)
+        if until is not None:
+            stmt = stmt.where(Entry.timestamp <= until)
+        with self.engine.connect() as conn:
+            rows = conn.execute(stmt.order_by(Entry.id)).all()
+        return [
+            {name: self.codec.decode(value) if name == "data" else value for name, value in zip(names, row)}
+            for row in rows
+        ]
+
+    def add_run(self, run_id: str, run: Dict[str, Any]) -> None:
+        # a new run is a good time to forget the expired ones
+        self.expire_runs()
+        stmt = sqlite_insert(Run).values(run_id=run_id, data=self.codec.encode(run), last_write=time.time())
+        with self.engine.begin() as conn:
+            conn.execute(stmt.on_conflict_do_update(index_elements=[Run.run_id], set_={"data": stmt.excluded.data, "last_write": stmt.excluded.last_write}))
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            data = conn.execute(select(Run.data).where(Run.run_id == run_id)).scalar()
+        return self.codec.decode(data) if data else None
+
+    def add_node_record(self, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        with self.engine.begin() as conn:
+            self._add_node_record(conn, run_id, node_id, record)
+
+    def add_node_output(self, run_id: str, node_id: NodeId, entries: List[Dict[str, Any]], record: Dict[str, Any]) -> None:
+        # one transaction, the record is never visible without the entries
+        with self.engine.begin() as conn:
+            if entries:
+                conn.execute(insert(Entry), [self._entry_to_row(e) for e in entries])
+            self._add_node_record(conn, run_id, node_id, record)
+
+    def _touch(self, conn, run_id: str) -> None:
+        if self.ttl is None:
+            return
+        # entries may be written for a run that never stored its graph, its row then only tracks the expiry
+        stmt = sqlite_insert(Run).values(run_id=run_id, last_write=time.time())
+        conn.execute(stmt.on_conflict_do_update(index_elements=[Run.run_id], set_={"last_write": stmt.excluded.last_write}))
+
+    def _add_node_record(self, conn, run_id: str, node_id: NodeId, record: Dict[str, Any]) -> None:
+        self._touch(conn, run_id)
+        stmt = sqlite_insert(NodeRecord).values(run_id=run_id, node_id=node_id, hash=record.get("hash"), data=self.codec.encode(record))
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[NodeRecord.run_id, NodeRecord.node_id],
+            set_={"hash": stmt.excluded.hash, "data": stmt.excluded.data},
+        ))
+
+    def get_node_record(self, run_id: str, node_id: NodeId) -> Optional[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            data = conn.execute(select(NodeRecord.data).where(NodeRecord.run_id == run_id, NodeRecord.node_id == node_id)).scalar()
+        return self.codec.decode(data) if data else None
+
+    def get_node_records(self, run_id: str) -> Dict[NodeId, Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(NodeRecord.node_id, NodeRecord.data).where(NodeRecord.run_id == run_id)).all()
+        return {node_id: self.codec.decode(data) for node_id, data in rows}
+
+    def get_node_record_by_hash(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            data = conn.execute(select(NodeRecord.data).where(NodeRecord.hash == node_hash).limit(1)).scalar()
+        return self.codec.decode(data) if data else None
+
+    def drop_run(self, run_id: str) -> None:
+        with self.engine.begin() as conn:
+            self._drop_runs(conn, [run_id])
+
+    def expire_runs(self) -> None:
+        if self.ttl is None:
+            return
+        with self.engine.begin() as conn:
+            expired = conn.execute(select(Run.run_id).where(Run.last_write < time.time() - self.ttl)).scalars().all()
+            self._drop_runs(conn, expired)
+
+    def _drop_runs(self, conn, run_ids: List[str]) -> None:
+        if not run_ids:
+            return
+        conn.execute(delete(Entry).where(Entry.run_id.in_(run_ids)))
+        conn.execute(delete(NodeRecord).where(NodeRecord.run_id.in_(run_ids)))
+        conn.execute(delete(Run).where(Run.run_id.in_(run_ids)))
+
+    def _select_entries(self, stmt) -> List[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(stmt).all()
+        return [self._row_to_dict(row) for row in rows]
+
+    def _entry_to_row(self, entry: Dict[str, Any]) -> Dict[str, Any]:
         return {
+            "run_id": entry["run_id"],
+            "caller": entry["caller"],
+            "callee": entry["callee"],
+            "action": entry["action"],
+            "data": self.codec.encode(entry["data"]),
+            "timestamp": entry["timestamp"]
+        }
+
+    def _row_to_dict(self, entry) -> Dict[str, Any]:
+        return {
+            "run_id": entry.run_id,
             "caller": entry.caller,
             "callee": entry.callee,
             "action": entry.action,
-            "data": json.loads(entry.data),
+            "data": self.codec.decode(entry.data),
             "timestamp": entry.timestamp
         }
+
+class AsyncSqliteStorage(ThreadedAsyncStorage):
+    ''' sqlite3 calls block, so every call runs on a worker thread, like aiosqlite does, on the same pooled connections '''
+
+    def __init__(self, table_name: str = "agent_sessions", db_file: str = "tmp/agent_storage.db", ttl: Optional[float] = None, codec: Optional[Codec] = None):
+        super().__init__(SqliteStorage(table_name=table_name, db_file=db_file, ttl=ttl, codec=codec))
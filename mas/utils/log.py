@@ -0,0 +1,57 @@
+import json
+import logging
+import pprint
+from typing import Any, Callable, Optional
+
+'''
+Lazy logging: messages and graphs are logged as objects that only serialize in __str__,
+and logging only calls it when a handler emits the record, so a disabled level costs one isEnabledFor check
+1. records carry size-capped previews: long strings are clipped, media and tool calls counted, not dumped
+2. complete dumps go to the "mas.dump" logger, off until enable_full_dump gives it a sink
+'''
+
+PREVIEW_CHARS = 1000
+
+dump_logger = logging.getLogger("mas.dump")
+dump_logger.propagate = False
+dump_logger.setLevel(logging.CRITICAL + 1)  # off
+
+def clip(text: str, max_chars: Optional[int] = PREVIEW_CHARS) -> str:
+    if max_chars is None or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... [{len(text) - max_chars} more chars]"
+
+class LazyJson:
+    ''' json.dumps of build() when formatted, at most max_chars of it '''
+    __slots__ = ("build", "max_chars")
+
+    def __init__(self, build: Callable[[], Any], max_chars: Optional[int] = None):
+        self.build = build
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        text = json.dumps(self.build(), indent=2, default=str)
+        return text if self.max_chars is None else clip(text, self.max_chars)
+
+class LazyPformat(LazyJson):
+    ''' pprint.pformat of build() when formatted, for objects json can't show, e.g. int keys '''
+    __slots__ = ()
+
+    def __str__(self) -> str:
+        text = pprint.pformat(self.build(), indent=2)
+        return text if self.max_chars is None else clip(text, self.max_chars)
+
+def enable_full_dump(path: str = "tmp/mas_dump.log", level: int = logging.DEBUG) -> logging.Handler:
+    ''' write complete messages and graphs to path, as they are logged, return the handler for disable_full_dump '''
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    dump_logger.addHandler(handler)
+    dump_logger.setLevel(level)
+    return handler
+
+def disable_full_dump(handler: Optional[logging.Handler] = None) -> None:
+    for h in [handler] if handler is not None else list(dump_logger.handlers):
+        dump_logger.removeHandler(h)
+        h.close()
+    if not dump_logger.handlers:
+        dump_logger.setLevel(logging.CRITICAL + 1)
@@ -0,0 +1,55 @@
+import threading
+from dataclasses import fields
+
+import agno.agent as agno_agent
+
+from mas.agent.agno import AgnoAgent
+from mas.agent.cache import AgentCache
+from mas.graph.types import NodeAttr
+
+def test_agent_cache_reuse():
+    cache = AgentCache(max_size=4)
+    built = []
+
+    def build():
+        built.append(agno_agent.Agent())
+        return built[-1]
+
+    agent = cache.acquire("gpt-4o", build)
+    # a concurrent call on the same key gets its own agent
+    other = cache.acquire("gpt-4o", build)
+    assert agent is not other and len(built) == 2
+
+    agent.initialize_agent()
+    agent.memory.add_message(agno_agent.Message(role="user", content="hi"))
+    agent.run_id = "run-1"
+    cache.release("gpt-4o", agent)
+    assert cache.acquire("gpt-4o", build) is agent and len(built) == 2
+    # the per-run state is gone
+    assert agent.run_id is None and agent.memory.messages == []
+    assert cache.hit_rate() == 1 / 3
+
+def test_agent_cache_bounded():
+    cache = AgentCache(max_size=2)
+    for key in ["a", "b", "c"]:
+        cache.release(key, agno_agent.Agent())
+    # the least recently used key went first
+    assert cache.size == 2 and list(cache.idle) == ["b", "c"]
+
+def test_agent_cache_hedge_losers():
+    cache = AgentCache(max_size=4)
+    AgnoAgent.set_agent_cache(cache)
+    try:
+        assert [f.name for f in fields(AgnoAgent)] == ["id"]
+        node = AgnoAgent(id=1, node_attr=NodeAttr(name="test", prompt="test", profile="test", model="gpt-4o", tools=[], input_formats=["text"], output_formats=["text"]))
+        key = node.cache_key("gpt-4o")
+        for _ in range(2):
+            cache.release(key, agno_agent.Agent())
+        settled = threading.Event()
+        with node.lease("gpt-4o", 0, settled) as slow:
+            with node.lease("gpt-4o", 1, settled) as fast:
+                pass
+        # the first attempt to finish goes back, the abandoned one is dropped
+        assert cache.size == 1 and cache.idle[key] == [fast] and fast is not slow
+    finally:
+        AgnoAgent.set_agent_cache(AgentCache())
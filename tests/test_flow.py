@@ -1,18 +1,73 @@
+import threading
+import os
+import sys
+import pytest
+import asyncio
+import time
+from agno.media import Image
 from mas.agent.agno import AgnoAgent
 from mas.agent.base import Agent
 from mas.agent.mock import MockAgent
 from mas.flow.agent_task_flow import AgentTaskFlow
+from mas.flow.context import ContextBuilder
+from mas.flow.events import FinalAnswer, NodeDelta, NodeFinished, NodeStarted, RunStatus
 from mas.flow.executor.pocketflow import PocketflowExecutor
 from mas.flow.executor.simple_sequential import SimpleSequentialExecutor
+from mas.flow.executor.parallel import ParallelExecutor
+from mas.flow.executor.async_parallel import AsyncParallelExecutor
+from mas.flow.executor.process import ProcessExecutor
+from mas.flow.executor.distributed import DistributedExecutor, FlowWorker
+from mas.errors.flow_error import FlowError
+from mas.flow.task_queue import LocalTaskQueue
 from mas.orch.parser import YamlParser
+from mas.memory import AsyncFlowMemory, FlowMemory
+from mas.message import MediaRef, Message
+from mas.storage import AsyncInMemoryStorage, InMemoryBlobStore, InMemoryStorage
 from mas.tool import ToolPool
 from mas.model import ModelPool
 
-def build_graph_from_yaml():
+def build_graph_from_yaml(path='tests/data/graph.1.yaml'):
     parser = YamlParser()
-    graph = parser.parse_from_path('tests/data/graph.1.yaml')
+    graph = parser.parse_from_path(path)
     return graph
 
+class SlowMockAgent(MockAgent):
+    ''' done tells whether a call got through, an abandoned or cancelled one may not '''
+    def __init__(self, id, node_attr):
+        super().__init__(id, node_attr)
+        self.done = False
+
+    def run_messages(self, messages):
+        time.sleep(0.2)
+        self.done = True
+        return super().run_messages(messages)
+
+    async def arun_messages(self, messages):
+        await asyncio.sleep(0.2)
+        self.done = True
+        return super().run_messages(messages)
+
+    async def arun_messages_stream(self, messages):
+        yield await self.arun_messages(messages)
+
+def ran_concurrently(events, node_ids):
+    ''' every node in node_ids started before any of them finished '''
+    started = [i for i, e in enumerate(events) if isinstance(e, NodeStarted) and e.node_id in node_ids]
+    finished = [i for i, e in enumerate(events) if isinstance(e, NodeFinished) and e.node_id in node_ids]
+    return len(started) == len(node_ids) and max(started) < min(finished)
+
+class HangingMockAgent(SlowMockAgent):
+    ''' node 3 hangs, e.g. on a tool fetching an unresponsive website '''
+    def run_messages(self, messages):
+        if self.id == 3:
+            time.sleep(2)
+        return super().run_messages(messages)
+
+    async def arun_messages(self, messages):
+        if self.id == 3:
+            await asyncio.sleep(2)
+        return await super().arun_messages(messages)
+
 def test_SimpleSequentialFlow():
     flow = AgentTaskFlow(
         cls_Agent=MockAgent,
@@ -31,4 +86,444 @@ def test_PocketFlowChainFlow():
         executor=PocketflowExecutor()
     )
     flow.build(build_graph_from_yaml())
-    flow.run()
\ No newline at end of file
+    flow.run()
+
+def test_ParallelFlow():
+    chain_flow = AgentTaskFlow(
+        cls_Agent=MockAgent,
+        executor=PocketflowExecutor(),
+    )
+    chain_flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    expected = chain_flow.run()
+
+    flow = AgentTaskFlow(
+        cls_Agent=MockAgent,
+        executor=ParallelExecutor(),
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    assert flow.run() == expected
+    assert flow.executor.get_execution_order_str() == "1->2|3->4"
+
+class BarrierMockAgent(MockAgent):
+    ''' root nodes wait for each other, then all post at once '''
+    def __init__(self, id, node_attr, barrier=None):
+        super().__init__(id, node_attr)
+        self.barrier = barrier
+
+    def run_messages(self, messages):
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        return super().run_messages(messages)
+
+def test_ParallelFlowConcurrentRoots():
+    graph = build_graph_from_yaml('tests/data/graph.2.yaml')
+    roots = list(range(5, 13))
+    for node_id in roots:
+        graph.add_node_typed(node_id, graph.get_node_attr(1))
+        graph.add_edge(node_id, 4)
+    flow = AgentTaskFlow(cls_Agent=BarrierMockAgent, executor=ParallelExecutor(max_workers=len(roots) + 1))
+    flow.build(graph)
+    barrier = threading.Barrier(len(roots) + 1)
+    for node_id in roots + [1]:
+        graph.nodes[node_id]["agent"].barrier = barrier
+    # switch threads often, so the first writes of a run interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for _ in range(50):
+            flow.run()
+            memory = flow.memory.for_run(flow.run_id)
+            assert sorted(e["caller"] for e in memory.get_entries_by_callee(4, mask=["caller"])) == [2, 3] + roots
+            assert set(memory.get_node_records()) == set(graph.nodes)
+    finally:
+        sys.setswitchinterval(interval)
+
+def test_ParallelFlowCriticalPath():
+    flow = AgentTaskFlow(
+        cls_Agent=SlowMockAgent,
+        executor=ParallelExecutor(),
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    events = list(flow.run_stream())
+    # 3 levels on the critical path instead of 4 sequential calls
+    assert ran_concurrently(events, {2, 3})
+    assert isinstance(events[-1], FinalAnswer) and events[-1].status == RunStatus.COMPLETED
+
+def test_AsyncParallelFlow():
+    chain_flow = AgentTaskFlow(
+        cls_Agent=MockAgent,
+        executor=PocketflowExecutor(),
+    )
+    chain_flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    expected = chain_flow.run()
+
+    flow = AgentTaskFlow(
+        cls_Agent=SlowMockAgent,
+        executor=AsyncParallelExecutor(),
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    response = asyncio.run(flow.arun())
+    assert response == expected
+
+    async def collect():
+        return [event async for event in flow.arun_stream()]
+
+    # independent branches run as concurrent tasks
+    assert ran_concurrently(asyncio.run(collect()), {2, 3})
+
+def test_ParallelFlowStream():
+    flow = AgentTaskFlow(
+        cls_Agent=MockAgent,
+        executor=ParallelExecutor(),
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    events = list(flow.run_stream())
+
+    assert isinstance(events[0], NodeStarted) and events[0].node_id == 1
+    assert isinstance(events[-1], FinalAnswer)
+    finished = {e.node_id: e.message for e in events if isinstance(e, NodeFinished)}
+    assert set(finished) == {1, 2, 3, 4}
+    for node_id, message in finished.items():
+        deltas = [e.delta for e in events if isinstance(e, NodeDelta) and e.node_id == node_id]
+        assert "".join(deltas) == message.content
+    assert events[-1].message == finished[4]
+
+def test_AsyncParallelFlowStreamCancel():
+    flow = AgentTaskFlow(
+        cls_Agent=SlowMockAgent,
+        executor=AsyncParallelExecutor(),
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+
+    async def first_finished():
+        stream = flow.arun_stream()
+        async for event in stream:
+            if isinstance(event, NodeFinished):
+                await stream.aclose()
+                # longer than a node call, the cancelled ones would have finished by now
+                await asyncio.sleep(0.5)
+                return event
+
+    event = asyncio.run(first_finished())
+    assert event.node_id == 1
+    assert [n for n in flow.graph.nodes if flow.graph.nodes[n]["agent"].done] == [1]
+
+class FlakyMockAgent(MockAgent):
+    ''' crashes while fail is set, counts its calls '''
+    def __init__(self, id, node_attr):
+        super().__init__(id, node_attr)
+        self.fail = False
+        self.calls = 0
+
+    def run_messages(self, messages):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError(f"Agent[id={self.id}] crashed")
+        return super().run_messages(messages)
+
+def called_nodes(flow):
+    ''' nodes whose agent ran since the flow was built, reset every call '''
+    called = sorted(node_id for node_id, agent in flow.graph.nodes(data="agent") if agent.calls)
+    for _, agent in flow.graph.nodes(data="agent"):
+        agent.calls = 0
+    return called
+
+def test_ResumeFlow():
+    flow = AgentTaskFlow(
+        cls_Agent=FlakyMockAgent,
+        executor=PocketflowExecutor(),
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    flow.graph.nodes[3]["agent"].fail = True
+    with pytest.raises(RuntimeError):
+        flow.run()
+    run_id = flow.run_id
+    assert set(flow.memory.for_run(run_id).get_node_records()) == {1, 2}
+
+    resumed = AgentTaskFlow(
+        cls_Agent=FlakyMockAgent,
+        executor=ParallelExecutor(),
+        memory=flow.memory,
+    )
+    response = resumed.resume(run_id)
+    assert called_nodes(resumed) == [3, 4]
+    assert resumed.run_id == run_id
+
+    chain_flow = AgentTaskFlow(
+        cls_Agent=MockAgent,
+        executor=PocketflowExecutor(),
+    )
+    chain_flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    assert response == chain_flow.run()
+
+def test_IncrementalFlow():
+    flow = AgentTaskFlow(
+        cls_Agent=FlakyMockAgent,
+        executor=ParallelExecutor(),
+        memory=FlowMemory(storage=InMemoryStorage()),
+        incremental=True,
+    )
+    graph = build_graph_from_yaml('tests/data/graph.2.yaml')
+    flow.build(graph)
+    flow.run()
+    assert called_nodes(flow) == [1, 2, 3, 4]
+
+    flow.run()
+    assert called_nodes(flow) == []
+
+    # editing node 3 only re-runs it and its descendants
+    graph.nodes[3]["prompt"] = "Answer the second research question in one sentence."
+    flow.build(graph)
+    response = flow.run()
+    assert called_nodes(flow) == [3, 4]
+    assert "one sentence" in response.content
+
+class PidMockAgent(MockAgent):
+    def run_messages(self, messages):
+        response = super().run_messages(messages)
+        response.content = f"{os.getpid()}|{response.content}"
+        return response
+
+def test_ProcessFlow():
+    executor = ProcessExecutor(max_processes=2, worker_initializer=None)
+    flow = AgentTaskFlow(
+        cls_Agent=PidMockAgent,
+        executor=executor,
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    try:
+        response = flow.run()
+    finally:
+        executor.close()
+    pid, _ = response.content.split("|", 1)
+    assert int(pid) != os.getpid()
+
+def test_DistributedFlow():
+    storage = InMemoryStorage()
+    task_queue = LocalTaskQueue()
+    stop = threading.Event()
+    workers = [threading.Thread(target=FlowWorker(task_queue, storage).run_forever, args=(stop, 0.1)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+
+    chain_flow = AgentTaskFlow(
+        cls_Agent=MockAgent,
+        executor=PocketflowExecutor(),
+    )
+    chain_flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+
+    flow = AgentTaskFlow(
+        cls_Agent=MockAgent,
+        executor=DistributedExecutor(task_queue=task_queue, result_timeout=5),
+        memory=FlowMemory(storage=storage),
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    try:
+        assert flow.run() == chain_flow.run()
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+    # a late result, e.g. from a worker of a timed out run, doesn't bring the closed run back
+    task_queue.put_result(flow.run_id, {"node_id": 1})
+    assert flow.run_id not in task_queue.results
+
+def test_DistributedFlowClosedRun():
+    fakeredis = pytest.importorskip("fakeredis")
+    from mas.flow.task_queue import RedisTaskQueue
+
+    storage = InMemoryStorage()
+    for task_queue in [LocalTaskQueue(), RedisTaskQueue(client=fakeredis.FakeRedis())]:
+        flow = AgentTaskFlow(cls_Agent=MockAgent, executor=DistributedExecutor(task_queue=task_queue, result_timeout=0.1), memory=FlowMemory(storage=storage))
+        flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+        # no worker: the run gives up and closes, its task stays queued
+        with pytest.raises(FlowError):
+            flow.run()
+        task = task_queue.get_task(timeout=0.1)
+        assert task["run_id"] == flow.run_id and not task_queue.is_open(flow.run_id)
+        # a worker picking it up later skips it, a late result is dropped
+        FlowWorker(task_queue, storage).run_task(task)
+        task_queue.put_result(flow.run_id, {"node_id": task["node_id"]})
+        assert flow.memory.for_run(flow.run_id).get_node_record(task["node_id"]) is None
+        if isinstance(task_queue, RedisTaskQueue):
+            assert task_queue.r.keys() == []
+        else:
+            assert flow.run_id not in task_queue.results
+
+def test_ParallelFlowNodeTimeout():
+    for executor in [ParallelExecutor(node_timeout=0.5), AsyncParallelExecutor(node_timeout=0.5)]:
+        flow = AgentTaskFlow(
+            cls_Agent=HangingMockAgent,
+            executor=executor,
+            memory=FlowMemory(storage=InMemoryStorage()),
+        )
+        flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+        result = flow.run_result()
+        # the run did not wait for the hanging call
+        assert not flow.graph.nodes[3]["agent"].done
+        # 3 timed out, 4 depends on it, 2 is the furthest finished node
+        assert result.status == RunStatus.PARTIAL
+        assert result.timed_out == [3] and result.skipped == [4]
+        memory = flow.memory.for_run(flow.run_id)
+        assert result.message == memory.get_node_record(2)["caller_output_message"]
+        # the abandoned call finishes in the background, but its node stays unfinished for resume
+        time.sleep(2)
+        assert memory.get_node_record(3) is None
+    # the chain executor has no timeouts, it says so
+    with pytest.raises(ValueError):
+        PocketflowExecutor(node_timeout=0.5)
+
+def test_ParallelFlowDeadline():
+    flow = AgentTaskFlow(
+        cls_Agent=SlowMockAgent,
+        executor=ParallelExecutor(run_timeout=0.3),
+        memory=FlowMemory(storage=InMemoryStorage()),
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    events = list(flow.run_stream())
+    assert isinstance(events[-1], FinalAnswer)
+    assert events[-1].status == RunStatus.DEADLINE_EXCEEDED
+    assert events[-1].timed_out == [2, 3] and events[-1].skipped == [4]
+    assert "Agent[id=1]" in events[-1].message.content
+
+def test_AsyncParallelFlowAsyncMemory():
+    chain_flow = AgentTaskFlow(
+        cls_Agent=MockAgent,
+        executor=PocketflowExecutor(),
+    )
+    chain_flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    expected = chain_flow.run()
+
+    flow = AgentTaskFlow(
+        cls_Agent=MockAgent,
+        executor=AsyncParallelExecutor(),
+        memory=AsyncFlowMemory(storage=AsyncInMemoryStorage()),
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    assert asyncio.run(flow.arun()) == expected
+    # every node is checkpointed, resuming re-runs nothing
+    assert asyncio.run(flow.aresume(flow.run_id)) == expected
+
+def test_ParallelFlowBlobs():
+    graph = build_graph_from_yaml('tests/data/graph.2.yaml')
+    plain = AgentTaskFlow(cls_Agent=MockAgent, executor=ParallelExecutor())
+    plain.build(graph)
+    blobs = InMemoryBlobStore()
+    flow = AgentTaskFlow(
+        cls_Agent=MockAgent,
+        executor=ParallelExecutor(),
+        memory=FlowMemory(storage=InMemoryStorage(), blobs=blobs, blob_threshold=0),
+    )
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    assert flow.run() == plain.run()
+    assert len(blobs.blobs) > 0
+
+def test_ParallelFlowContextBudget():
+    context = ContextBuilder(budget=200)
+    flow = AgentTaskFlow(cls_Agent=MockAgent, executor=ParallelExecutor(context=context))
+    flow.build(build_graph_from_yaml('tests/data/graph.2.yaml'))
+    flow.run()
+    # the writer gets both researcher outputs, each quoting the planner's, cut to its budget
+    stats = context.stats[4]
+    assert stats.tokens_before > 200 >= stats.tokens_after
+    assert sorted(stats.reduced) == [2, 3]
+    assert context.stats[1].tokens_before == context.stats[1].tokens_after
+
+    prompt = "Summarize the latency results."
+    text = "Intro about the project.\n\nThe latency results: p50 is 12ms, p99 is 80ms.\n\n" + "Unrelated filler. " * 100
+    preds = [(1, {"caller_user_prompt": "Measure it.", "caller_output_message": Message(role="assistant", content=text)})]
+    extracted = ContextBuilder(budget=25, strategy="extract").build(5, prompt, preds)[1].content
+    assert extracted == "The latency results: p50 is 12ms, p99 is 80ms."
+
+class SerialMockAgent(SlowMockAgent):
+    ''' a summarizer that notices being called from two threads at once '''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.running = 0
+        self.overlapped = False
+
+    def run_messages(self, messages):
+        self.running += 1
+        self.overlapped |= self.running > 1
+        try:
+            return super().run_messages(messages)
+        finally:
+            self.running -= 1
+
+def test_ContextSummarizerSerialized():
+    graph = build_graph_from_yaml('tests/data/graph.2.yaml')
+    summarizer = SerialMockAgent(id=0, node_attr=graph.get_node_attr(1))
+    context = ContextBuilder(budget=200, strategy="summarize", summarizer=summarizer)
+    # sibling nodes reducing different outputs at once, as in parallel prep
+    threads = [threading.Thread(target=context.summarize, args=(f"output {i} " * 100, 50)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(context.summaries) == 4
+    assert not summarizer.overlapped
+
+class CachingMockAgent(MockAgent):
+    ''' reports half of its input as served from the prompt cache, keeps the messages it got '''
+    def __init__(self, id, node_attr):
+        super().__init__(id, node_attr)
+        self.received = None
+
+    def run_messages(self, messages):
+        self.received = messages
+        message = super().run_messages(messages)
+        return message.model_copy(update={"usage": {"input_tokens": 100, "output_tokens": 10, "cached_tokens": 50}})
+
+def test_ParallelFlowContextLayout():
+    graph = build_graph_from_yaml('tests/data/graph.2.yaml')
+    # re-added edges come last in graph.predecessors, the layout must not depend on it
+    graph.remove_edge(2, 4)
+    graph.add_edge(3, 4)
+    graph.add_edge(2, 4)
+    assert list(graph.predecessors(4)) == [3, 2]
+
+    context = ContextBuilder()
+    flow = AgentTaskFlow(cls_Agent=CachingMockAgent, executor=ParallelExecutor(context=context))
+    flow.build(graph)
+    flow.run()
+    prompts = [m.content for m in graph.nodes[4]["agent"].received if m.role == "user"]
+    assert prompts == [graph.nodes[2]["prompt"], graph.nodes[3]["prompt"], graph.nodes[4]["prompt"]]
+    assert context.stats[4].cached_tokens == 50
+    assert context.cache_hit_rate() == 0.5
+
+class MediaMockAgent(MockAgent):
+    ''' the first node outputs an image, by reference to a blob in its blob store '''
+    def __init__(self, id, node_attr):
+        super().__init__(id, node_attr)
+        self.blobs = None
+        self.received = None
+
+    def run_messages(self, messages):
+        self.received = messages
+        message = super().run_messages(messages)
+        if self.id == 1:
+            message = message.model_copy(update={"images": [MediaRef.from_bytes(self.blobs, "image", b"\x89PNG", format="png")]})
+        return message
+
+def test_ParallelFlowLazyMedia():
+    graph = build_graph_from_yaml('tests/data/graph.2.yaml')
+    graph.nodes[2]["input_formats"] = ["text", "image"]
+    blobs = InMemoryBlobStore()
+    flow = AgentTaskFlow(
+        cls_Agent=MediaMockAgent,
+        executor=ParallelExecutor(),
+        memory=FlowMemory(storage=InMemoryStorage(), blobs=blobs),
+    )
+    flow.build(graph)
+    graph.nodes[1]["agent"].blobs = blobs
+    flow.run()
+    # entries only carry the reference
+    entry = flow.memory.for_run(flow.run_id).get_data(1, 3, "default")
+    assert isinstance(entry["caller_output_message"].images[0], MediaRef)
+    # loaded for the agent taking images, dropped for the text only one
+    assert graph.nodes[2]["agent"].received[1].images[0].content == b"\x89PNG"
+    assert graph.nodes[3]["agent"].received[1].images is None
+    # media already loaded in a message is passed on as it was, whatever the agent takes
+    image = Image(content=b"\x89PNG", format="png")
+    message = Message(role="assistant", images=[image, MediaRef(kind="image", url="http://example.com/chart.png")])
+    assert message.materialize(["text"]).images == [image]
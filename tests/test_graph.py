@@ -22,3 +22,11 @@ def test_add_node_edge():
     assert graph.nodes[2] == asdict(node_b)
     assert graph.edges[1, 2] == {}
     assert graph.edges[1, 3] == asdict(edge_attr)
+
+def test_to_from_dict():
+    from mas.orch.parser import YamlParser
+    graph = YamlParser().parse_from_path('tests/data/graph.2.yaml')
+    graph.nodes[1]["agent"] = object()  # runtime attributes are not serialized
+    restored = AgentTaskGraph.from_dict(graph.to_dict())
+    assert restored.to_dict() == graph.to_dict()
+    assert list(restored.edges()) == list(graph.edges())
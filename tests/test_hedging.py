@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from mas.agent.hedging import HedgingPolicy, LatencyTracker
+
+def warm_policy(**kwargs) -> HedgingPolicy:
+    policy = HedgingPolicy(min_samples=10, budget=0.5, alternates={"slow-model": ["fast-model"]}, **kwargs)
+    for _ in range(10):
+        policy.tracker.record("slow-model", 0.05)
+        policy.calls["slow-model"] += 1
+    return policy
+
+def test_latency_tracker():
+    tracker = LatencyTracker(window=10)
+    for i in range(20):
+        tracker.record("gpt-4o", float(i))
+    # only the last 10 calls count
+    assert tracker.count("gpt-4o") == 10
+    assert tracker.percentile("gpt-4o", 0.5) == 15.0
+    assert tracker.percentile("unknown", 0.5) is None
+
+def test_hedging_run():
+    policy = warm_policy()
+
+    finished = []
+
+    def call(model, attempt):
+        time.sleep(1 if model == "slow-model" else 0.01)
+        finished.append(model)
+        return model
+
+    assert policy.run("slow-model", call) == "fast-model"
+    # the hedge answered, the slow call was not waited for
+    assert finished == ["fast-model"]
+    assert policy.hedges["slow-model"] == 1
+
+def test_hedging_budget():
+    policy = warm_policy()
+    policy.hedges["slow-model"] = 100
+
+    def call(model, attempt):
+        time.sleep(0.2 if model == "slow-model" else 0.01)
+        return model
+
+    # over budget, the slow call is waited for
+    assert policy.run("slow-model", call) == "slow-model"
+
+def test_hedging_arun_failover():
+    policy = HedgingPolicy(alternates={"slow-model": ["fast-model"]})
+
+    async def call(model, attempt):
+        if model == "slow-model":
+            raise ConnectionError("provider down")
+        return model
+
+    assert asyncio.run(policy.arun("slow-model", call)) == "fast-model"
+
+    async def always_fails(model, attempt):
+        raise ConnectionError("provider down")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(policy.arun("slow-model", always_fails))
+
+def test_hedging_arun_cancels_loser():
+    policy = warm_policy()
+    cancelled = []
+
+    async def call(model, attempt):
+        try:
+            await asyncio.sleep(1 if model == "slow-model" else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return model
+
+    async def main():
+        result = await policy.arun("slow-model", call)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "fast-model"
+    assert cancelled == ["slow-model"]
+
+def test_hedging_run_inline_and_close():
+    policy = HedgingPolicy(alternates={"slow-model": ["fast-model"]})
+    threads = []
+
+    def call(model, attempt):
+        threads.append(threading.current_thread())
+        if model == "slow-model":
+            raise ConnectionError("provider down")
+        return model
+
+    # too few samples to hedge: the call and its failover run on the caller's thread, no pool is made
+    assert policy.run("slow-model", call) == "fast-model"
+    assert threads == [threading.current_thread()] * 2 and policy.pool is None
+
+    policy = warm_policy(max_abandoned=1)
+
+    def slow(model, attempt):
+        time.sleep(0.5 if model == "slow-model" else 0.01)
+        return model
+
+    assert policy.run("slow-model", slow) == "fast-model"
+    # the loser still holds a worker, the next call is not hedged
+    assert policy.abandoned == 1 and not policy.can_hedge("slow-model")
+    time.sleep(1.5)
+    assert policy.abandoned == 0
+    policy.close()
+    assert policy.pool is None
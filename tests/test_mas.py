@@ -0,0 +1,81 @@
+import time
+from mas.mas import MasFactory
+from mas.orch import MockOrch
+from mas.curator import ModelCurator, ToolCurator
+from mas.flow import PocketflowExecutor
+from mas.agent import MockAgent
+from mas.flow import AgentTaskFlow
+
+class SlowMockOrch(MockOrch):
+    def generate_by_message(self, user_message, historical_messages):
+        time.sleep(0.2)
+        return super().generate_by_message(user_message, historical_messages)
+
+class SlowMockAgent(MockAgent):
+    def run_messages(self, messages):
+        time.sleep(0.2)
+        return super().run_messages(messages)
+
+def build_mas(cls_Orch=MockOrch, cls_Agent=MockAgent):
+    mas = MasFactory(
+        cls_Orch=cls_Orch,
+        cls_Executor=PocketflowExecutor,
+        cls_Agent=cls_Agent,
+        cls_Curators=[ModelCurator, ToolCurator],
+    )
+    mas.build()
+    return mas
+
+def test_run_many():
+    mas = build_mas()
+    queries = ["Write a story", "Write a poem", "Write a song"]
+    results = dict(mas.run_many(queries, max_concurrency=2))
+    assert sorted(results) == [0, 1, 2]
+    assert results[0] == mas.run(queries[0])
+
+def test_run_many_pipelined(monkeypatch):
+    mas = build_mas(SlowMockOrch, SlowMockAgent)
+    spans = {"orch": [], "agent": []}
+
+    def timed(kind, method):
+        def wrapper(self, *args, **kwargs):
+            start = time.monotonic()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                spans[kind].append((start, time.monotonic()))
+        return wrapper
+
+    monkeypatch.setattr(SlowMockOrch, "generate_by_message", timed("orch", SlowMockOrch.generate_by_message))
+    monkeypatch.setattr(SlowMockAgent, "run_messages", timed("agent", SlowMockAgent.run_messages))
+    results = list(mas.run_many(["q1", "q2", "q3"], max_concurrency=3, orch_concurrency=1))
+    assert len(results) == 3
+    # a query is orchestrated while an earlier one executes, serially they never overlap
+    assert any(o_start < a_end and a_start < o_end for o_start, o_end in spans["orch"] for a_start, a_end in spans["agent"])
+
+def test_run_arun_curate_once():
+    import asyncio
+    mas = build_mas()
+    calls = []
+    curate = mas.curate
+    mas.curate = lambda graph: calls.append(graph) or curate(graph)
+    message = mas.run("Write a story")
+    assert len(calls) == 1
+    assert asyncio.run(mas.arun("Write a story")) == message
+    assert len(calls) == 2
+
+def test_run_many_keeps_flow_settings(monkeypatch):
+    mas = build_mas()
+    mas.flow.incremental = True
+    mas.flow.executor.node_timeout = 30
+    flows = []
+    run = AgentTaskFlow.run
+    monkeypatch.setattr(AgentTaskFlow, "run", lambda self, *args, **kwargs: flows.append(self) or run(self, *args, **kwargs))
+    results = dict(mas.run_many(["Write a story", "Write a poem"], max_concurrency=2))
+    assert sorted(results) == [0, 1]
+    assert len(flows) == 2 and flows[0] is not flows[1]
+    for flow in flows:
+        assert flow.incremental and flow.memory is mas.flow.memory
+        assert flow.executor is not mas.flow.executor and flow.executor.node_timeout == 30
+    assert flows[0].executor is not flows[1].executor
+    assert mas.flow.graph is None and mas.flow.run_id is None
@@ -1,3 +1,4 @@
+from mas.graph import AgentTaskGraph
 from mas.memory.memory import FlowMemory
 from mas.storage.mem import InMemoryStorage
 
@@ -7,4 +8,310 @@ def test_memory_inmemory():
     memory.add_entry(caller=2, callee=3, action="action2", data={"y": 2})
     assert memory.get_entries_by_caller(1, mask=["callee", "action"]) == [{"callee": 2, "action": "action1"}]
     assert memory.get_entries_by_callee(2, mask=["caller", "action"]) == [{"caller": 1, "action": "action1"}]
-    assert memory.get_data(1, 2, "action1") == {"x": 1}
\ No newline at end of file
+    assert memory.get_data(1, 2, "action1") == {"x": 1}
+
+def test_memory_inmemory_concurrent_writes():
+    import sys
+    import threading
+    storage = InMemoryStorage()
+    # the first writes to a run from several threads at once, as root nodes post on a parallel executor
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for trial in range(200):
+            memory = FlowMemory(storage=storage)
+            barrier = threading.Barrier(8)
+
+            def post(caller):
+                barrier.wait()
+                memory.add_node_output(caller, [99], "default", {"caller": caller})
+
+            threads = [threading.Thread(target=post, args=(caller,)) for caller in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert sorted(e["caller"] for e in memory.get_entries_by_callee(99, mask=["caller"])) == list(range(8))
+            assert sorted(memory.get_node_records()) == list(range(8))
+    finally:
+        sys.setswitchinterval(interval)
+
+def test_memory_sqlite_records(tmp_path):
+    from mas.message import Message
+    from mas.storage.sqlite import SqliteStorage
+
+    memory = FlowMemory(storage=SqliteStorage(db_file=str(tmp_path / "flow.db")))
+    message = Message(role="assistant", content="done")
+    memory.add_entry(caller=1, callee=2, action="default", data={"caller_output_message": message})
+    memory.add_node_record(1, {"caller_output_message": message})
+
+    resumed = memory.for_run(memory.run_id)
+    assert resumed.get_data(1, 2, "default") == {"caller_output_message": message}
+    assert resumed.get_node_record(1) == {"caller_output_message": message}
+    assert resumed.get_node_record(2) is None
+    assert memory.for_run().get_node_records() == {}
+
+def test_memory_redis_bulk():
+    import pytest
+    fakeredis = pytest.importorskip("fakeredis")
+    from mas.message import Message
+    from mas.storage.redis import RedisStorage
+
+    client = fakeredis.FakeRedis()
+    commands = []
+    execute_command = client.execute_command
+    client.execute_command = lambda *args, **kwargs: commands.append(args[0]) or execute_command(*args, **kwargs)
+
+    memory = FlowMemory(storage=RedisStorage(client=client))
+    message = Message(role="assistant", content="done")
+    memory.add_node_output(1, [2, 3, 4], "default", {"caller_output_message": message}, node_hash="abc")
+    # one pipeline round-trip for all entries and the record
+    assert commands == []
+
+    assert [e["callee"] for e in memory.get_entries_by_caller(1)] == [2, 3, 4]
+    assert commands == ["ZRANGE", "MGET"]
+    # the entry ids carry every field but data, no entry is read
+    commands.clear()
+    assert memory.get_entries_by_caller(1, mask=["callee", "action"]) == [{"callee": c, "action": "default"} for c in (2, 3, 4)]
+    assert commands == ["ZRANGE"]
+    assert memory.get_data(1, 3, "default") == {"caller_output_message": message}
+    assert memory.get_node_record(1) == {"caller_output_message": message}
+    assert memory.get_node_record_by_hash("abc") == {"caller_output_message": message}
+
+    # colons in actions and tz-aware timestamps survive the round trip through the ids
+    storage = memory.storage
+    entry = {"run_id": memory.run_id, "caller": 5, "callee": 6, "action": "tool:call", "timestamp": "2026-01-02T03:04:05.000006+02:00", "data": {}}
+    storage.add_entry(entry)
+    assert storage.get_entries(memory.run_id, caller=5, fields=["callee", "action", "timestamp"]) == [{k: entry[k] for k in ("callee", "action", "timestamp")}]
+    assert memory.entries_mask(memory.get_entries(caller=5), ["action"]) == [{"action": "tool:call"}]
+
+def test_memory_async(tmp_path):
+    import asyncio
+    from mas.memory import AsyncFlowMemory
+    from mas.message import Message
+    from mas.storage import AsyncInMemoryStorage, AsyncSqliteStorage
+
+    storages = [AsyncInMemoryStorage(), AsyncSqliteStorage(db_file=str(tmp_path / "flow.db"))]
+    try:
+        from fakeredis import FakeAsyncRedis
+        from mas.storage import AsyncRedisStorage
+        storages.append(AsyncRedisStorage(client=FakeAsyncRedis()))
+    except ImportError:
+        pass
+
+    async def check(storage):
+        memory = AsyncFlowMemory(storage=storage)
+        message = Message(role="assistant", content="done")
+        await memory.add_node_output(1, [2, 3], "default", {"caller_output_message": message}, node_hash="abc")
+
+        resumed = memory.for_run(memory.run_id)
+        assert await resumed.get_entries_by_caller(1, mask=["callee"]) == [{"callee": 2}, {"callee": 3}]
+        assert await resumed.get_data(1, 3, "default") == {"caller_output_message": message}
+        assert await resumed.get_node_record(1) == {"caller_output_message": message}
+        assert await memory.for_run().get_node_record_by_hash("abc") == {"caller_output_message": message}
+        assert await memory.for_run().get_node_records() == {}
+
+    for storage in storages:
+        asyncio.run(check(storage))
+
+def test_memory_run_scope(tmp_path):
+    import time
+    from mas.storage.redis import RedisStorage
+    from mas.storage.sqlite import SqliteStorage
+
+    storages = [InMemoryStorage(ttl=0.1), SqliteStorage(db_file=str(tmp_path / "flow.db"), ttl=0.1)]
+    try:
+        import fakeredis
+        storages.append(RedisStorage(client=fakeredis.FakeRedis(), ttl=60))
+    except ImportError:
+        pass
+
+    for storage in storages:
+        run_a, run_b = FlowMemory(storage=storage), FlowMemory(storage=storage)
+        # concurrent runs of the same graph use the same node ids
+        run_a.add_entry(caller=1, callee=2, action="default", data={"run": "a"})
+        run_b.add_entry(caller=1, callee=2, action="default", data={"run": "b"})
+        run_a.add_node_record(1, {"run": "a"}, node_hash="abc")
+        assert run_a.get_data(1, 2, "default") == {"run": "a"}
+        assert run_b.get_data(1, 2, "default") == {"run": "b"}
+        assert run_b.get_entries_by_callee(2, mask=["caller"]) == [{"caller": 1}]
+
+        run_a.drop_run()
+        assert run_a.get_data(1, 2, "default") is None
+        assert run_a.get_node_record(1) is None
+        assert run_a.get_node_record_by_hash("abc") is None
+        assert run_b.get_data(1, 2, "default") == {"run": "b"}
+
+        if isinstance(storage, RedisStorage):
+            assert 0 < storage.r.ttl(f"run:{run_b.run_id}:keys") <= 60
+            continue
+        # run b expires once a later run starts after its ttl
+        time.sleep(0.2)
+        run_c = FlowMemory(storage=storage)
+        run_c.save_graph(AgentTaskGraph())
+        assert run_b.get_data(1, 2, "default") is None
+        assert run_c.load_graph() is not None
+
+def test_memory_bounded(tmp_path):
+    from mas.message import Message
+    from mas.storage.mem import BoundedInMemoryStorage
+    from mas.storage.sqlite import SqliteStorage
+
+    storage = BoundedInMemoryStorage(max_entries=4, spill=SqliteStorage(db_file=str(tmp_path / "spill.db")))
+    runs = [FlowMemory(storage=storage) for _ in range(3)]
+    for i, run in enumerate(runs):
+        run.save_graph(AgentTaskGraph())
+        run.add_entry(caller=1, callee=2, action="default", data={"caller_output_message": Message(role="assistant", content=f"run {i}")})
+        run.add_node_record(1, {"run": i}, node_hash=f"hash{i}")
+    # every run is still active, nothing can be evicted
+    assert storage.n_entries == 6 and not storage.spilled
+
+    runs[1].get_data(1, 2, "default")
+    for run in runs:
+        run.complete_run()
+    # run 0 was used least recently
+    assert storage.spilled == {runs[0].run_id}
+    assert storage.n_entries == 4
+    assert runs[0].get_data(1, 2, "default")["caller_output_message"].content == "run 0"
+    assert runs[0].get_node_record(1) == {"run": 0}
+    assert runs[0].get_node_record_by_hash("hash0") == {"run": 0}
+    assert runs[0].load_graph() is not None
+
+    runs[0].drop_run()
+    assert runs[0].get_data(1, 2, "default") is None and not storage.spilled
+    assert runs[2].get_data(1, 2, "default")["caller_output_message"].content == "run 2"
+
+    # a node record written again replaces the old one in the budget
+    runs[2].add_node_record(1, {"run": 2, "again": True})
+    assert storage.n_entries == 4
+    # a resumed run is pinned until it completes again
+    runs[1].start_run()
+    runs[3:] = [FlowMemory(storage=storage)]
+    runs[3].add_entry(caller=1, callee=2, action="default", data={"x": 3})
+    runs[3].complete_run()
+    assert storage.spilled == {runs[2].run_id}
+    runs[1].complete_run()
+    assert runs[1].run_id in storage.completed
+
+def test_memory_blobs(tmp_path):
+    from mas.message import Message
+    from mas.storage.blob import FileBlobStore, InMemoryBlobStore
+
+    blob_stores = [InMemoryBlobStore(), FileBlobStore(root=str(tmp_path / "blobs"))]
+    try:
+        import fakeredis
+        from mas.storage.blob import RedisBlobStore
+        blob_stores.append(RedisBlobStore(client=fakeredis.FakeRedis()))
+    except ImportError:
+        pass
+
+    for blobs in blob_stores:
+        storage = InMemoryStorage()
+        memory = FlowMemory(storage=storage, blobs=blobs, blob_threshold=100)
+        message = Message(role="assistant", content="long output " * 20)
+        memory.add_node_output(1, [2, 3, 4], "default", {"caller_user_prompt": "prompt", "caller_output_message": message})
+        memory.add_entry(caller=5, callee=6, action="default", data={"caller_output_message": Message(role="assistant", content="short")})
+
+        # one blob shared by the three entries and the record, small messages stay inline
+        refs = {e["data"]["caller_output_message"]["__blob__"] for callee in (2, 3, 4) for e in storage.get_entries_by_callee(memory.run_id, callee)}
+        assert len(refs) == 1
+        ref = refs.pop()
+        assert blobs.has(ref)
+        assert memory.get_data(5, 6, "default")["caller_output_message"].content == "short"
+        assert memory.resolve(memory.get_data(1, 3, "default")) == {"caller_user_prompt": "prompt", "caller_output_message": message}
+        assert memory.for_run(memory.run_id).resolve(memory.get_node_record(1))["caller_output_message"] == message
+
+        # the run's blobs go with it, others stay
+        other = memory.for_run()
+        other.add_node_record(1, {"caller_output_message": message})
+        other_ref = storage.get_node_record(other.run_id, 1)["data"]["caller_output_message"]["__blob__"]
+        memory.drop_run()
+        assert not blobs.has(ref) and blobs.has(other_ref)
+
+    # with a ttl, a run's blobs expire like its entries, once a later run writes
+    import time
+    for blobs in [InMemoryBlobStore(ttl=0.1), FileBlobStore(root=str(tmp_path / "ttl"), ttl=0.1)]:
+        old = blobs.put(b"old", run_id="a")
+        time.sleep(0.2)
+        new = blobs.put(b"new", run_id="b")
+        assert not blobs.has(old) and blobs.has(new)
+
+def test_memory_codecs(tmp_path):
+    import json
+    from agno.media import Audio, Image
+    from mas.message import Message
+    from mas.storage.codec import JsonCodec, MsgpackCodec, OrjsonCodec, decode
+    from mas.storage.sqlite import SqliteStorage
+
+    message = Message(role="user", content="describe", images=[Image(content=b"\x89PNG\xff"), Image(filepath=tmp_path / "a.png")], audios=[Audio(content=b"\x00\x01", format="wav")])
+    data = {"caller_user_prompt": "prompt", "caller_output_message": message}
+    codecs = [MsgpackCodec(), JsonCodec()]
+    try:
+        codecs.append(OrjsonCodec())
+    except ImportError:
+        pass
+    for codec in codecs:
+        decoded = decode(codec.encode(data))
+        assert decoded["caller_output_message"].images[0].content == b"\x89PNG\xff"
+        assert decoded["caller_user_prompt"] == "prompt"
+    # json written before codecs existed still reads
+    assert decode(json.dumps({"__message__": {"role": "user", "content": "old"}})) == Message(role="user", content="old")
+
+    memory = FlowMemory(storage=SqliteStorage(db_file=str(tmp_path / "flow.db"), codec=JsonCodec()))
+    memory.add_node_output(1, [2], "default", data)
+    assert memory.for_run(memory.run_id).get_data(1, 2, "default")["caller_output_message"].audios[0].content == b"\x00\x01"
+
+def test_memory_log(tmp_path):
+    import os
+    from mas.message import Message
+    from mas.storage.log import LogStorage
+
+    storage = LogStorage(root=str(tmp_path / "log"), segment_size=1024)
+    runs = [FlowMemory(storage=storage) for _ in range(3)]
+    for i, run in enumerate(runs):
+        run.save_graph(AgentTaskGraph())
+        run.add_node_output(1, [2, 3], "default", {"caller_output_message": Message(role="assistant", content=f"run {i} " * 50)}, node_hash=f"hash{i}")
+    assert len(storage.segments()) > 1
+    runs[0].drop_run()
+    assert runs[0].get_data(1, 2, "default") is None
+
+    # a torn write at the tail is cut off when the log is opened again
+    storage.close()
+    with open(storage.segment_path(storage.segments()[-1]), "ab") as f:
+        f.write(b"\x10\x00\x00\x00torn")
+    storage = LogStorage(root=str(tmp_path / "log"), segment_size=1024)
+    memory = FlowMemory(storage=storage, run_id=runs[1].run_id)
+    assert memory.get_data(1, 3, "default")["caller_output_message"].content == "run 1 " * 50
+    assert memory.get_node_record_by_hash("hash1") is not None
+    assert memory.get_node_record_by_hash("hash0") is None
+
+    size = sum(os.path.getsize(storage.segment_path(s)) for s in storage.segments())
+    storage.compact()
+    assert sum(os.path.getsize(storage.segment_path(s)) for s in storage.segments()) < size
+    assert memory.get_entries_by_caller(1, mask=["callee"]) == [{"callee": 2}, {"callee": 3}]
+    assert memory.load_graph() is not None
+
+def test_memory_entries_pushdown(tmp_path):
+    from datetime import datetime
+    from mas.storage.log import LogStorage
+    from mas.storage.redis import RedisStorage
+    from mas.storage.sqlite import SqliteStorage
+
+    storages = [InMemoryStorage(), SqliteStorage(db_file=str(tmp_path / "flow.db")), LogStorage(root=str(tmp_path / "log"))]
+    try:
+        import fakeredis
+        storages.append(RedisStorage(client=fakeredis.FakeRedis()))
+    except ImportError:
+        pass
+
+    for storage in storages:
+        memory = FlowMemory(storage=storage)
+        memory.add_entry(caller=1, callee=2, action="default", data={"x": 1})
+        middle = datetime.utcnow().isoformat()
+        memory.add_entry(caller=1, callee=2, action="reject", data={"x": 2})
+        memory.add_entry(caller=1, callee=3, action="default", data={"x": 3})
+
+        assert memory.get_entries(caller=1, callee=2, mask=["action"]) == [{"action": "default"}, {"action": "reject"}]
+        assert memory.get_entries(caller=1, action="default", mask=["callee", "data"]) == [{"callee": 2, "data": {"x": 1}}, {"callee": 3, "data": {"x": 3}}]
+        assert [e["data"] for e in memory.get_entries(callee=2, since=middle)] == [{"x": 2}]
+        assert memory.get_entries(callee=3, until=middle) == []
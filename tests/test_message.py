@@ -7,4 +7,32 @@ def test_message():
     m2 = Message(role="assistant", content="This is a sample test case.")
 
     # print(json.dumps([x.to_dict() for x in [m1,m2]], indent=2))
-    pprint_messages([m1,m2])
\ No newline at end of file
+    pprint_messages([m1,m2])
+
+def test_message_lazy_logging(tmp_path):
+    import logging
+    from mas.utils.log import LazyJson, disable_full_dump, enable_full_dump
+
+    calls = []
+    lazy = LazyJson(lambda: calls.append(1) or {"content": "x" * 100}, max_chars=20)
+    logging.getLogger("mas.message.message").debug("%s", lazy)
+    # the level is disabled, nothing was serialized
+    assert calls == []
+    assert str(lazy).startswith('{\n  "content": "xxx') and "more chars" in str(lazy)
+
+    records = []
+    handler = logging.Handler()
+    handler.emit = lambda record: records.append(record.getMessage())
+    message_logger = logging.getLogger("mas.message.message")
+    message_logger.addHandler(handler)
+    message_logger.setLevel(logging.INFO)
+    dump = enable_full_dump(str(tmp_path / "dump.log"))
+    try:
+        pprint_messages([Message(role="assistant", content="y" * 5000)])
+    finally:
+        message_logger.removeHandler(handler)
+        message_logger.setLevel(logging.NOTSET)
+        disable_full_dump(dump)
+    # a capped preview in the log, the whole message in the dump
+    assert len(records) == 1 and len(records[0]) < 1200
+    assert "y" * 5000 in (tmp_path / "dump.log").read_text()
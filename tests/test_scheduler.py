@@ -0,0 +1,38 @@
+from mas.flow.scheduler import CriticalPathScheduler, Scheduler
+from mas.graph import AgentTaskGraph, EdgeAttr, NodeAttr
+
+def build_graph(models):
+    ''' 1 -> 2 -> 5, 1 -> 3 -> 4 -> 5 '''
+    nodes = [
+        (node_id, NodeAttr(name=f"A{node_id}", prompt="task", profile="profile", model=model, input_formats=["text"], output_formats=["text"]))
+        for node_id, model in models.items()
+    ]
+    edges = [(fr, to, EdgeAttr()) for fr, to in [(1, 2), (1, 3), (2, 5), (3, 4), (4, 5)]]
+    return AgentTaskGraph(nodes=nodes, edges=edges)
+
+def test_critical_path_first():
+    graph = build_graph({1: "m", 2: "m", 3: "m", 4: "m", 5: "m"})
+    schedule = CriticalPathScheduler(concurrency_limits={}).start(graph)
+    assert schedule.pop_ready() == [1]
+    schedule.complete(1)
+    # 3 heads the longer branch
+    assert schedule.pop_ready(slots=1) == [3]
+    assert schedule.pop_ready() == [2]
+
+def test_latency_weighted():
+    graph = build_graph({1: "m", 2: "slow", 3: "m", 4: "m", 5: "m"})
+    scheduler = CriticalPathScheduler(concurrency_limits={}, latency_estimates={"slow": 10.0})
+    schedule = scheduler.start(graph)
+    schedule.pop_ready()
+    schedule.complete(1)
+    assert schedule.pop_ready() == [2, 3]
+
+def test_concurrency_limits():
+    graph = build_graph({1: "m", 2: "capped", 3: "capped", 4: "m", 5: "m"})
+    schedule = Scheduler(concurrency_limits={"capped": 1}).start(graph)
+    schedule.pop_ready()
+    schedule.complete(1)
+    assert schedule.pop_ready() == [2]
+    assert schedule.pop_ready() == []
+    schedule.complete(2)
+    assert schedule.pop_ready() == [3]